@@ -1,11 +1,35 @@
-from neuron import h, gui
+# NEURON is imported when the first model is built, so headless workers can import this module
+# without NEURON or its GUI; call gui() to open the GUI explicitly
+h = None
+
+def load_neuron():
+    '''imports NEURON once and returns its hoc interpreter'''
+    global h
+    if h is None:
+        from neuron import h as hoc
+        h = hoc
+    return h
+
+def gui():
+    '''starts the NEURON GUI, importing this module used to do it implicitly'''
+    load_neuron()
+    from neuron import gui as neuron_gui
+    return neuron_gui
 
 class HH_NEURON:
-    def __init__(self):
+    def __init__(self, gnabar = 0.12, gkbar = 0.036, gl = 0.003, el = -54.3, delay = 10, dur = 100, amp = 0.1):
+        '''
+        ball and stick cell with hodgkin huxley channels in the soma, driven by an IClamp at the soma center
+        Args:
+            gnabar, gkbar, gl (floats): soma conductances (S/cm^2)
+            el (float): leak reversal potential (mV)
+            delay, dur, amp (floats): IClamp delay (ms), duration (ms) and amplitude (nA)
+        '''
+        load_neuron()
         self.create_sections()
         #self.define_geometry()
-        self.define_biophysics()
-        self.create_stimulator()
+        self.define_biophysics(gnabar, gkbar, gl, el)
+        self.create_sim(delay, dur, amp)
        
     def create_sections(self):
         self.soma = h.Section(name = 'soma')
@@ -16,30 +40,55 @@ class HH_NEURON:
         self.dend.L = 200
         self.dend.diam = 1
         
-    def define_biophysics(self):
+    def define_biophysics(self, gnabar = 0.12, gkbar = 0.036, gl = 0.003, el = -54.3):
         for sec in self.all: 
                 sec.Ra  = 100 #axial resistance Ohm * cm
                 sec.cm = 1 #membrane capacitance micro farads/cm^2
         
         #active currents
         self.soma.insert('hh') #applying hodgkin huxley biophysical constrains
-        for seg in self.soma: 
-            
-            #S/cm^2
-            seg.hh.gnabar = 0.12 #na conductance
-            seg.hh.gkbar = 0.036 #k conductance
-            seg.hh.gl = 0.003 #leak conductance
-            
-            seg.hh.el = -54.3 #reversal potential, mV
+        self.set_biophysics(gnabar, gkbar, gl, el)
         
         #passive currrents
         self.dend.insert('pas')
         for seg in self.dend:
             seg.pas.g = 0.001
             seg.pas.e = -65
+    
+    def set_biophysics(self, gnabar = 0.12, gkbar = 0.036, gl = 0.003, el = -54.3):
+        for seg in self.soma: 
+            
+            #S/cm^2
+            seg.hh.gnabar = gnabar #na conductance
+            seg.hh.gkbar = gkbar #k conductance
+            seg.hh.gl = gl #leak conductance
+            
+            seg.hh.el = el #reversal potential, mV
             
-    def create_sim(self): 
+    def create_sim(self, delay = 10, dur = 100, amp = 0.1): 
         self.stim = h.IClamp(self.soma(0.5)) #injecting current at center of soma
-        self.stim.delay = 10 #time delay before stimulus
-        self.stim.dur = 100 #duration of stimulus TUNE THIS
-        self.stim.amp = 0.1 #amplitude TUNE THIS
\ No newline at end of file
+        self.set_stim(delay, dur, amp)
+    
+    def set_stim(self, delay = 10, dur = 100, amp = 0.1):
+        self.stim.delay = delay #time delay before stimulus
+        self.stim.dur = dur #duration of stimulus
+        self.stim.amp = amp #amplitude
+    
+    def record(self):
+        '''records time, soma voltage and stimulus current of every following run'''
+        self.t_vec = h.Vector().record(h._ref_t)
+        self.v_vec = h.Vector().record(self.soma(0.5)._ref_v)
+        self.i_vec = h.Vector().record(self.stim._ref_i)
+    
+    def run(self, tstop = 250, dt = 0.025, v_init = -65):
+        '''fixed step run, returns time, soma voltage and stimulus current as arrays'''
+        import numpy as np
+        if not hasattr(self, 't_vec'):
+            self.record()
+        h.load_file('stdrun.hoc')
+        h.dt = dt
+        h.steps_per_ms = 1.0 / dt
+        h.tstop = tstop
+        h.v_init = v_init
+        h.run()
+        return np.array(self.t_vec), np.array(self.v_vec), np.array(self.i_vec)
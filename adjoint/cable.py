@@ -0,0 +1,289 @@
+import autograd.numpy as np
+from autograd import value_and_grad
+from scipy import optimize
+from observation import obs_operator
+from eval_cache import eval_cache
+from hh_rates import get_gating
+from hh_integrators import gate_step
+
+# Multi-compartment cells without NEURON. A cell is a tree of unbranched sections (length L and diameter
+# diam in um, nseg segments, axial resistivity Ra in ohm cm, capacitance cm in uF/cm2) carrying the hh
+# and/or pas mechanisms with NEURON's parameter names and units, with each child section attached to a
+# point of its parent like sec.connect(parent(x)). Every segment is one compartment at its center.
+# Stepping follows NEURON's fixed step method: the voltage of all compartments advances by backward euler,
+# a tree shaped linear system solved in O(compartments) by the Hines algorithm, then the gates take an
+# exponential (cnexp) step at the new voltage. The rates are those of hh.mod at NEURON's default celsius
+# of 6.3 degC, i.e. the hh_rates kinetics shared with stim_adj and param_adj.
+#
+# Stimuli, parameters and initial voltage may carry a leading batch axis of K cells, so a whole set of
+# candidates is stepped together, and the solve is written with autograd.numpy and no in-place updates,
+# so autograd differentiates simulated traces with respect to any parameter (cable_adj below).
+
+HH = {'gnabar': 0.12, 'gkbar': 0.036, 'gl': 0.0003, 'el': -54.3, 'ena': 50.0, 'ek': -77.0} #hh.mod defaults
+PAS = {'g_pas': 0.001, 'e_pas': -70.0} #pas defaults
+
+
+class section:
+    def __init__(self, name, L, diam, nseg = 1, Ra = 100.0, cm = 1.0, parent = None, parent_x = 1.0, hh = None, pas = None):
+        '''
+        Args:
+            name (str): section name, parameters are addressed as '<name>.<parameter>'
+            L, diam (float): length and diameter in um
+            nseg (int): number of segments (compartments)
+            Ra (float): axial resistivity in ohm cm
+            cm (float): membrane capacitance in uF/cm2
+            parent (str): name of the parent section, None for the root
+            parent_x (float): position along the parent the section's 0 end is attached to
+            hh (dict): inserts hh, with any of HH's keys overriding its defaults ({} for all defaults)
+            pas (dict): inserts pas, with any of PAS's keys overriding its defaults
+        '''
+        self.name = name
+        self.L = L
+        self.diam = diam
+        self.nseg = nseg
+        self.parent = parent
+        self.parent_x = parent_x
+        self.params = {'Ra': Ra, 'cm': cm}
+        self.mechanisms = []
+        if hh is not None:
+            self.params.update(dict(HH, **hh))
+            self.mechanisms.append('hh')
+        if pas is not None:
+            self.params.update(dict(PAS, **pas))
+            self.mechanisms.append('pas')
+
+
+class cell:
+    def __init__(self, sections):
+        '''
+        Args:
+            sections (list): section instances, every parent listed before its children
+        '''
+        self.sections = list(sections)
+        names = [sec.name for sec in self.sections]
+        if len(set(names)) != len(names):
+            raise ValueError('section names must be unique')
+        if self.sections[0].parent is not None or any(sec.parent is None for sec in self.sections[1:]):
+            raise ValueError('the first section must be the only one without a parent')
+        self.index = {name: i for i, name in enumerate(names)}
+
+        # compartments in Hines order, every parent has a lower index than its children
+        self.first = [] #index of the first compartment of every section
+        self.sec = [] #section of every compartment
+        self.area = [] #membrane area in um2
+        self.parent = [-1] #parent compartment, -1 for the root
+        # axial resistance to the parent in Mohm is Ra_child * r_child + Ra_parent * r_parent
+        self.r_child = [0.0]
+        self.r_parent = [0.0]
+        self.psec = [0] #section of the parent compartment
+        for s, sec in enumerate(self.sections):
+            if sec.parent is not None and self.index.get(sec.parent, s) >= s:
+                raise ValueError('parent of %s must be listed before it' % sec.name)
+            self.first.append(len(self.sec))
+            length = sec.L / sec.nseg
+            half = 1e-2 * (length / 2) / (np.pi * (sec.diam / 2)**2) #ohm cm * um / um2 -> Mohm per unit Ra
+            for k in range(sec.nseg):
+                i = len(self.sec)
+                self.sec.append(s)
+                self.area.append(np.pi * sec.diam * length)
+                if k > 0:
+                    self.parent.append(i - 1)
+                    self.r_child.append(half)
+                    self.r_parent.append(half)
+                    self.psec.append(s)
+                elif sec.parent is not None:
+                    p = self.sections[self.index[sec.parent]]
+                    j = self.compartment(p.name, sec.parent_x)
+                    # from the center of the parent segment to the attachment point
+                    center = (j - self.first[self.index[p.name]] + 0.5) / p.nseg
+                    dist = abs(sec.parent_x - center) * p.L
+                    self.parent.append(j)
+                    self.r_child.append(half)
+                    self.r_parent.append(1e-2 * dist / (np.pi * (p.diam / 2)**2))
+                    self.psec.append(self.index[p.name])
+        self.n = len(self.sec)
+        self.children = [[i for i in range(self.n) if self.parent[i] == j] for j in range(self.n)]
+
+    @classmethod
+    def ball_and_stick(cls, nseg = 1):
+        '''the soma and dendrite of NEURON_inst.HH_NEURON'''
+        return cls([section('soma', 12.6157, 12.6157, hh = {'gl': 0.003}),
+                    section('dend', 200.0, 1.0, nseg, parent = 'soma', pas = {'e_pas': -65.0})])
+
+    def compartment(self, name, x = 0.5):
+        '''index of the compartment holding position x of a section, like sec(x) in NEURON'''
+        s = self.index[name]
+        nseg = self.sections[s].nseg
+        return self.first[s] + min(int(x * nseg), nseg - 1)
+
+    def values(self, params = None):
+        '''
+        per section parameters with params taking precedence over the section defaults
+        Args:
+            params (dict): '<section>.<parameter>' -> scalar or (K,) array, e.g. {'soma.gnabar': 0.1}
+        Returns:
+            values (list): per section dict of parameter -> value
+        '''
+        values = [dict(sec.params) for sec in self.sections]
+        for key, value in (params or {}).items():
+            name, param = key.split('.', 1)
+            if name not in self.index or param not in values[self.index[name]]:
+                raise KeyError('%s is not a parameter of the cell' % key)
+            values[self.index[name]][param] = value
+        return values
+
+    def __column(self, values, param, default = 0.0):
+        # (K, n) or (1, n) array of a parameter over the compartments
+        cols = [values[s].get(param, default) * np.ones((1,)) for s in self.sec]
+        K = max(np.size(c) for c in cols)
+        return np.stack([c * np.ones(K) for c in cols], axis = 1)
+
+    def simulate(self, I, dt, site = ('soma', 0.5), v_init = -65.0, params = None, record = (('soma', 0.5),), gating = None):
+        '''
+        fixed step solve of the cell, or of K copies of it with their own stimulus, parameters or initial voltage
+        Args:
+            I (array): (N,) or (K, N) IClamp current in nA injected at site, I[:, k] acts from step k to k + 1
+            dt (float): time step in ms
+            site (tuple): (section, x) receiving the current
+            v_init (float or array): initial voltage in mV, the gates start at their steady state like finitialize
+            params (dict): '<section>.<parameter>' overrides, see values
+            record (tuple): (section, x) locations to return, None returns every compartment
+            gating (hh_rates): rate constants of the hh gates
+        Returns:
+            V_record (array): (K, N, len(record)) voltage before each step, without the K axis for unbatched inputs
+        '''
+        gating = get_gating(gating)
+        values = self.values(params)
+        batched = np.ndim(I) == 2 or any(np.ndim(v) > 0 for v in list((params or {}).values()) + [v_init])
+        I = np.atleast_2d(I)
+        area = np.array(self.area)
+        inject = np.array([1.0 if i == self.compartment(*site) else 0.0 for i in range(self.n)])
+        rec = list(range(self.n)) if record is None else [self.compartment(*r) for r in record]
+
+        # capacitance in nF and conductances in uS of every compartment
+        C = self.__column(values, 'cm') * area * 1e-5
+        g_Na = self.__column(values, 'gnabar') * area * 1e-2
+        g_K = self.__column(values, 'gkbar') * area * 1e-2
+        g_L = (self.__column(values, 'gl') + self.__column(values, 'g_pas')) * area * 1e-2
+        E_Na = self.__column(values, 'ena')
+        E_K = self.__column(values, 'ek')
+        # both leaks lumped into one conductance and reversal potential
+        gE_L = (self.__column(values, 'gl') * self.__column(values, 'el') +
+                self.__column(values, 'g_pas') * self.__column(values, 'e_pas')) * area * 1e-2
+        # coupling conductance of every compartment to its parent and the diagonal it adds to both
+        Ra = [values[s]['Ra'] for s in range(len(self.sections))]
+        g_ax = [None] + [1.0 / (Ra[self.sec[i]] * self.r_child[i] + Ra[self.psec[i]] * self.r_parent[i]) for i in range(1, self.n)]
+        d_ax = [sum(g_ax[c] for c in self.children[i]) + (g_ax[i] if i > 0 else 0.0) for i in range(self.n)]
+
+        # batch size from whichever input carries a batch axis
+        K = max([np.shape(I)[0], np.size(v_init)] + [np.shape(q)[0] for q in (C, g_Na, g_K, g_L, E_Na, E_K, gE_L)] +
+                [np.size(g) for g in g_ax[1:]])
+        V = np.reshape(v_init, (-1, 1)) * np.ones((K, self.n))
+        alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n = gating.rates(V)
+        m, h, n = alpha_m / (alpha_m + beta_m), alpha_h / (alpha_h + beta_h), alpha_n / (alpha_n + beta_n)
+
+        V_record = []
+        for k in range(I.shape[1]):
+            V_record.append(V[:, rec] if record is not None else V)
+            G_Na = g_Na * m**3 * h
+            G_K = g_K * n**4
+            # backward euler: (C/dt + G) V' - sum g_ax (V'_j - V') = C/dt V + G E + I
+            diag = C / dt + G_Na + G_K + g_L
+            rhs = C / dt * V + G_Na * E_Na + G_K * E_K + gE_L + inject * I[:, k:k + 1]
+            V = hines_solve([diag[:, i] + d_ax[i] for i in range(self.n)], g_ax, [rhs[:, i] for i in range(self.n)], self.parent)
+            alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n = gating.rates(V)
+            m = gate_step(m, alpha_m, beta_m, dt)
+            h = gate_step(h, alpha_h, beta_h, dt)
+            n = gate_step(n, alpha_n, beta_n, dt)
+        V_record = np.stack(V_record, axis = 1)
+        return V_record if batched else V_record[0]
+
+
+def hines_solve(d, a, b, parent):
+    '''
+    solves the symmetric tree system d_i x_i - a_i x_parent(i) - sum_(children c) a_c x_c = b_i
+    Args:
+        d (list): diagonal of every node
+        a (list): coupling of every node to its parent, a[0] is unused
+        b (list): right hand side of every node
+        parent (list): parent of every node with parent[i] < i, the root is node 0
+    Returns:
+        x (array): (..., n) solution, the entries of d and b may be floats or arrays of a common shape
+    '''
+    d = list(d)
+    b = list(b)
+    # eliminate every node into its parent, leaves first
+    for i in range(len(d) - 1, 0, -1):
+        p = parent[i]
+        f = a[i] / d[i]
+        d[p] = d[p] - f * a[i]
+        b[p] = b[p] + f * b[i]
+    # back substitution from the root
+    x = [b[0] / d[0]]
+    for i in range(1, len(d)):
+        x.append((b[i] + a[i] * x[parent[i]]) / d[i])
+    return np.stack(x, axis = -1)
+
+
+class cable_adj:
+    def __init__(self, V_data, t_data, I_data, dt, model, names, init_guess, bounds = None, method = 'L-BFGS-B', tol = 1e-5,
+                 site = ('soma', 0.5), record = ('soma', 0.5), obs_mode = 'linear', gating = None):
+        '''
+        recovers parameters of a cell from a voltage recording, with the gradient from autograd through simulate
+        Args:
+            V_data, t_data, I_data (arrays): recorded voltage, time stamps and injected current (nA)
+            dt (float): simulation time step
+            model (cell): morphology and default parameters
+            names (list): '<section>.<parameter>' keys to recover, e.g. ['soma.gnabar', 'soma.gkbar', 'dend.g_pas']
+            init_guess (array): initial values of names
+            bounds (list): (low, high) of every name
+            method, tol: passed to scipy.optimize.minimize
+            site (tuple): (section, x) of the current injection
+            record (tuple): (section, x) of the recording
+            obs_mode (str): see observation.obs_operator
+            gating: see hh_rates.get_gating
+        '''
+        self.V0 = V_data[0]
+        self.model = model
+        self.names = list(names)
+        self.init_guess = np.asarray(init_guess, dtype = float)
+        self.dt = dt
+        self.t_sim = np.arange(t_data[0], t_data[-1], dt)
+        self.obs = obs_operator(self.t_sim, t_data, V_data, obs_mode)
+        self.I_sim = np.interp(self.t_sim, t_data, I_data)
+        self.bounds = bounds
+        self.method = method
+        self.tol = tol
+        self.site = site
+        self.record = record
+        self.gating = get_gating(gating)
+        self.cache = eval_cache()
+
+    def simulate(self, x):
+        '''recorded voltage on the simulation grid for the parameter values x'''
+        return self.model.simulate(self.I_sim, self.dt, self.site, self.V0, dict(zip(self.names, x)), (self.record,), self.gating)[:, 0]
+
+    def __cost(self, x):
+        return self.obs.misfit(self.simulate(x))
+
+    def value_and_grad(self, x):
+        '''objective and its gradient, repeated calls at the same x are served from self.cache'''
+        hit = self.cache.get(x)
+        if hit is not None and hit[1] is not None:
+            self.cache.hits += 1
+            return hit[0], hit[1].copy()
+        self.cache.misses += 1
+        J, g = value_and_grad(self.__cost)(np.asarray(x, dtype = float))
+        self.cache.put(x, float(J), g)
+        return float(J), np.array(g, dtype = float)
+
+    def cost(self, x):
+        return self.value_and_grad(x)[0]
+
+    def gradient(self, x):
+        return self.value_and_grad(x)[1]
+
+    def optimize(self, x0 = None):
+        if x0 is None:
+            x0 = self.init_guess
+        return optimize.minimize(self.value_and_grad, x0, jac = True, bounds = self.bounds, method = self.method, tol = self.tol)
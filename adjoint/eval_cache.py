@@ -0,0 +1,43 @@
+from collections import OrderedDict
+import numpy as np
+
+# Small least recently used cache of objective evaluations keyed on the exact bytes of the
+# parameter vector. scipy calls fun, jac and callbacks separately at the same x, with the cache
+# they all share a single forward/backward pass.
+
+
+class eval_cache:
+    def __init__(self, maxsize = 8):
+        '''
+        Args:
+            maxsize (int): number of distinct parameter vectors remembered
+        '''
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        #misses count the evaluations that actually ran a simulation
+        self.hits = 0
+        self.misses = 0
+
+    def __key(self, x):
+        return np.asarray(x, dtype = float).tobytes()
+
+    def get(self, x):
+        '''cached (cost, gradient) at x or None, gradient is None when only the cost was evaluated'''
+        key = self.__key(x)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, x, cost, gradient = None):
+        '''stores the cost (and gradient) at x, dropping the least recently used entry when full'''
+        key = self.__key(x)
+        self.entries[key] = (cost, None if gradient is None else np.array(gradient, dtype = float))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last = False)
+
+    def clear(self):
+        '''forgets every entry, needed whenever the data or the model settings of the solver change'''
+        self.entries.clear()
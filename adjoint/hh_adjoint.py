@@ -0,0 +1,307 @@
+import numpy as np
+from hh_rates import analytic
+from hh_integrators import gate_step
+
+# Hand written discrete adjoint of the forward euler Hodgkin Huxley solver used by stim_adj and param_adj.
+# The state is x = (V, m, h, n) and the model parameters are p = (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m),
+# the stimulus I is given at every simulation step. The forward sweep stores the trajectory in a
+# preallocated array, the reverse sweep applies the transposed euler jacobian step by step.
+# For long recordings checkpointed_gradient keeps only a bounded number of states alive and
+# recomputes the rest of the trajectory segment by segment during the reverse sweep.
+# tangent_sweep runs the same jacobian forwards instead, giving the derivative of the whole voltage record
+# with respect to a handful of parameters, i.e. the jacobian of the residual for Gauss-Newton type fits.
+# Every function takes the gating kinetics to use, hh_rates.analytic or an hh_rates.rate_table,
+# and the fixed step scheme, 'euler', 'rush_larsen' (exponential euler on the gates) or 'exponential'
+# (exponential euler on V as well), see hh_integrators.
+
+# scipy.optimize.least_squares methods, the recovery classes fit with them through tangent_sweep
+least_squares_methods = ('trf', 'dogbox', 'lm')
+
+
+def forward_sweep(x0, I, p, dt, gating = analytic, scheme = 'euler'):
+    '''fixed step solve that keeps the whole trajectory
+    Args:
+        x0 (tuple): initial state (V, m, h, n)
+        I (array): stimulus at every simulation step
+        p (tuple): (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m)
+        dt (float): simulation time step
+        gating (hh_rates): rate constants of the gates
+        scheme (str): 'euler', 'rush_larsen' or 'exponential'
+    Returns:
+        traj (array): (N, 4) state at each step before it is advanced, traj[:, 0] is the voltage record
+    '''
+    traj = np.empty((len(I), 4))
+    advance(x0, I, p, dt, traj, gating, scheme)
+    return traj
+
+
+def advance(x0, I, p, dt, out = None, gating = analytic, scheme = 'euler'):
+    '''fixed step solve over len(I) steps
+    Args:
+        x0 (tuple): initial state (V, m, h, n)
+        I (array): stimulus at every step
+        p (tuple): (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m)
+        dt (float): simulation time step
+        out (array): optional (len(I), 4) buffer filled with the state before each step
+        gating (hh_rates): rate constants of the gates
+        scheme (str): 'euler', 'rush_larsen' or 'exponential'
+    Returns:
+        x (tuple): state after the last step
+    '''
+    exp_gates, exp_V = _check_scheme(scheme)
+    g_Na, g_K, g_L, E_Na, E_K, E_L, C_m = [float(q) for q in p]
+    V, m, h, n = [float(q) for q in x0]
+    I = np.asarray(I, dtype = float).tolist()
+    for i in range(len(I)):
+        if out is not None:
+            out[i] = V, m, h, n
+        alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n = gating.rates(V)
+        if exp_V:
+            G_Na = g_Na * m**3 * h
+            G_K = g_K * n**4
+            G = G_Na + G_K + g_L
+            V_inf = (I[i] + G_Na * E_Na + G_K * E_K + g_L * E_L) / G
+            V = V_inf + (V - V_inf) * np.exp(-dt * G / C_m)
+        else:
+            V += (I[i] - g_Na * m**3 * h * (V - E_Na) - g_K * n**4 * (V - E_K) - g_L * (V - E_L)) / C_m * dt
+        if exp_gates:
+            m = gate_step(m, alpha_m, beta_m, dt)
+            h = gate_step(h, alpha_h, beta_h, dt)
+            n = gate_step(n, alpha_n, beta_n, dt)
+        else:
+            m += (alpha_m * (1 - m) - beta_m * m) * dt
+            h += (alpha_h * (1 - h) - beta_h * h) * dt
+            n += (alpha_n * (1 - n) - beta_n * n) * dt
+    return V, m, h, n
+
+
+def _check_scheme(scheme):
+    '''whether the scheme updates the gates and V exponentially'''
+    if scheme not in ('euler', 'rush_larsen', 'exponential'):
+        raise ValueError("the discrete adjoint supports the 'euler', 'rush_larsen' and 'exponential' schemes only")
+    return scheme != 'euler', scheme == 'exponential'
+
+
+def _gate_jacobian(x, alpha, beta, d_alpha, d_beta, dt):
+    '''derivatives of the exponential gate update with respect to the gate itself and to V'''
+    rate = alpha + beta
+    x_inf = alpha / rate
+    E = np.exp(-dt * rate)
+    d_x_inf = (d_alpha * rate - alpha * (d_alpha + d_beta)) / rate**2
+    return E, d_x_inf * (1 - E) - dt * (x - x_inf) * E * (d_alpha + d_beta)
+
+
+def _step_jacobian(traj, I, p, dt, gating, scheme):
+    '''nonzero entries of the step jacobian along the whole trajectory, computed in one vectorized pass,
+    together with the derivatives of the new voltage with respect to the stimulus and the parameters,
+    which only enter through the voltage row
+    Returns:
+        J (tuple): (J_VV, J_Vm, J_Vh, J_Vn, J_mV, J_mm, J_hV, J_hh, J_nV, J_nn) at every step, J_xy = d x_new / d y
+        dV_dI (array or float): derivative of the new voltage with respect to the stimulus
+        dV_dp (list): derivative of the new voltage with respect to each of (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m)
+    '''
+    exp_gates, exp_V = _check_scheme(scheme)
+    g_Na, g_K, g_L, E_Na, E_K, E_L, C_m = [float(q) for q in p]
+    V, m, h, n = traj.T
+    I = np.asarray(I, dtype = float)
+    alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n = gating.rates(V)
+    d_alpha_m, d_beta_m, d_alpha_h, d_beta_h, d_alpha_n, d_beta_n = gating.rate_derivs(V)
+
+    m3h = m**3 * h
+    n4 = n**4
+    if exp_V:
+        G = g_Na * m3h + g_K * n4 + g_L
+        V_inf = (I + g_Na * m3h * E_Na + g_K * n4 * E_K + g_L * E_L) / G
+        E_V = np.exp(-dt * G / C_m)
+        K = (1 - E_V) / G
+        decay = dt * (V - V_inf) * E_V / C_m
+        J_VV = E_V
+        J_Vm = 3 * g_Na * m**2 * h * ((E_Na - V_inf) * K - decay)
+        J_Vh = g_Na * m**3 * ((E_Na - V_inf) * K - decay)
+        J_Vn = 4 * g_K * n**3 * ((E_K - V_inf) * K - decay)
+        dV_dI = K
+        dV_dp = [m3h * ((E_Na - V_inf) * K - decay),
+                 n4 * ((E_K - V_inf) * K - decay),
+                 (E_L - V_inf) * K - decay,
+                 g_Na * m3h * K,
+                 g_K * n4 * K,
+                 g_L * K,
+                 decay * G / C_m]
+    else:
+        J_VV = 1 - dt * (g_Na * m3h + g_K * n4 + g_L) / C_m
+        J_Vm = -dt * 3 * g_Na * m**2 * h * (V - E_Na) / C_m
+        J_Vh = -dt * g_Na * m**3 * (V - E_Na) / C_m
+        J_Vn = -dt * 4 * g_K * n**3 * (V - E_K) / C_m
+        dVdt = (I - g_Na * m3h * (V - E_Na) - g_K * n4 * (V - E_K) - g_L * (V - E_L)) / C_m
+        dV_dI = dt / C_m
+        dV_dp = [-dt * m3h * (V - E_Na) / C_m,
+                 -dt * n4 * (V - E_K) / C_m,
+                 -dt * (V - E_L) / C_m,
+                 dt * g_Na * m3h / C_m,
+                 dt * g_K * n4 / C_m,
+                 dt * g_L / C_m,
+                 -dt * dVdt / C_m]
+    if exp_gates:
+        J_mm, J_mV = _gate_jacobian(m, alpha_m, beta_m, d_alpha_m, d_beta_m, dt)
+        J_hh, J_hV = _gate_jacobian(h, alpha_h, beta_h, d_alpha_h, d_beta_h, dt)
+        J_nn, J_nV = _gate_jacobian(n, alpha_n, beta_n, d_alpha_n, d_beta_n, dt)
+    else:
+        J_mm, J_mV = 1 - dt * (alpha_m + beta_m), dt * (d_alpha_m * (1 - m) - d_beta_m * m)
+        J_hh, J_hV = 1 - dt * (alpha_h + beta_h), dt * (d_alpha_h * (1 - h) - d_beta_h * h)
+        J_nn, J_nV = 1 - dt * (alpha_n + beta_n), dt * (d_alpha_n * (1 - n) - d_beta_n * n)
+    return (J_VV, J_Vm, J_Vh, J_Vn, J_mV, J_mm, J_hV, J_hh, J_nV, J_nn), dV_dI, dV_dp
+
+
+def reverse_sweep(traj, I, p, dt, dJdV, lam = None, gating = analytic, scheme = 'euler'):
+    '''applies the transposed step jacobian backwards in time
+    Args:
+        traj (array): (N, 4) trajectory from forward_sweep
+        I (array): stimulus at every simulation step
+        p (tuple): (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m)
+        dt (float): simulation time step
+        dJdV (array): gradient of the cost with respect to the voltage record
+        lam (array): adjoint of the state following the last step, zero when the trajectory ends the record
+        gating (hh_rates): rate constants of the gates, their voltage derivatives enter the jacobian
+        scheme (str): 'euler', 'rush_larsen' or 'exponential', must match the forward solve
+    Returns:
+        dJdx0 (array): gradient with respect to the initial state (V, m, h, n)
+        dJdp (array): gradient with respect to (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m)
+        dJdI (array): gradient with respect to the stimulus at every step
+    '''
+    J, dV_dI, dV_dp = _step_jacobian(traj, I, p, dt, gating, scheme)
+    J_VV, J_Vm, J_Vh, J_Vn, J_mV, J_mm, J_hV, J_hh, J_nV, J_nn = [np.broadcast_to(q, (len(traj),)).tolist() for q in J]
+    g = np.asarray(dJdV, dtype = float).tolist()
+
+    # lam_V_next[k] is the voltage adjoint of step k + 1, the only component the parameters feed into
+    N = len(g)
+    lam_V_next = np.zeros(N)
+    lV, lm, lh, ln = (0.0, 0.0, 0.0, 0.0) if lam is None else [float(q) for q in lam]
+    for k in range(N - 1, -1, -1):
+        lam_V_next[k] = lV
+        lV, lm, lh, ln = (g[k] + J_VV[k] * lV + J_mV[k] * lm + J_hV[k] * lh + J_nV[k] * ln,
+                          J_Vm[k] * lV + J_mm[k] * lm,
+                          J_Vh[k] * lV + J_hh[k] * lh,
+                          J_Vn[k] * lV + J_nn[k] * ln)
+    dJdx0 = np.array([lV, lm, lh, ln])
+
+    # parameters and stimulus only enter through the new voltage
+    dJdp = np.array([np.sum(lam_V_next * d) for d in dV_dp])
+    return dJdx0, dJdp, lam_V_next * dV_dI
+
+
+def tangent_sweep(traj, I, p, dt, dx0, dp = None, dI = None, gating = analytic, scheme = 'euler'):
+    '''forward sensitivity equations, the step jacobian applied forwards in time to the derivatives of the state
+    with respect to P fitted quantities, all P columns carried along in one sweep
+    Args:
+        traj (array): (N, 4) trajectory from forward_sweep
+        I, p, dt, gating, scheme: as in reverse_sweep
+        dx0 (array): (4, P) derivative of the initial state (V, m, h, n) with respect to the fitted quantities
+        dp (array): (7, P) derivative of (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m), None when they are not fitted
+        dI (array): (N, P) derivative of the stimulus at every step, None when it is not fitted
+    Returns:
+        dV (array): (N, P) derivative of the voltage record, the residual jacobian of a least squares fit
+    '''
+    N = len(traj)
+    J, dV_dI, dV_dp = _step_jacobian(traj, I, p, dt, gating, scheme)
+    J_VV, J_Vm, J_Vh, J_Vn, J_mV, J_mm, J_hV, J_hh, J_nV, J_nn = [np.broadcast_to(q, (N,)).tolist() for q in J]
+    dx0 = np.asarray(dx0, dtype = float)
+
+    # parameters and stimulus only force the voltage row
+    F = np.zeros((N, dx0.shape[1]))
+    if dp is not None:
+        F += np.column_stack([np.broadcast_to(d, (N,)) for d in dV_dp]) @ np.asarray(dp, dtype = float)
+    if dI is not None:
+        F += np.reshape(dV_dI, (-1, 1)) * np.asarray(dI, dtype = float)
+
+    dV = np.empty_like(F)
+    sV, sm, sh, sn = dx0
+    for k in range(N):
+        dV[k] = sV
+        sV, sm, sh, sn = (J_VV[k] * sV + J_Vm[k] * sm + J_Vh[k] * sh + J_Vn[k] * sn + F[k],
+                          J_mV[k] * sV + J_mm[k] * sm,
+                          J_hV[k] * sV + J_hh[k] * sh,
+                          J_nV[k] * sV + J_nn[k] * sn)
+    return dV
+
+
+def checkpoint_plan(N, budget):
+    '''number of evenly spaced checkpoints stored at each level of the recursion
+    Args:
+        N (int): number of simulation steps
+        budget (int): maximum number of states held in memory at once
+    Returns:
+        plan (list): checkpoints per level, empty when the whole trajectory fits in the budget
+    '''
+    levels = 0
+    while True:
+        # every level costs one extra forward solve, so use as few as the budget allows
+        k = budget // (levels + 1)
+        if k < 2:
+            raise ValueError('checkpoint budget too small for a trajectory of this length')
+        if k**levels * (budget - levels * k) >= N:
+            return [k] * levels
+        levels += 1
+
+
+def observe(x0, I, p, dt, obs, chunk, gating = analytic, scheme = 'euler'):
+    '''forward solve in blocks of chunk steps that only keeps the voltage at the observed samples
+    Returns:
+        V_sim (array): simulated voltage at each sample retained by obs
+    '''
+    V_sim = np.zeros(len(obs.V_obs))
+    buf = np.empty((min(chunk, len(I)), 4))
+    x = x0
+    for start in range(0, len(I), chunk):
+        seg = I[start:start + chunk]
+        x = advance(x, seg, p, dt, buf[:len(seg)], gating, scheme)
+        obs.accumulate(V_sim, buf[:len(seg), 0], start)
+    return V_sim
+
+
+def checkpointed_gradient(x0, I, p, dt, obs, budget, gating = analytic, scheme = 'euler'):
+    '''gradient of the misfit with at most budget states held in memory
+
+    The trajectory is split into evenly spaced segments whose initial states are stored, during
+    the reverse sweep each segment is recomputed from its checkpoint and split again when it
+    still does not fit, so every level of the recursion costs one extra forward solve.
+
+    Args:
+        x0 (tuple): initial state (V, m, h, n)
+        I (array): stimulus at every simulation step
+        p (tuple): (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m)
+        dt (float): simulation time step
+        obs (obs_operator): observation operator built on the simulation grid
+        budget (int): maximum number of trajectory states held in memory at once
+        gating (hh_rates): rate constants of the gates
+        scheme (str): 'euler', 'rush_larsen' or 'exponential'
+    Returns:
+        J (float): misfit
+        dJdx0, dJdp, dJdI (arrays): as returned by reverse_sweep
+    '''
+    I = np.asarray(I, dtype = float)
+    plan = checkpoint_plan(len(I), budget)
+    leaf = budget - sum(plan)
+    r = observe(x0, I, p, dt, obs, leaf, gating, scheme) - obs.V_obs
+    J = np.sum(r**2) / obs.n_data
+    dJdobs = 2.0 * r / obs.n_data
+
+    dJdp = np.zeros(7)
+    dJdI = np.zeros(len(I))
+
+    def reverse(x, s0, s1, lam, level):
+        if level == len(plan):
+            traj = forward_sweep(x, I[s0:s1], p, dt, gating, scheme)
+            lam, g_p, dJdI[s0:s1] = reverse_sweep(traj, I[s0:s1], p, dt, obs.adjoint(dJdobs, s0, s1), lam, gating, scheme)
+            dJdp[:] += g_p
+            return lam
+        L = -(-(s1 - s0) // plan[level])
+        bounds = list(range(s0, s1, L)) + [s1]
+        checkpoints = [x]
+        for a, b in zip(bounds[:-2], bounds[1:-1]):
+            checkpoints.append(advance(checkpoints[-1], I[a:b], p, dt, gating = gating, scheme = scheme))
+        for j in range(len(checkpoints) - 1, -1, -1):
+            lam = reverse(checkpoints[j], bounds[j], bounds[j + 1], lam, level + 1)
+        return lam
+
+    dJdx0 = reverse(x0, 0, len(I), None, 0)
+    return J, np.asarray(dJdx0), dJdp, dJdI
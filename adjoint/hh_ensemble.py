@@ -0,0 +1,104 @@
+import numpy as np
+from hh_rates import analytic
+from hh_integrators import gate_step
+
+# Batched forward euler Hodgkin Huxley solver. K candidates (stimuli or parameter vectors) are
+# stepped together with state held as a (K, 4) array of (V, m, h, n), so the per step interpreter
+# overhead is shared by the whole ensemble. Stepping is identical to integrate_HH in stim_adj and param_adj,
+# with the same choice of 'euler', 'rush_larsen' or 'exponential' fixed step scheme.
+
+
+def _broadcast(x0, I, p):
+    '''brings initial states, stimuli and parameters to a common ensemble size K'''
+    x0 = np.atleast_2d(np.asarray(x0, dtype = float))
+    p = np.atleast_2d(np.asarray(p, dtype = float))
+    if not callable(I):
+        I = np.atleast_2d(np.asarray(I, dtype = float))
+        K = np.broadcast_shapes((len(x0),), (len(p),), (len(I),))[0]
+        I = np.broadcast_to(I, (K, I.shape[1]))
+    else:
+        K = np.broadcast_shapes((len(x0),), (len(p),))[0]
+    x = np.array(np.broadcast_to(x0, (K, 4)))
+    p = np.broadcast_to(p, (K, 7))
+    return x, I, p
+
+
+def ensemble_advance(x, I, p, dt, out = None, gating = analytic, scheme = 'euler'):
+    '''advances every member of the ensemble by I.shape[1] fixed steps
+    Args:
+        x (array): (K, 4) state (V, m, h, n), updated in place
+        I (array): (K, n) stimulus of each member at each step
+        p (array): (K, 7) rows of (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m)
+        dt (float): simulation time step
+        out (array): optional (K, n) buffer filled with the voltage before each step
+        gating (hh_rates): rate constants of the gates
+        scheme (str): 'euler', 'rush_larsen' or 'exponential'
+    Returns:
+        x (array): state after the last step
+    '''
+    g_Na, g_K, g_L, E_Na, E_K, E_L, C_m = p.T
+    V, m, h, n = x.T
+    for i in range(I.shape[1]):
+        if out is not None:
+            out[:, i] = V
+        alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n = gating.rates(V)
+        if scheme == 'exponential':
+            G_Na = g_Na * m**3 * h
+            G_K = g_K * n**4
+            G = G_Na + G_K + g_L
+            V_inf = (I[:, i] + G_Na * E_Na + G_K * E_K + g_L * E_L) / G
+            V[:] = V_inf + (V - V_inf) * np.exp(-dt * G / C_m)
+        else:
+            V += (I[:, i] - g_Na * m**3 * h * (V - E_Na) - g_K * n**4 * (V - E_K) - g_L * (V - E_L)) / C_m * dt
+        if scheme != 'euler':
+            m[:] = gate_step(m, alpha_m, beta_m, dt)
+            h[:] = gate_step(h, alpha_h, beta_h, dt)
+            n[:] = gate_step(n, alpha_n, beta_n, dt)
+        else:
+            m += (alpha_m * (1 - m) - beta_m * m) * dt
+            h += (alpha_h * (1 - h) - beta_h * h) * dt
+            n += (alpha_n * (1 - n) - beta_n * n) * dt
+    return x
+
+
+def integrate_ensemble(x0, I, p, dt, N = None, gating = analytic, scheme = 'euler'):
+    '''fixed step solve of K Hodgkin Huxley models at once
+    Args:
+        x0 (array): (K, 4) or (4,) initial state (V, m, h, n)
+        I (array or callable): (K, N) or (N,) stimulus, or a function of (start, stop) returning the (K, stop - start) block
+        p (array): (K, 7) or (7,) rows of (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m)
+        dt (float): simulation time step
+        N (int): number of steps, only needed when I is a function
+        gating (hh_rates): rate constants of the gates
+        scheme (str): 'euler', 'rush_larsen' or 'exponential'
+    Returns:
+        V_record (array): (K, N) voltage of each member before each step
+    '''
+    x, I, p = _broadcast(x0, I, p)
+    if callable(I):
+        I = I(0, N)
+    V_record = np.empty(I.shape)
+    ensemble_advance(x, I, p, dt, V_record, gating, scheme)
+    return V_record
+
+
+def ensemble_misfit(x0, I, p, dt, obs, N = None, chunk = 2048, gating = analytic, scheme = 'euler'):
+    '''misfit of every ensemble member, integrating in blocks so only chunk steps of voltage are stored
+    Args:
+        x0, I, p, dt, N, gating, scheme: as in integrate_ensemble
+        obs (obs_operator): observation operator built on the simulation grid
+        chunk (int): number of steps integrated per block
+    Returns:
+        cost (array): (K,) mean squared error of each member
+    '''
+    x, I, p = _broadcast(x0, I, p)
+    if N is None:
+        N = I.shape[1]
+    V_sim = np.zeros((len(x), len(obs.V_obs)))
+    buf = np.empty((len(x), min(chunk, N)))
+    for start in range(0, N, chunk):
+        stop = min(start + chunk, N)
+        block = I(start, stop) if callable(I) else I[:, start:stop]
+        ensemble_advance(x, block, p, dt, buf[:, :stop - start], gating, scheme)
+        obs.accumulate(V_sim, buf[:, :stop - start], start)
+    return np.sum((V_sim - obs.V_obs)**2, axis = -1) / obs.n_data
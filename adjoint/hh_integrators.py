@@ -0,0 +1,121 @@
+import autograd.numpy as np
+from autograd.tracer import getval
+from hh_rates import analytic
+
+# Time stepping schemes for the Hodgkin Huxley forward model.
+#   euler        explicit forward euler on all four variables, the scheme the recovery classes always used
+#   rush_larsen  forward euler on V, exact exponential update of m, h and n with the rates frozen over the step,
+#                stable for much larger steps because the gates can no longer overshoot
+#   exponential  rush_larsen gates plus an exact exponential relaxation of V towards its steady state with the
+#                conductances frozen over the step, stable at any dt, used for the coarse levels of multires
+#   rk23         embedded Bogacki-Shampine 3(2) pair with error control and spike aware step shrinking
+# The steps are written with autograd.numpy so they work on floats, arrays and autograd boxes alike.
+
+schemes = ('euler', 'rush_larsen', 'exponential', 'rk23')
+
+
+def hh_rhs(V, m, h, n, I, p, gating = analytic):
+    '''right hand side of the Hodgkin Huxley equations
+    Args:
+        V, m, h, n: state
+        I: injected current
+        p (tuple): (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m)
+        gating (hh_rates): rate constants of the gates
+    Returns:
+        dVdt, dmdt, dhdt, dndt
+    '''
+    g_Na, g_K, g_L, E_Na, E_K, E_L, C_m = p
+    alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n = gating.rates(V)
+    dVdt = (I - g_Na * m**3 * h * (V - E_Na) - g_K * n**4 * (V - E_K) - g_L * (V - E_L)) / C_m
+    dmdt = alpha_m * (1 - m) - beta_m * m
+    dhdt = alpha_h * (1 - h) - beta_h * h
+    dndt = alpha_n * (1 - n) - beta_n * n
+    return dVdt, dmdt, dhdt, dndt
+
+
+def euler_step(V, m, h, n, I, p, dt, gating = analytic):
+    '''one forward euler step, returns the new (V, m, h, n)'''
+    dVdt, dmdt, dhdt, dndt = hh_rhs(V, m, h, n, I, p, gating)
+    return V + dVdt * dt, m + dmdt * dt, h + dhdt * dt, n + dndt * dt
+
+
+def gate_step(x, alpha, beta, dt):
+    '''exact solution of dx/dt = alpha (1 - x) - beta x over dt with alpha and beta held constant'''
+    rate = alpha + beta
+    x_inf = alpha / rate
+    return x_inf + (x - x_inf) * np.exp(-dt * rate)
+
+
+def rush_larsen_step(V, m, h, n, I, p, dt, gating = analytic):
+    '''one Rush-Larsen step, forward euler on V and exponential euler on the gates, returns the new (V, m, h, n)'''
+    g_Na, g_K, g_L, E_Na, E_K, E_L, C_m = p
+    alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n = gating.rates(V)
+    dVdt = (I - g_Na * m**3 * h * (V - E_Na) - g_K * n**4 * (V - E_K) - g_L * (V - E_L)) / C_m
+    return V + dVdt * dt, gate_step(m, alpha_m, beta_m, dt), gate_step(h, alpha_h, beta_h, dt), gate_step(n, alpha_n, beta_n, dt)
+
+
+def exponential_step(V, m, h, n, I, p, dt, gating = analytic):
+    '''one exponential euler step on every variable, returns the new (V, m, h, n)'''
+    g_Na, g_K, g_L, E_Na, E_K, E_L, C_m = p
+    alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n = gating.rates(V)
+    G_Na = g_Na * m**3 * h
+    G_K = g_K * n**4
+    G = G_Na + G_K + g_L
+    V_inf = (I + G_Na * E_Na + G_K * E_K + g_L * E_L) / G
+    V_new = V_inf + (V - V_inf) * np.exp(-dt * G / C_m)
+    return V_new, gate_step(m, alpha_m, beta_m, dt), gate_step(h, alpha_h, beta_h, dt), gate_step(n, alpha_n, beta_n, dt)
+
+
+steps = {'euler': euler_step, 'rush_larsen': rush_larsen_step, 'exponential': exponential_step}
+
+
+def rk23(rhs, x0, t0, t1, dt0, rtol = 1e-4, atol = 1e-3, dt_min = 1e-4, dt_max = 0.5, dV_max = 2.0, tstops = ()):
+    '''adaptive Bogacki-Shampine 3(2) integration with error control
+
+    Step sizes are chosen from the values of the state only (autograd getval), so differentiating
+    through the solve gives the exact gradient of the discrete scheme for the accepted step sequence.
+
+    Args:
+        rhs (function): rhs(t, x) returning the four derivatives of x = (V, m, h, n)
+        x0 (tuple): initial state
+        t0, t1 (float): integration interval
+        dt0 (float): first trial step
+        rtol, atol (float): relative and absolute error tolerance of each accepted step
+        dt_min, dt_max (float): smallest and largest allowed step
+        dV_max (float): largest voltage change allowed per step, shrinks the step on the upstroke of a spike
+        tstops (list): times the solver must not step over, e.g. stimulus onsets
+    Returns:
+        t_record (array): accepted times, starting with t0 and ending with t1
+        x_record (list): state at each accepted time
+    '''
+    stops = sorted(float(s) for s in tstops if t0 < s < t1) + [float(t1)]
+    t = float(t0)
+    x = tuple(x0)
+    h = float(dt0)
+    k1 = rhs(t, x)
+    t_record = [t]
+    x_record = [x]
+    while t < t1:
+        # spike aware limit, never move V by more than dV_max in one step
+        slope = abs(getval(k1[0]))
+        h = min(h, dt_max, dV_max / slope if slope > 0 else dt_max)
+        h = max(h, dt_min)
+        stop = next(s for s in stops if s > t)
+        last = t + h >= stop - 1e-12
+        if last:
+            h = stop - t
+        k2 = rhs(t + h / 2, tuple(xi + h / 2 * ki for xi, ki in zip(x, k1)))
+        k3 = rhs(t + 3 * h / 4, tuple(xi + 3 * h / 4 * ki for xi, ki in zip(x, k2)))
+        x_new = tuple(xi + h * (2 / 9 * a + 1 / 3 * b + 4 / 9 * c) for xi, a, b, c in zip(x, k1, k2, k3))
+        k4 = rhs(t + h, x_new)
+        err = max(abs(getval(h * (-5 / 72 * a + 1 / 12 * b + 1 / 9 * c - 1 / 8 * d))) / (atol + rtol * max(abs(getval(xi)), abs(getval(yi))))
+                  for xi, yi, a, b, c, d in zip(x, x_new, k1, k2, k3, k4))
+        if err <= 1.0 or h <= dt_min:
+            t = stop if last else t + h
+            x = x_new
+            k1 = k4
+            t_record.append(t)
+            x_record.append(x)
+        # standard step size update for a third order pair
+        h = h * min(5.0, max(0.2, 0.9 * (err if err > 0 else 1e-12)**(-1 / 3)))
+    return np.array(t_record), x_record
@@ -0,0 +1,156 @@
+import autograd.numpy as np
+from autograd.tracer import getval
+
+# Hodgkin Huxley gating kinetics shared by stim_adj, param_adj, hh_adjoint and hh_ensemble.
+# analytic evaluates the rate functions directly, rate_table precomputes them (and their voltage
+# derivatives) on a voltage grid and interpolates linearly, like the TABLE statement of NEURON mod files.
+# Both work on floats, numpy arrays and autograd boxes.
+
+
+def vtrap(x, y):
+    '''x / (1 - exp(-x / y)), with the removable singularity at x = 0 replaced by its series'''
+    if np.ndim(x) == 0:
+        if abs(x / y) < 1e-6:
+            return y * (1.0 + x / (2.0 * y))
+        return x / (1.0 - np.exp(-x / y))
+    small = np.abs(x / y) < 1e-6
+    x_safe = np.where(small, y, x)
+    return np.where(small, y * (1.0 + x / (2.0 * y)), x_safe / (1.0 - np.exp(-x_safe / y)))
+
+
+def d_vtrap(x, y):
+    '''derivative of vtrap with respect to x'''
+    if np.ndim(x) == 0:
+        if abs(x / y) < 1e-6:
+            return 0.5 + x / (6.0 * y)
+        e = np.exp(-x / y)
+        return 1.0 / (1.0 - e) - x * e / (y * (1.0 - e)**2)
+    small = np.abs(x / y) < 1e-6
+    x_safe = np.where(small, y, x)
+    e = np.exp(-x_safe / y)
+    return np.where(small, 0.5 + x / (6.0 * y), 1.0 / (1.0 - e) - x_safe * e / (y * (1.0 - e)**2))
+
+
+class hh_rates:
+    '''analytic transition rate constants of the m, h and n gates'''
+
+    def alpha_m(self, V):
+        '''transition rate constant for m-gates (rapid response Na) shut gates opening as a function of voltage'''
+        return 0.1 * vtrap(V + 40.0, 10.0)
+
+    def beta_m(self, V):
+        '''transition rate constant for m-gates (rapid response Na) open gates closing as a function of voltage '''
+        return 4.0 * np.exp(-(V + 65.0) / 18.0)
+
+    def alpha_h(self, V):
+        '''transition rate constant for h-gates (slow response Na) shut gates opening as a function of voltage'''
+        return 0.07 * np.exp(-(V + 65.0) / 20.0)
+
+    def beta_h(self, V):
+        '''transition rate constant for h-gates (slow response Na) open gates closing as a function of voltage '''
+        return 1.0 / (1.0 + np.exp(-(V + 35.0) / 10.0))
+
+    def alpha_n(self, V):
+        '''transition rate constant for n-gates (slow response K) shut gates opening as a function of voltage'''
+        return 0.01 * vtrap(V + 55.0, 10.0)
+
+    def beta_n(self, V):
+        '''transition rate constant for n-gates (slow response K) open gates closing as a function of voltage '''
+        return 0.125 * np.exp(-(V + 65) / 80.0)
+
+    def rates(self, V):
+        '''all six rate constants (alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n) at once'''
+        return self.alpha_m(V), self.beta_m(V), self.alpha_h(V), self.beta_h(V), self.alpha_n(V), self.beta_n(V)
+
+    def rate_derivs(self, V):
+        '''derivatives of the rate constants with respect to voltage, same order as rates'''
+        beta_h = self.beta_h(V)
+        return (0.1 * d_vtrap(V + 40.0, 10.0),
+                -4.0 / 18.0 * np.exp(-(V + 65.0) / 18.0),
+                -0.07 / 20.0 * np.exp(-(V + 65.0) / 20.0),
+                beta_h * (1.0 - beta_h) / 10.0,
+                0.01 * d_vtrap(V + 55.0, 10.0),
+                -0.125 / 80.0 * np.exp(-(V + 65) / 80.0))
+
+
+class rate_table(hh_rates):
+    def __init__(self, vmin = -150.0, vmax = 100.0, dv = 0.01):
+        '''
+        rate constants and their analytic derivatives tabulated once on a uniform voltage grid,
+        looked up by linear interpolation. Voltages outside [vmin, vmax] use the closest table entry.
+
+        Args:
+            vmin, vmax (float): voltage range of the table (mV)
+            dv (float): grid spacing (mV)
+        '''
+        self.vmin = vmin
+        self.dv = dv
+        self.n = int(round((vmax - vmin) / dv))
+        V = vmin + dv * np.arange(self.n + 1)
+        self.table = np.column_stack(analytic.rates(V))
+        self.dtable = np.column_stack(analytic.rate_derivs(V))
+        #python lists make the scalar lookups inside the euler loops cheap
+        self.rows = self.table.tolist()
+        self.drows = self.dtable.tolist()
+
+    def __lookup(self, table, rows, V):
+        '''linear interpolation of all six columns of table at V'''
+        x = (V - self.vmin) / self.dv
+        if np.ndim(V) == 0:
+            xv = getval(x)
+            if xv <= 0.0:
+                return tuple(rows[0])
+            if xv >= self.n:
+                return tuple(rows[self.n])
+            i = int(xv)
+            f = x - i
+            return tuple(a + f * (b - a) for a, b in zip(rows[i], rows[i + 1]))
+        x = np.clip(x, 0.0, self.n)
+        i = np.minimum(x.astype(int), self.n - 1)
+        f = (x - i)[..., None]
+        out = table[i] + f * (table[i + 1] - table[i])
+        return tuple(np.moveaxis(out, -1, 0))
+
+    def rates(self, V):
+        '''all six rate constants (alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n), interpolated'''
+        return self.__lookup(self.table, self.rows, V)
+
+    def rate_derivs(self, V):
+        '''analytic derivatives of the rate constants, interpolated, same order as rates'''
+        return self.__lookup(self.dtable, self.drows, V)
+
+    def alpha_m(self, V):
+        return self.rates(V)[0]
+
+    def beta_m(self, V):
+        return self.rates(V)[1]
+
+    def alpha_h(self, V):
+        return self.rates(V)[2]
+
+    def beta_h(self, V):
+        return self.rates(V)[3]
+
+    def alpha_n(self, V):
+        return self.rates(V)[4]
+
+    def beta_n(self, V):
+        return self.rates(V)[5]
+
+
+analytic = hh_rates()
+
+
+def get_gating(gating):
+    '''resolves the gating argument of the recovery classes
+    Args:
+        gating (None, str or hh_rates): None or 'analytic' for the rate functions, 'table' for a default rate_table,
+                                        or any hh_rates instance such as a custom rate_table
+    '''
+    if gating is None or gating == 'analytic':
+        return analytic
+    if gating == 'table':
+        return rate_table()
+    if isinstance(gating, hh_rates):
+        return gating
+    raise ValueError("gating must be None, 'analytic', 'table' or an hh_rates instance")
@@ -0,0 +1,37 @@
+# Coarse to fine continuation for stim_adj and param_adj. The data is decimated into a pyramid of
+# shorter traces, each level is fitted with a correspondingly coarser dt and warm starts the next
+# finer one, so most iterations run on traces several times shorter than the original.
+# Forward euler on V is unstable above dt ~ 0.05 ms during a spike, so the coarse levels use the
+# 'exponential' integrator by default, which is stable at any dt.
+
+
+def pyramid(solver, factors = (8, 4, 2), coarse_integrator = 'exponential'):
+    '''recovery problems from coarsest to finest, the last one is solver itself
+    Args:
+        solver (stim_adj or param_adj): problem at the target resolution
+        factors (list): decimation factors of the coarse levels, factors of 1 are skipped
+        coarse_integrator (str): integrator of the coarse levels, None keeps the one of solver
+    Returns:
+        levels (list): coarse instances built with solver.coarsen followed by solver
+    '''
+    return [solver.coarsen(f, coarse_integrator) for f in sorted(set(factors), reverse = True) if f > 1] + [solver]
+
+
+def multires(solver, factors = (8, 4, 2), coarse_integrator = 'exponential', x0 = None):
+    '''optimizes on every level of the pyramid, warm starting each level from the optimum of the previous one
+    Args:
+        solver (stim_adj or param_adj): problem at the target resolution
+        factors (list): decimation factors of the coarse levels
+        coarse_integrator (str): integrator of the coarse levels, None keeps the one of solver
+        x0 (array): starting point of the coarsest level, defaults to the initial guess of solver
+    Returns:
+        optim (OptimizeResult): result at the target resolution, optim.levels holds the result of every level
+    '''
+    levels = []
+    x = x0
+    for level in pyramid(solver, factors, coarse_integrator):
+        optim = level.optimize(x)
+        x = optim.x
+        levels.append(optim)
+    optim.levels = levels
+    return optim
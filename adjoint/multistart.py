@@ -0,0 +1,130 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import optimize
+from scipy.stats import qmc
+import hh_adjoint
+
+# Multi-start driver for stim_adj and param_adj. Starting points are drawn from the bounds with a
+# Latin hypercube or Sobol sequence and optimized in parallel worker processes. Workers share the best
+# cost found so far, a start whose own best stays far above it after a few evaluations is cancelled.
+
+_solver = None
+_best = None
+
+
+class _hopeless(Exception):
+    '''raised inside a worker to abandon a start that cannot catch up with the best one'''
+
+
+def _init_worker(solver, best):
+    '''each worker process unpickles the solver once and keeps a handle on the shared best cost'''
+    global _solver, _best
+    _solver = solver
+    _best = best
+
+
+def sample_starts(bounds, n_starts, sampler = 'lhs', seed = None):
+    '''draws starting points that evenly cover the box given by bounds
+    Args:
+        bounds (list of tuples): finite (lower, upper) bound of every variable, equal bounds fix a variable
+        n_starts (int): number of starting points
+        sampler (str): 'lhs' for latin hypercube, 'sobol' for a scrambled Sobol sequence
+        seed (int): seed of the sampler
+    Returns:
+        starts (array): (n_starts, len(bounds))
+    '''
+    lower, upper = np.asarray(bounds, dtype = float).T
+    if not (np.all(np.isfinite(lower)) and np.all(np.isfinite(upper))):
+        raise ValueError('multistart needs finite bounds on every variable to draw starting points')
+    if sampler == 'lhs':
+        unit = qmc.LatinHypercube(d = len(lower), seed = seed).random(n_starts)
+    elif sampler == 'sobol':
+        unit = qmc.Sobol(d = len(lower), seed = seed).random(n_starts)
+    else:
+        raise ValueError("sampler must be 'lhs' or 'sobol'")
+    return lower + unit * (upper - lower)
+
+
+def _space(solver):
+    '''objective, change of variables and bounds of the space the solver optimizes in, the free parameters of a
+    param_adj with a mask or scaling, the full parameter vector otherwise
+    Returns:
+        value_and_grad, pack, unpack, bounds: pack takes the values of the optimized entries only (see param_adj.pack_bound)
+    '''
+    if hasattr(solver, 'free'):
+        return solver.free_value_and_grad, solver.pack_bound, solver.unpack, solver.free_bounds
+    same = lambda x: np.array(x, dtype = float)
+    return solver.value_and_grad, same, same, solver.bounds
+
+
+def _run_start(x0, bounds, cancel_ratio, patience):
+    '''optimizes from one starting point, given in the space the solver optimizes in, inside a worker process'''
+    solver = _solver
+    value_and_grad, pack, unpack, _ = _space(solver)
+    track = {'x': np.array(x0, dtype = float), 'fun': np.inf, 'nfev': 0}
+
+    def fun(x):
+        f, g = value_and_grad(x)
+        track['nfev'] += 1
+        if f < track['fun']:
+            track['x'], track['fun'] = np.array(x, dtype = float), f
+        with _best.get_lock():
+            if f < _best.value:
+                _best.value = f
+            best = _best.value
+        if track['nfev'] >= patience and track['fun'] > cancel_ratio * best:
+            raise _hopeless
+        return f, g
+
+    if solver.method in hh_adjoint.least_squares_methods:
+        # least squares fits converge in a few jacobian evaluations, they are not cancelled; they take and return full vectors
+        optim = solver.least_squares(unpack(x0))
+        optim.x0 = unpack(x0)
+        return optim
+    try:
+        optim = optimize.minimize(fun, x0, jac = True, bounds = bounds, method = solver.method, tol = getattr(solver, 'tol', None))
+    except _hopeless:
+        optim = optimize.OptimizeResult(x = track['x'], fun = track['fun'], success = False, status = -1,
+                                        nfev = track['nfev'], message = 'cancelled, best cost stayed above cancel_ratio times the best start')
+    optim.z = optim.x
+    optim.x = unpack(optim.z)
+    optim.x0 = unpack(x0)
+    return optim
+
+
+def multistart(solver, n_starts, bounds = None, sampler = 'lhs', x0 = None, max_workers = None, seed = None, cancel_ratio = 10.0, patience = 20):
+    '''runs the optimization of a stim_adj or param_adj instance from many starting points in parallel
+
+    Args:
+        solver (stim_adj or param_adj): configured recovery instance, its value_and_grad, method and tol are used,
+                                        for param_adj its free_value_and_grad so fixed parameters stay fixed
+        n_starts (int): number of starting points drawn from the bounds
+        bounds (list of tuples): box the starting points are drawn from, defaults to solver.bounds, only the entries
+                                 of free parameters are used; the optimization itself uses the bounds of solver.optimize
+        sampler (str): 'lhs' or 'sobol'
+        x0 (array): optional extra starting point, e.g. the solver's own initial guess
+        max_workers (int): number of worker processes, defaults to the number of cores
+        seed (int): seed of the sampler
+        cancel_ratio (float): a start is cancelled once its best cost exceeds cancel_ratio times the best of all starts
+        patience (int): cost evaluations a start gets before it can be cancelled
+    Returns:
+        results (list): OptimizeResult of every start ranked by final cost, x and the starting point x0 are full parameter vectors
+    '''
+    _, pack, _, opt_bounds = _space(solver)
+    opt_bounds = opt_bounds if len(opt_bounds) else None
+    if bounds is None:
+        bounds = solver.bounds
+    if bounds is None or len(bounds) == 0:
+        raise ValueError('multistart needs bounds, pass them here or when creating the solver')
+    # a param_adj with fixed parameters is started and optimized over its free parameters only
+    free = getattr(solver, 'free', np.arange(len(bounds)))
+    starts = np.array([pack(start) for start in sample_starts([bounds[i] for i in free], n_starts, sampler, seed)])
+    if x0 is not None:
+        starts = np.vstack([pack(np.asarray(x0, dtype = float)[free]), starts])
+
+    best = multiprocessing.Value('d', np.inf)
+    with ProcessPoolExecutor(max_workers = max_workers, initializer = _init_worker, initargs = (solver, best)) as pool:
+        futures = [pool.submit(_run_start, start, opt_bounds, cancel_ratio, patience) for start in starts]
+        results = [future.result() for future in futures]
+    return sorted(results, key = lambda optim: optim.fun)
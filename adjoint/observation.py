@@ -0,0 +1,129 @@
+import autograd.numpy as np
+
+
+class obs_operator:
+    def __init__(self, t_sim, t_data, V_data, mode = 'linear', tol = None):
+        '''
+        maps every ground truth sample onto simulation step indices once, so the misfit
+        becomes a single gather and reduce instead of a search at every euler step
+
+        Args:
+            t_sim (array): simulation time steps
+            t_data (array): time stamps of the ground truth samples
+            V_data (array): ground truth voltage samples
+            mode (str): 'exact' keeps the samples that fall on a simulation step (within tol)
+                        'nearest' snaps each sample to the closest simulation step
+                        'linear' interpolates between the two simulation steps bracketing each sample
+            tol (float): matching tolerance in time units, defaults to 1e-6 of the simulation step
+        '''
+        t_sim = np.asarray(t_sim, dtype = float)
+        t_data = np.asarray(t_data, dtype = float)
+        V_data = np.asarray(V_data, dtype = float)
+        if mode not in ('exact', 'nearest', 'linear'):
+            raise ValueError("mode must be one of 'exact', 'nearest' or 'linear'")
+
+        self.mode = mode
+        self.n_sim = len(t_sim)
+        #normalization matches the original cost, which divided by the full data length
+        self.n_data = len(t_data)
+
+        step = t_sim[1] - t_sim[0] if self.n_sim > 1 else 1.0
+        if tol is None:
+            tol = 1e-6 * step
+        self.tol = tol
+
+        # lower bracketing step of every sample and its fractional position towards the next step
+        last = max(self.n_sim - 2, 0)
+        idx0 = np.clip(np.searchsorted(t_sim, t_data + tol, side = 'right') - 1, 0, last)
+        idx1 = np.minimum(idx0 + 1, self.n_sim - 1)
+        span = np.where(idx1 > idx0, t_sim[idx1] - t_sim[idx0], 1.0)
+        w1 = np.clip((t_data - t_sim[idx0]) / span, 0.0, 1.0)
+
+        # samples sitting on a step within tol are treated as exact hits
+        on_lower = np.abs(t_data - t_sim[idx0]) <= tol
+        on_upper = np.abs(t_data - t_sim[idx1]) <= tol
+        inside = (t_data >= t_sim[0] - tol) & (t_data <= t_sim[-1] + tol)
+
+        if mode == 'exact':
+            keep = inside & (on_lower | on_upper)
+            idx0 = np.where(on_lower, idx0, idx1)
+            w1 = np.zeros_like(w1)
+        elif mode == 'nearest':
+            keep = inside
+            idx0 = np.where(w1 > 0.5, idx1, idx0)
+            w1 = np.zeros_like(w1)
+        else:
+            keep = inside
+            idx0 = np.where(on_lower | ~on_upper, idx0, idx1)
+            w1 = np.where(on_lower | on_upper, 0.0, w1)
+
+        self.idx0 = idx0[keep]
+        self.idx1 = idx1[keep]
+        self.w1 = w1[keep]
+        self.w0 = 1.0 - self.w1
+        self.V_obs = V_data[keep]
+        self.n_dropped = int(np.sum(~keep))
+        #skip the second gather whenever no sample lies strictly between two steps
+        self.interp = bool(np.any(self.w1 > 0.0))
+
+    def project(self, V_record):
+        '''gathers the simulated voltage at the data time stamps
+        Args:
+            V_record (array): simulated voltage at every simulation step, leading axes index ensemble members
+        Returns:
+            V_sim (array): simulated voltage at each retained data sample
+        '''
+        if self.interp:
+            return self.w0 * V_record[..., self.idx0] + self.w1 * V_record[..., self.idx1]
+        return V_record[..., self.idx0]
+
+    def residual(self, V_record):
+        '''simulated minus observed voltage at each retained data sample'''
+        return self.project(V_record) - self.V_obs
+
+    def misfit(self, V_record):
+        '''mean squared error between simulation and data, differentiable with autograd'''
+        return np.sum(self.residual(V_record)**2, axis = -1) / self.n_data
+
+    def misfit_grad(self, V_record):
+        '''gradient of the misfit with respect to every entry of V_record
+        Returns:
+            dJdV (array): same length as V_record
+        '''
+        return self.adjoint(2.0 * self.residual(V_record) / self.n_data)
+
+    def __bracket(self, idx, start, stop):
+        '''range of retained samples whose step index lies in [start, stop), samples are in time order'''
+        return np.searchsorted(idx, start), np.searchsorted(idx, stop)
+
+    def accumulate(self, V_sim, V_seg, start):
+        '''adds the contribution of a contiguous block of the voltage record to the projected voltage
+        Args:
+            V_sim (array): running projection, one entry per retained sample along the last axis, updated in place
+            V_seg (array): simulated voltage for steps start, start + 1, ... along the last axis
+            start (int): simulation step of V_seg[0]
+        '''
+        stop = start + V_seg.shape[-1]
+        a, b = self.__bracket(self.idx0, start, stop)
+        V_sim[..., a:b] += self.w0[a:b] * V_seg[..., self.idx0[a:b] - start]
+        if self.interp:
+            a, b = self.__bracket(self.idx1, start, stop)
+            V_sim[..., a:b] += self.w1[a:b] * V_seg[..., self.idx1[a:b] - start]
+        return V_sim
+
+    def adjoint(self, dJdobs, start = 0, stop = None):
+        '''scatters a gradient with respect to the projected voltage back onto the simulation steps
+        Args:
+            dJdobs (array): gradient with respect to the simulated voltage at each retained sample
+            start, stop (int): block of simulation steps to return, defaults to the whole record
+        Returns:
+            dJdV (array): gradient with respect to the voltage at steps start to stop
+        '''
+        if stop is None:
+            stop = self.n_sim
+        a, b = self.__bracket(self.idx0, start, stop)
+        dJdV = np.bincount(self.idx0[a:b] - start, weights = self.w0[a:b] * dJdobs[a:b], minlength = stop - start)
+        if self.interp:
+            a, b = self.__bracket(self.idx1, start, stop)
+            dJdV = dJdV + np.bincount(self.idx1[a:b] - start, weights = self.w1[a:b] * dJdobs[a:b], minlength = stop - start)
+        return dJdV
@@ -1,10 +1,28 @@
 import autograd.numpy as np
-from autograd import grad, jacobian
+from autograd import grad, jacobian, value_and_grad
 from scipy import optimize
 from scipy.optimize import minimize
+from observation import obs_operator
+import hh_adjoint
+import hh_ensemble
+import hh_integrators
+from eval_cache import eval_cache
+from hh_rates import get_gating
+
+
+def _block_mean(x, factor):
+    '''mean of every block of factor consecutive samples, the last block may be shorter, one value per x[::factor]'''
+    x = np.asarray(x, dtype = float)
+    n = len(x) // factor * factor
+    mean = x[:n].reshape(-1, factor).mean(1)
+    return mean if n == len(x) else np.append(mean, x[n:].mean())
+
 
 class param_adj:
-    def __init__(self, V_data, t_data, I_data, dt, init_guess, bounds = [], method = 'CG', tol = 1e-5):
+    #attributes the cached evaluations depend on, assigning any of them clears self.cache, self.lsq_cache and self.free_cache
+    _settings = ('V0', 't_sim', 'obs', 'I_sim', 'dt', 'integrator', 'gating', 'grad_mode', 'rk_options', 'I_edges')
+
+    def __init__(self, V_data, t_data, I_data, dt, init_guess, bounds = [], method = 'CG', tol = 1e-5, obs_mode = 'linear', grad_mode = 'autograd', checkpoint_budget = 50000, gating = None, integrator = 'euler', rk_options = None, mask = None, scaling = None, init_state = None):
         
         #variables from upload.py
         self.V0 = V_data[0]
@@ -13,67 +31,160 @@ class param_adj:
         self.t_data = t_data
         
         self.init_guess = init_guess
+        #(V, m, h, n) at the first sample, e.g. carried over from the previous window of a long recording; its gates
+        #replace the initial gates of init_guess and are held fixed unless a mask frees them
+        self.init_state = init_state
+        if init_state is not None:
+            self.V0 = float(init_state[0])
+            self.init_guess = np.concatenate([np.asarray(init_guess, dtype = float)[:7], np.asarray(init_state, dtype = float)[1:]])
         
         #simulation parameters
         self.dt = dt
-        self.t_sim = np.arange(0, t_data[-1], dt)
+        #starts at the first sample, so windows cut out of a long recording simulate only their own span
+        self.t_sim = np.arange(t_data[0], t_data[-1], dt)
+        self.obs = obs_operator(self.t_sim, t_data, V_data, obs_mode)
+        #stimulus sampled on the simulation grid, identical to I_data when dt matches the data step
+        self.I_sim = np.interp(self.t_sim, t_data, I_data)
         
         #set optimization parameters
         self.bounds = bounds
         self.method = method
         self.tol = tol
+        if grad_mode not in ('autograd', 'adjoint', 'checkpoint'):
+            raise ValueError("grad_mode must be 'autograd', 'adjoint' or 'checkpoint'")
+        self.grad_mode = grad_mode
+        #maximum number of trajectory states held in memory in 'checkpoint' mode
+        self.checkpoint_budget = checkpoint_budget
+        #None or 'analytic' for the rate functions, 'table' or an hh_rates.rate_table for tabulated rates
+        self.gating = get_gating(gating)
+        #'euler', 'rush_larsen' (exponential euler on the gates), 'exponential' (on V as well, stable at coarse dt)
+        #or 'rk23' (adaptive steps, autograd only)
+        if integrator not in hh_integrators.schemes:
+            raise ValueError("integrator must be 'euler', 'rush_larsen', 'exponential' or 'rk23'")
+        if integrator == 'rk23' and grad_mode != 'autograd':
+            raise ValueError("the adaptive integrator only supports grad_mode = 'autograd'")
+        self.integrator = integrator
+        #keyword arguments passed to hh_integrators.rk23, the adaptive steps never cross a jump of the stimulus
+        self.rk_options = {} if rk_options is None else rk_options
+        self.I_edges = t_data[1:][np.diff(I_data) != 0]
+        #cost and gradient of recently evaluated params, cleared whenever a setting in _settings is assigned
+        self.cache = eval_cache()
+        #'trf', 'dogbox' or 'lm' as method fits with scipy.optimize.least_squares and the forward sensitivity jacobian
+        if method in hh_adjoint.least_squares_methods and integrator == 'rk23':
+            raise ValueError('least squares fits need a fixed step integrator')
+        #residual and jacobian of recently evaluated params
+        self.lsq_cache = eval_cache(2)
+        #True for the parameters handed to the optimizer, by default every parameter whose lower and upper bounds are equal
+        #is fixed at that value, the others are free; optimize() and least_squares() only see the free ones
+        #scaling: None, 'affine' (finite bounds onto [0, 1], else relative to init_guess) or 'log' for every free parameter,
+        #or a list with one entry per parameter; a single 'log' leaves the reversal potentials unscaled
+        self.mask = mask
+        self.scaling = scaling
+        self.__free_space(mask, scaling)
+        #objective and gradient of recently evaluated free vectors
+        self.free_cache = eval_cache()
     
-    # Define the HH model helper equations, note these are repeated from the stim_adj class, but for independent completeness included seperately
+    def __setattr__(self, name, value):
+        # cached evaluations are only valid for the settings they were computed with
+        object.__setattr__(self, name, value)
+        if name in self._settings:
+            self.clear_caches()
+
+    def clear_caches(self):
+        '''forgets every cached cost, gradient, residual and jacobian, called whenever a setting in _settings is assigned'''
+        for cache in ('cache', 'lsq_cache', 'free_cache'):
+            if cache in self.__dict__:
+                self.__dict__[cache].clear()
+
+    # Define the HH model helper equations, the kinetics are shared with stim_adj through hh_rates
     def alpha_m(self, V):
         '''transition rate constant for m-gates (rapid response Na) shut gates opening as a function of voltage'''
-        return 0.1 * (V + 40.0) / (1.0 - np.exp(-(V + 40.0) / 10.0))
+        return self.gating.alpha_m(V)
 
     def beta_m(self, V):
         '''transition rate constant for m-gates (rapid response Na) open gates closing as a function of voltage '''
-        return 4.0 * np.exp(-(V + 65.0) / 18.0)
+        return self.gating.beta_m(V)
 
     def alpha_h(self, V):
         '''transition rate constant for h-gates (slow response Na) shut gates opening as a function of voltage'''
-        return 0.07 * np.exp(-(V + 65.0) / 20.0)
+        return self.gating.alpha_h(V)
 
     def beta_h(self, V):
         '''transition rate constant for h-gates (slow response Na) open gates closing as a function of voltage '''
-        return 1.0 / (1.0 + np.exp(-(V + 35.0) / 10.0))
+        return self.gating.beta_h(V)
 
     def alpha_n(self, V):
         '''transition rate constant for n-gates (slow response K) shut gates opening as a function of voltage'''
-        return 0.01 * (V + 55.0) / (1.0 - np.exp(-(V + 55.0) / 10.0))
+        return self.gating.alpha_n(V)
 
     def beta_n(self, V):
         '''transition rate constant for n-gates (slow response K) open gates closing as a function of voltage '''
-        return 0.125 * np.exp(-(V + 65) / 80.0)
+        return self.gating.beta_n(V)
     
-    def __forward(self, params, I, V, t):
-        g_Na, g_K, g_L, E_Na, E_K, E_L, C_m, m, h, n = params
+    def __forward(self, params, I, V, m, h, n):
+        g_Na, g_K, g_L, E_Na, E_K, E_L, C_m = params[:7]
         dVdt = (I - g_Na * m**3 * h * (V - E_Na) - g_K * n**4 * (V - E_K) - g_L * (V - E_L)) / C_m
-        dmdt = self.alpha_m(V) * (1 - m) - self.beta_m(V) * m
-        dhdt = self.alpha_h(V) * (1 - h) - self.beta_h(V) * h
-        dndt = self.alpha_n(V) * (1 - n) - self.beta_n(V) * n
+        alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n = self.gating.rates(V)
+        dmdt = alpha_m * (1 - m) - beta_m * m
+        dhdt = alpha_h * (1 - h) - beta_h * h
+        dndt = alpha_n * (1 - n) - beta_n * n
         return dVdt, dmdt, dhdt, dndt
+
+    def __step(self, params, I, V, m, h, n):
+        '''advances the state by one step of the selected fixed step integrator'''
+        if self.integrator != 'euler':
+            return hh_integrators.steps[self.integrator](V, m, h, n, I, params[:7], self.dt, self.gating)
+        dVdt, dmdt, dhdt, dndt = self.__forward(params, I, V, m, h, n)
+        return V + dVdt * self.dt, m + dmdt * self.dt, h + dhdt * self.dt, n + dndt * self.dt
+
+    def __adaptive(self, params, t_end = None):
+        '''adaptive runge kutta solve up to t_end (default the last sample), returns the accepted times and the state (V, m, h, n) at each'''
+        def rhs(t, x):
+            V, m, h, n = x
+            return self.__forward(params, np.interp(t, self.t_data, self.I_data), V, m, h, n)
+        return hh_integrators.rk23(rhs, (self.V0, params[7], params[8], params[9]), self.t_sim[0], self.t_data[-1] if t_end is None else t_end, self.dt,
+                                   tstops = self.I_edges, **self.rk_options)
     
     def integrate_HH(self, params):
+        if self.integrator == 'rk23':
+            t_record, x_record = self.__adaptive(params)
+            return np.interp(self.t_sim, t_record, np.array([x[0] for x in x_record]))
         g_Na, g_K, g_L, E_Na, E_K, E_L, C_m, m, h, n = params
         V_record = np.zeros_like(self.t_sim)
         V = self.V0
 
-        for i in range(len(self.t)):
+        for i in range(len(self.t_sim)):
             V_record[i] = V
-            dVdt, dmdt, dhdt, dndt =self.__forward(params, self.I_data[i], V, self.t_sim[i])
-            V += dVdt * self.dt
-            m += dmdt * self.dt
-            h += dhdt * self.dt
-            n += dndt * self.dt
+            V, m, h, n = self.__step(params, self.I_sim[i], V, m, h, n)
         return V_record
 
+    def integrate_batch(self, params_batch):
+        '''forward euler for many parameter vectors stepped together
+        Args:
+            params_batch (array): (K, 10) rows of (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m, m, h, n)
+        Returns:
+            V_record (array): (K, len(t_sim)) record of voltages of each parameter vector
+        '''
+        params_batch = np.atleast_2d(np.asarray(params_batch, dtype = float))
+        if self.integrator == 'rk23':
+            return np.array([self.integrate_HH(params) for params in params_batch])
+        x0 = np.column_stack([np.full(len(params_batch), self.V0), params_batch[:, 7:]])
+        return hh_ensemble.integrate_ensemble(x0, self.I_sim, params_batch[:, :7], self.dt, gating = self.gating, scheme = self.integrator)
+
+    def cost_batch(self, params_batch):
+        '''objective function for a (K, 10) batch of parameter vectors, returns the (K,) costs'''
+        params_batch = np.atleast_2d(np.asarray(params_batch, dtype = float))
+        if self.integrator == 'rk23':
+            return np.array([self.cost(params) for params in params_batch])
+        x0 = np.column_stack([np.full(len(params_batch), self.V0), params_batch[:, 7:]])
+        return hh_ensemble.ensemble_misfit(x0, self.I_sim, params_batch[:, :7], self.dt, self.obs, gating = self.gating, scheme = self.integrator)
+
         
     def __cost(self, params): 
-        cost = 0
-        
+        if self.integrator == 'rk23':
+            # the accepted steps change with params, so the data is matched to them on every evaluation
+            t_record, x_record = self.__adaptive(params)
+            return obs_operator(t_record, self.t_data, self.V_data, 'linear').misfit(np.array([x[0] for x in x_record]))
         V_record = []
         V = self.V0
         g_Na, g_K, g_L, E_Na, E_K, E_L, C_m, m, h, n = params
@@ -83,26 +194,236 @@ class param_adj:
             # run forward step
             V_record.append(V)
         
-            dVdt, dmdt, dhdt, dndt = self.__forward(params, self.I_data[i], V, self.t_sim[i])
-            V += dVdt * self.dt
-            m += dmdt * self.dt
-            h += dhdt * self.dt
-            n += dndt * self.dt
-
-            # compute cost
-            if self.t_sim[i] in t_data:
-                j = np.where(self.t_data == self.t_sim[i])
-                cost += (V_record[i] - self.V_data[j])**2
-         
-        cost = cost/len(self.t_data)
-
-            
+            V, m, h, n = self.__step(params, self.I_sim[i], V, m, h, n)
+
+        # compute cost against every observed sample in one pass
+        cost = self.obs.misfit(np.array(V_record))
+
         return cost
     
-    def optimize(self): 
-        grad_AD = grad(self.__cost, 0)
-        optim = optimize.minimize(self.__cost, self.init_guess, args = (), jac = grad_AD, bounds = self.bounds, method = self.method, tol = self.tol)
+    def __adjoint_grad(self, params):
+        '''cost and its gradient with respect to all ten parameters from one forward and one reverse sweep'''
+        x0 = (self.V0, params[7], params[8], params[9])
+        if self.grad_mode == 'checkpoint':
+            J, dJdx0, dJdp, dJdI = hh_adjoint.checkpointed_gradient(x0, self.I_sim, params[:7], self.dt, self.obs, self.checkpoint_budget, self.gating, self.integrator)
+        else:
+            traj = hh_adjoint.forward_sweep(x0, self.I_sim, params[:7], self.dt, self.gating, self.integrator)
+            J = self.obs.misfit(traj[:, 0])
+            dJdx0, dJdp, dJdI = hh_adjoint.reverse_sweep(traj, self.I_sim, params[:7], self.dt, self.obs.misfit_grad(traj[:, 0]),
+                                                         gating = self.gating, scheme = self.integrator)
+        return J, np.concatenate([dJdp, dJdx0[1:]])
+
+    def __evaluate(self, params):
+        '''objective function alone, evaluated with the solver matching grad_mode'''
+        if self.grad_mode == 'autograd':
+            return self.__cost(params)
+        x0 = (self.V0, params[7], params[8], params[9])
+        if self.grad_mode == 'checkpoint':
+            V_sim = hh_adjoint.observe(x0, self.I_sim, params[:7], self.dt, self.obs, self.checkpoint_budget, self.gating, self.integrator)
+            return np.sum((V_sim - self.obs.V_obs)**2) / self.obs.n_data
+        return self.obs.misfit(hh_adjoint.forward_sweep(x0, self.I_sim, params[:7], self.dt, self.gating, self.integrator)[:, 0])
+
+    def value_and_grad(self, params):
+        '''objective and its gradient from a single fused pass using grad_mode,
+        repeated calls at the same params are served from self.cache'''
+        hit = self.cache.get(params)
+        if hit is not None and hit[1] is not None:
+            self.cache.hits += 1
+            return hit[0], hit[1].copy()
+        self.cache.misses += 1
+        if self.grad_mode == 'autograd':
+            J, g = value_and_grad(self.__cost, 0)(params)
+        else:
+            J, g = self.__adjoint_grad(params)
+        self.cache.put(params, float(J), g)
+        return float(J), np.array(g, dtype = float)
+
+    def cost(self, params):
+        '''objective function, reuses the cached value when params was evaluated recently'''
+        hit = self.cache.get(params)
+        if hit is not None:
+            self.cache.hits += 1
+            return hit[0]
+        self.cache.misses += 1
+        J = float(self.__evaluate(params))
+        self.cache.put(params, J)
+        return J
+
+    def gradient(self, params):
+        '''gradient of the objective with respect to (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m, m, h, n) using grad_mode'''
+        return self.value_and_grad(params)[1]
+
+    def __free_space(self, mask, scaling):
+        '''splits the ten parameters into free and fixed ones and sets up the change of variables of the free ones'''
+        init = np.asarray(self.init_guess, dtype = float)
+        lower = np.array([-np.inf if not len(self.bounds) or self.bounds[i][0] is None else self.bounds[i][0] for i in range(10)], dtype = float)
+        upper = np.array([np.inf if not len(self.bounds) or self.bounds[i][1] is None else self.bounds[i][1] for i in range(10)], dtype = float)
+        if mask is None:
+            mask = lower != upper
+            if self.init_state is not None:
+                mask[7:] = False
+        self.free = np.flatnonzero(np.asarray(mask, dtype = bool))
+        if not len(self.free):
+            raise ValueError('at least one parameter must be free')
+        #fixed parameters keep equal bounds or init_guess, the free entries are filled in by unpack
+        self.fixed_values = np.where(lower == upper, lower, init)
+        if self.init_state is not None:
+            self.fixed_values[7:] = init[7:]
+        self.fixed_values[self.free] = 0.0
+        self.embed = np.eye(10)[:, self.free]
+        if scaling is None or isinstance(scaling, str):
+            positive = (0, 1, 2, 6, 7, 8, 9) if scaling == 'log' else range(10)
+            scaling = [scaling if i in positive else None for i in range(10)]
+        kinds = [scaling[i] for i in self.free]
+        if any(kind not in (None, 'affine', 'log') for kind in kinds):
+            raise ValueError("scaling must be None, 'affine' or 'log'")
+        # x = offset + width * z, or x = exp(z) for log scaled parameters
+        lo, hi, x0 = lower[self.free], upper[self.free], init[self.free]
+        bounded = np.isfinite(lo) & np.isfinite(hi)
+        affine = np.array([kind == 'affine' for kind in kinds])
+        self.log_scaled = np.array([kind == 'log' for kind in kinds])
+        if np.any(self.log_scaled & (x0 <= 0)):
+            raise ValueError('log scaled parameters need a positive initial guess')
+        self.offset = np.where(affine & bounded, lo, 0.0)
+        self.width = np.where(affine, np.where(bounded, hi - lo, np.where(x0 != 0, np.abs(x0), 1.0)), 1.0)
+        self.width = np.where(self.width > 0, self.width, 1.0)
+        self.free_bounds = [] if not len(self.bounds) else [(float(a) if np.isfinite(a) else None, float(b) if np.isfinite(b) else None)
+                                                             for a, b in zip(self.pack_bound(lo), self.pack_bound(hi))]
+
+    def pack_bound(self, x_free):
+        '''free space value of every free parameter value in x_free, -inf for log scaled zeros'''
+        x_free = np.asarray(x_free, dtype = float)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return np.where(self.log_scaled, np.log(np.where(self.log_scaled, x_free, 1.0)), (x_free - self.offset) / self.width)
+
+    def pack(self, params):
+        '''free (and rescaled) parameters of a full ten parameter vector'''
+        return self.pack_bound(np.asarray(params, dtype = float)[self.free])
+
+    def unpack(self, z):
+        '''full ten parameter vector from the free vector z, the fixed parameters folded in as constants'''
+        x_free = np.where(self.log_scaled, np.exp(np.where(self.log_scaled, z, 0.0)), self.offset + self.width * z)
+        return self.fixed_values + np.dot(self.embed, x_free)
+
+    def __dxdz(self, z):
+        return np.where(self.log_scaled, np.exp(np.where(self.log_scaled, z, 0.0)), self.width)
+
+    def free_value_and_grad(self, z):
+        '''objective and its gradient with respect to the free vector z, only the free parameters are differentiated,
+        repeated calls at the same z are served from self.free_cache'''
+        hit = self.free_cache.get(z)
+        if hit is not None and hit[1] is not None:
+            self.free_cache.hits += 1
+            return hit[0], hit[1].copy()
+        self.free_cache.misses += 1
+        z = np.asarray(z, dtype = float)
+        if self.grad_mode == 'autograd':
+            J, g = value_and_grad(lambda z: self.__cost(self.unpack(z)))(z)
+        else:
+            J, g = self.__adjoint_grad(self.unpack(z))
+            g = g[self.free] * self.__dxdz(z)
+        self.free_cache.put(z, float(J), g)
+        return float(J), np.array(g, dtype = float)
+
+    def residual_and_jacobian(self, params):
+        '''residual at every observed sample scaled by 1 / sqrt(n_data), so its sum of squares is the objective,
+        and its jacobian with respect to all ten parameters from the forward sensitivity equations'''
+        return self.__residual_and_jacobian(params, np.arange(10))
+
+    def __residual_and_jacobian(self, params, columns):
+        '''residual and its jacobian with respect to the parameters in columns, only those sensitivities are integrated,
+        repeated calls at the same params are served from self.lsq_cache'''
+        key = np.concatenate([params, columns])
+        hit = self.lsq_cache.get(key)
+        if hit is not None:
+            self.lsq_cache.hits += 1
+            return hit
+        self.lsq_cache.misses += 1
+        x0 = (self.V0, params[7], params[8], params[9])
+        traj = hh_adjoint.forward_sweep(x0, self.I_sim, params[:7], self.dt, self.gating, self.integrator)
+        # the gates start at params[7:], the model parameters are params[:7]
+        select = np.eye(10)[:, columns]
+        dx0 = np.vstack([np.zeros((1, len(columns))), select[7:]])
+        dV = hh_adjoint.tangent_sweep(traj, self.I_sim, params[:7], self.dt, dx0, select[:7], None, self.gating, self.integrator)
+        scale = 1.0 / np.sqrt(self.obs.n_data)
+        r, jac = scale * self.obs.residual(traj[:, 0]), scale * self.obs.project(dV.T).T
+        self.lsq_cache.put(key, r, jac)
+        return r, jac
+
+    def free_residual_and_jacobian(self, z):
+        '''residual and its jacobian with respect to the free vector z'''
+        r, jac = self.__residual_and_jacobian(self.unpack(z), self.free)
+        return r, jac * self.__dxdz(z)
+
+    def least_squares(self, x0 = None, method = None, maxiter = None):
+        '''Gauss-Newton type fit of the free parameters with scipy.optimize.least_squares, the jacobian from the forward
+        sensitivity equations of the free parameters only
+        Args:
+            x0 (array): full ten parameter starting point, defaults to init_guess
+            method (str): 'trf', 'dogbox' or 'lm' (unbounded only), defaults to self.method if it is one of them, else 'trf'
+            maxiter (int): cap on the residual evaluations (max_nfev), None for scipy's default
+        Returns:
+            optim (OptimizeResult): optim.x holds all ten parameters and optim.z the free vector, optim.fun is the objective
+                                    as with optimize() and optim.residual the residual vector
+        '''
+        if x0 is None:
+            x0 = self.init_guess
+        if method is None:
+            method = self.method if self.method in hh_adjoint.least_squares_methods else 'trf'
+        bounds = (-np.inf, np.inf)
+        if len(self.free_bounds):
+            bounds = tuple(np.array([(-np.inf if lo is None else lo, np.inf if hi is None else hi) for lo, hi in self.free_bounds], dtype = float).T)
+        # x_scale = 'jac' evens out parameters of very different magnitude
+        optim = optimize.least_squares(lambda z: self.free_residual_and_jacobian(z)[0], self.pack(x0),
+                                       jac = lambda z: self.free_residual_and_jacobian(z)[1], bounds = bounds, method = method, x_scale = 'jac',
+                                       max_nfev = maxiter)
+        optim.residual = optim.fun
+        optim.fun = float(np.sum(optim.residual**2))
+        optim.z = optim.x
+        optim.x = self.unpack(optim.z)
         return optim
+
+    def optimize(self, x0 = None, maxiter = None): 
+        # x0 overrides init_guess, e.g. with the optimum of a coarser level, maxiter optionally caps the iterations
+        if x0 is None:
+            x0 = self.init_guess
+        if self.method in hh_adjoint.least_squares_methods:
+            return self.least_squares(x0, maxiter = maxiter)
+        # scipy receives cost and gradient together, one forward/backward pass per iterate, over the free parameters only
+        optim = optimize.minimize(self.free_value_and_grad, self.pack(x0), args = (), jac = True, bounds = self.free_bounds or None,
+                                  method = self.method, tol = self.tol, options = {} if maxiter is None else {'maxiter': maxiter})
+        # optim.jac stays the gradient with respect to the free vector optim.z
+        optim.z = optim.x
+        optim.x = self.unpack(optim.z)
+        return optim
+
+    def state(self, params, t):
+        '''simulated state (V, m, h, n) at time t, carried into the next window of a long recording;
+        t may lie up to one data step past the last sample, where the next contiguous window starts,
+        the stimulus is held at its last sample there'''
+        if t > self.t_data[-1] + 1.5 * (self.t_data[-1] - self.t_data[-2]):
+            raise ValueError('state is only simulated up to one data step past the last sample')
+        if self.integrator == 'rk23':
+            return tuple(float(q) for q in self.__adaptive(params, t)[1][-1])
+        k = max(int(round((t - self.t_sim[0]) / self.dt)), 0)
+        I = np.interp(self.t_sim[0] + self.dt * np.arange(k), self.t_data, self.I_data)
+        x0 = (self.V0, params[7], params[8], params[9])
+        return hh_adjoint.advance(x0, I, params[:7], self.dt, gating = self.gating, scheme = self.integrator)
+
+    def coarsen(self, factor, integrator = None):
+        '''the same recovery problem on every factor-th data sample with a factor times larger dt, the stimulus is averaged
+        over each block of factor samples instead of decimated, so a pulse shorter than the coarse step keeps its charge
+        Args:
+            factor (int): decimation of the data and coarsening of the time step
+            integrator (str): integrator of the coarse problem, defaults to the one of this instance
+        Returns:
+            coarse (param_adj): new instance with every other setting copied from this one
+        '''
+        return param_adj(self.V_data[::factor], self.t_data[::factor], _block_mean(self.I_data, factor), self.dt * factor, self.init_guess,
+                         bounds = self.bounds, method = self.method, tol = self.tol, obs_mode = self.obs.mode, grad_mode = self.grad_mode,
+                         checkpoint_budget = self.checkpoint_budget, gating = self.gating,
+                         integrator = self.integrator if integrator is None else integrator, rk_options = self.rk_options,
+                         mask = self.mask, scaling = self.scaling, init_state = self.init_state)
     
     def recovery(self):
         optim = self.optimize().x
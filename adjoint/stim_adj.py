@@ -1,11 +1,21 @@
 import autograd.numpy as np 
-from autograd import grad
+from autograd import value_and_grad
+from autograd.scipy.special import erf
 from scipy import optimize
-import matplotlib.pyplot as plt
+from observation import obs_operator
+import hh_adjoint
+import hh_ensemble
+import hh_integrators
+from eval_cache import eval_cache
+from hh_rates import get_gating
 
 
 class stim_adj: 
-    def __init__(self, V_data, t_data, dt, HH_params, guess_a, guess_c, bounds = [], method =  'BFGS'):
+    #attributes the cached evaluations depend on, assigning any of them clears self.cache and self.lsq_cache
+    _settings = ('V0', 't_sim', 'obs', 'dt', 'b_init', 'integrator', 'gating', 'grad_mode', 'rk_options', 'step_mean',
+                 'g_Na', 'g_K', 'g_L', 'E_Na', 'E_K', 'E_L', 'C_m', 'm', 'n', 'h')
+
+    def __init__(self, V_data, t_data, dt, HH_params, guess_a, guess_c, bounds = [], method =  'BFGS', obs_mode = 'linear', grad_mode = 'autograd', checkpoint_budget = 50000, gating = None, integrator = 'euler', rk_options = None, b = 152.25, init_state = None, step_mean = False):
         '''
         args:
             V0 (float): defined in upload.py to be initial voltage
@@ -23,7 +33,21 @@ class stim_adj:
                 c: frequency
                 b: center location
             bounds (list of tuples): specifies bounds for each variable
-            method (str): method for optimization
+            method (str): method for optimization, 'trf', 'dogbox' or 'lm' fit with scipy.optimize.least_squares
+                          and the jacobian of the forward sensitivity equations
+            obs_mode (str): how data samples are matched to simulation steps, 'exact', 'nearest' or 'linear'
+            grad_mode (str): 'autograd' to differentiate the cost with autograd, 'adjoint' for the hand written discrete adjoint,
+                             'checkpoint' for the adjoint with a bounded number of stored states
+            checkpoint_budget (int): maximum number of trajectory states held in memory in 'checkpoint' mode
+            gating (None, str or hh_rates): None or 'analytic' for the rate functions, 'table' or an hh_rates.rate_table for tabulated rates
+            integrator (str): 'euler', 'rush_larsen' (exponential euler on the gates), 'exponential' (on V as well,
+                              stable at coarse dt) or 'rk23' (adaptive steps, autograd only)
+            rk_options (dict): keyword arguments passed to hh_integrators.rk23, e.g. rtol, atol, dt_max
+            b (float): center of the impulse, e.g. the stimulus center of a window of a long recording
+            init_state (tuple): (V, m, h, n) at the first sample, e.g. carried over from the previous window of a long recording,
+                                defaults to V_data[0] and the gates of HH_params
+            step_mean (bool): drive every fixed step with the mean of the impulse over the step instead of its value at the
+                              step start, so an impulse narrower than dt keeps its charge; set on the levels built by coarsen
         '''
         
         #variables from empiracle data
@@ -37,43 +61,94 @@ class stim_adj:
         self.g_Na, self.g_K, self.g_L, self.E_Na, self.E_K, self.E_L, self.C_m, self.m, self.n, self.h = HH_params  
         self.a_init = guess_a
         self.c_init = guess_c
-        self.b_init = 152.25
+        self.b_init = b
+        self.init_state = init_state
+        if init_state is not None:
+            self.V0, self.m, self.h, self.n = [float(q) for q in init_state]
         
         #retrieved simulation parameter
-        self.t_sim = np.arange(0, self.t_final, dt)
+        #starts at the first sample, so windows cut out of a long recording simulate only their own span
+        self.t_sim = np.arange(t_data[0], self.t_final, dt)
+        self.obs = obs_operator(self.t_sim, t_data, V_data, obs_mode)
         
         #defining optimization parameters
         self.I_params_init = np.array([guess_a, guess_c])
         self.bounds = bounds
         self.method = method
+        if grad_mode not in ('autograd', 'adjoint', 'checkpoint'):
+            raise ValueError("grad_mode must be 'autograd', 'adjoint' or 'checkpoint'")
+        self.grad_mode = grad_mode
+        self.checkpoint_budget = checkpoint_budget
+        self.gating = get_gating(gating)
+        if integrator not in hh_integrators.schemes:
+            raise ValueError("integrator must be 'euler', 'rush_larsen', 'exponential' or 'rk23'")
+        if integrator == 'rk23' and grad_mode != 'autograd':
+            raise ValueError("the adaptive integrator only supports grad_mode = 'autograd'")
+        self.integrator = integrator
+        self.rk_options = {} if rk_options is None else rk_options
+        self.step_mean = step_mean
+        #cost and gradient of recently evaluated I_params, cleared whenever a setting in _settings is assigned
+        self.cache = eval_cache()
+        if method in hh_adjoint.least_squares_methods and integrator == 'rk23':
+            raise ValueError('least squares fits need a fixed step integrator')
+        #residual and jacobian of recently evaluated I_params
+        self.lsq_cache = eval_cache(2)
 
         
-    # Define the HH model helper equations, these need not automatic imput
+    def __setattr__(self, name, value):
+        # cached evaluations are only valid for the settings they were computed with
+        object.__setattr__(self, name, value)
+        if name in self._settings:
+            self.clear_caches()
+
+    def clear_caches(self):
+        '''forgets every cached cost, gradient, residual and jacobian, called whenever a setting in _settings is assigned'''
+        for cache in ('cache', 'lsq_cache', 'free_cache'):
+            if cache in self.__dict__:
+                self.__dict__[cache].clear()
+
+    # Define the HH model helper equations, these need not automatic imput, the kinetics live in hh_rates
     def alpha_m(self, V):
         '''transition rate constant for m-gates (rapid response Na) shut gates opening as a function of voltage'''
-        return 0.1 * (V + 40.0) / (1.0 - np.exp(-(V + 40.0) / 10.0))
+        return self.gating.alpha_m(V)
 
     def beta_m(self, V):
         '''transition rate constant for m-gates (rapid response Na) open gates closing as a function of voltage '''
-        return 4.0 * np.exp(-(V + 65.0) / 18.0)
+        return self.gating.beta_m(V)
 
     def alpha_h(self, V):
         '''transition rate constant for h-gates (slow response Na) shut gates opening as a function of voltage'''
-        return 0.07 * np.exp(-(V + 65.0) / 20.0)
+        return self.gating.alpha_h(V)
 
     def beta_h(self, V):
         '''transition rate constant for h-gates (slow response Na) open gates closing as a function of voltage '''
-        return 1.0 / (1.0 + np.exp(-(V + 35.0) / 10.0))
+        return self.gating.beta_h(V)
 
     def alpha_n(self, V):
         '''transition rate constant for n-gates (slow response K) shut gates opening as a function of voltage'''
-        return 0.01 * (V + 55.0) / (1.0 - np.exp(-(V + 55.0) / 10.0))
+        return self.gating.alpha_n(V)
 
     def beta_n(self, V):
         '''transition rate constant for n-gates (slow response K) open gates closing as a function of voltage '''
-        return 0.125 * np.exp(-(V + 65) / 80.0)
+        return self.gating.beta_n(V)
 
  
+    def __impulse(self, I_params, t):
+        '''gaussian impulse at times t, or with step_mean its mean over the fixed step starting at each t'''
+        a, c = I_params[0], I_params[1]
+        if not self.step_mean or self.integrator == 'rk23':
+            return a*np.exp(-(t-self.b_init)**2/(2*c**2))
+        s = np.sqrt(2.0)*c
+        return a*c*np.sqrt(np.pi/2)/self.dt*(erf((t+self.dt-self.b_init)/s) - erf((t-self.b_init)/s))
+
+    def __impulse_dc(self, I_params, I, t):
+        '''derivative of the impulse I = __impulse(I_params, t) with respect to the width c'''
+        a, c = I_params[0], I_params[1]
+        if not self.step_mean or self.integrator == 'rk23':
+            return I*(t-self.b_init)**2/c**3
+        edge = lambda u: (u-self.b_init)*np.exp(-(u-self.b_init)**2/(2*c**2))
+        return I/c - a*(edge(t+self.dt) - edge(t))/(c*self.dt)
+
     def __forward(self, I_params, V, m, n, h, t):
         '''full hodgkin huxley model for an unknown stim.
         Args: 
@@ -83,37 +158,88 @@ class stim_adj:
         Returns: 
             dVdt, dmdt, dhdt, dndt (tuple: floats): rate of change for dynamical HH varianbles
         '''
-        I = I_params[0]*np.exp(-(t-self.b_init)**2/(2*I_params[1]**2))
+        I = self.__impulse(I_params, t)
         dVdt = (I - self.g_Na * m**3 * h * (V - self.E_Na) - self.g_K * n**4 * (V - self.E_K) - self.g_L * (V - self.E_L)) / self.C_m
-        dmdt = self.alpha_m(V) * (1 - m) - self.beta_m(V) * m
-        dhdt = self.alpha_h(V) * (1 - h) - self.beta_h(V) * h
-        dndt = self.alpha_n(V) * (1 - n) - self.beta_n(V) * n
+        alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n = self.gating.rates(V)
+        dmdt = alpha_m * (1 - m) - beta_m * m
+        dhdt = alpha_h * (1 - h) - beta_h * h
+        dndt = alpha_n * (1 - n) - beta_n * n
         return dVdt, dmdt, dhdt, dndt
     
+    def __step(self, I_params, V, m, n, h, t):
+        '''advances the state by one step of the selected fixed step integrator'''
+        if self.integrator != 'euler':
+            I = self.__impulse(I_params, t)
+            V, m, h, n = hh_integrators.steps[self.integrator](V, m, h, n, I, self.__hh()[1], self.dt, self.gating)
+            return V, m, n, h
+        dVdt, dmdt, dhdt, dndt = self.__forward(I_params, V, m, n, h, t)
+        return V + dVdt * self.dt, m + dmdt * self.dt, n + dndt * self.dt, h + dhdt * self.dt
+
+    def __adaptive(self, I_params, t_end = None):
+        '''adaptive runge kutta solve up to t_end (default t_final), returns the accepted times and the state (V, m, h, n) at each'''
+        def rhs(t, x):
+            V, m, h, n = x
+            return self.__forward(I_params, V, m, n, h, t)
+        return hh_integrators.rk23(rhs, (self.V0, self.m, self.h, self.n), self.t_sim[0], self.t_final if t_end is None else t_end, self.dt,
+                                   tstops = [self.b_init], **self.rk_options)
+
     # Forward Euler to solve IVP
     def integrate_HH(self, I_params):
-        '''forward euler method to solve Hodgkin Huxley
+        '''solves Hodgkin Huxley with the selected integrator, forward euler by default
         
         Returns: 
-            V_record (array): record of voltages for each time step
+            V_record (array): record of voltages for each time step, adaptive solutions are interpolated onto t_sim
         '''
+        if self.integrator == 'rk23':
+            t_record, x_record = self.__adaptive(I_params)
+            return np.interp(self.t_sim, t_record, np.array([x[0] for x in x_record]))
         V_record = np.zeros_like(self.t_sim)
         V, m, n, h = self.V0, self.m, self.n, self.h
         
         
         for i in range(len(self.t_sim)):
             V_record[i] = V
-            dVdt, dmdt, dhdt, dndt = self.__forward(I_params, V, m, n, h, self.t_sim[i])
-            V += dVdt * self.dt
-            m += dmdt * self.dt
-            h += dhdt * self.dt
-            n += dndt * self.dt
+            V, m, n, h = self.__step(I_params, V, m, n, h, self.t_sim[i])
         return V_record
+
+    def __stim_batch(self, I_params_batch):
+        '''gaussian impulses for a batch of (a, c), evaluated block by block on the simulation grid'''
+        a = I_params_batch[:, 0:1]
+        c = I_params_batch[:, 1:2]
+        def block(start, stop):
+            return self.__impulse((a, c), self.t_sim[start:stop])
+        return block
+
+    def integrate_batch(self, I_params_batch):
+        '''forward euler for many impulse candidates stepped together
+        Args:
+            I_params_batch (array): (K, 2) rows of (a, c)
+        Returns:
+            V_record (array): (K, len(t_sim)) record of voltages of each candidate
+        '''
+        I_params_batch = np.atleast_2d(np.asarray(I_params_batch, dtype = float))
+        if self.integrator == 'rk23':
+            return np.array([self.integrate_HH(I_params) for I_params in I_params_batch])
+        x0, p = self.__hh()
+        x0 = np.tile(x0, (len(I_params_batch), 1))
+        return hh_ensemble.integrate_ensemble(x0, self.__stim_batch(I_params_batch), p, self.dt, len(self.t_sim), self.gating, self.integrator)
+
+    def cost_batch(self, I_params_batch):
+        '''objective function for a (K, 2) batch of (a, c), returns the (K,) costs'''
+        I_params_batch = np.atleast_2d(np.asarray(I_params_batch, dtype = float))
+        if self.integrator == 'rk23':
+            return np.array([self.cost(I_params) for I_params in I_params_batch])
+        x0, p = self.__hh()
+        x0 = np.tile(x0, (len(I_params_batch), 1))
+        return hh_ensemble.ensemble_misfit(x0, self.__stim_batch(I_params_batch), p, self.dt, self.obs, len(self.t_sim),
+                                           gating = self.gating, scheme = self.integrator)
     
     def __cost(self, I_params): 
         '''defines optimizaton problem, objective function sought to minimize'''
-        cost = 0
-        
+        if self.integrator == 'rk23':
+            # the accepted steps change with I_params, so the data is matched to them on every evaluation
+            t_record, x_record = self.__adaptive(I_params)
+            return obs_operator(t_record, self.t_data, self.V_data, 'linear').misfit(np.array([x[0] for x in x_record]))
         V_record = []
         V = self.V0
         
@@ -126,31 +252,168 @@ class stim_adj:
         # forward euler solver 
             V_record.append(V)
         
-            dVdt, dmdt, dhdt, dndt = self.__forward( I_params, V, m, n, h, self.t_sim[i])
-            V += dVdt * self.dt
-            m += dmdt * self.dt
-            h += dhdt * self.dt
-            n += dndt * self.dt
-
-        # compute cost at time t_i
-            if self.t_sim[i] in self.t_data:
-                j = np.where(self.t_data == self.t_sim[i])
-                cost += (V_record[i] - self.V_data[j])**2 
-                  
-        cost = cost/len(self.t_data)
+            V, m, n, h = self.__step(I_params, V, m, n, h, self.t_sim[i])
+
+        # compare against the data at every observed time in one pass
+        cost = self.obs.misfit(np.array(V_record))
 
         return cost
 
+    def __stim(self, I_params):
+        '''gaussian impulse at every simulation step, along with its unit amplitude profile'''
+        profile = self.__impulse((1.0, I_params[1]), self.t_sim)
+        return I_params[0]*profile, profile
+
+    def __hh(self):
+        '''initial state and HH parameters in the layout used by hh_adjoint'''
+        x0 = (self.V0, self.m, self.h, self.n)
+        p = (self.g_Na, self.g_K, self.g_L, self.E_Na, self.E_K, self.E_L, self.C_m)
+        return x0, p
+
+    def __adjoint_grad(self, I_params):
+        '''cost and its gradient with respect to (a, c) from one forward and one reverse sweep'''
+        I, profile = self.__stim(I_params)
+        x0, p = self.__hh()
+        if self.grad_mode == 'checkpoint':
+            J, dJdx0, dJdp, dJdI = hh_adjoint.checkpointed_gradient(x0, I, p, self.dt, self.obs, self.checkpoint_budget, self.gating, self.integrator)
+        else:
+            traj = hh_adjoint.forward_sweep(x0, I, p, self.dt, self.gating, self.integrator)
+            J = self.obs.misfit(traj[:, 0])
+            dJdx0, dJdp, dJdI = hh_adjoint.reverse_sweep(traj, I, p, self.dt, self.obs.misfit_grad(traj[:, 0]), gating = self.gating, scheme = self.integrator)
+        dJda = np.dot(dJdI, profile)
+        dJdc = np.dot(dJdI, self.__impulse_dc(I_params, I, self.t_sim))
+        return J, np.array([dJda, dJdc])
+
+    def __evaluate(self, I_params):
+        '''objective function alone, evaluated with the solver matching grad_mode'''
+        if self.grad_mode == 'autograd':
+            return self.__cost(I_params)
+        I = self.__stim(I_params)[0]
+        x0, p = self.__hh()
+        if self.grad_mode == 'checkpoint':
+            V_sim = hh_adjoint.observe(x0, I, p, self.dt, self.obs, self.checkpoint_budget, self.gating, self.integrator)
+            return np.sum((V_sim - self.obs.V_obs)**2) / self.obs.n_data
+        return self.obs.misfit(hh_adjoint.forward_sweep(x0, I, p, self.dt, self.gating, self.integrator)[:, 0])
 
-    def optimize(self):
-        '''impliments minimization problem with respect to desired parameters'''
+    def value_and_grad(self, I_params):
+        '''objective and its gradient with respect to (a, c) from a single fused pass using grad_mode,
+        repeated calls at the same I_params are served from self.cache'''
+        hit = self.cache.get(I_params)
+        if hit is not None and hit[1] is not None:
+            self.cache.hits += 1
+            return hit[0], hit[1].copy()
+        self.cache.misses += 1
+        if self.grad_mode == 'autograd':
+            J, g = value_and_grad(self.__cost, 0)(I_params)
+        else:
+            J, g = self.__adjoint_grad(I_params)
+        self.cache.put(I_params, float(J), g)
+        return float(J), np.array(g, dtype = float)
+
+    def cost(self, I_params):
+        '''objective function, reuses the cached value when I_params was evaluated recently'''
+        hit = self.cache.get(I_params)
+        if hit is not None:
+            self.cache.hits += 1
+            return hit[0]
+        self.cache.misses += 1
+        J = float(self.__evaluate(I_params))
+        self.cache.put(I_params, J)
+        return J
+
+    def gradient(self, I_params):
+        '''gradient of the objective with respect to (a, c) using grad_mode'''
+        return self.value_and_grad(I_params)[1]
+
+    def residual_and_jacobian(self, I_params):
+        '''residual at every observed sample scaled by 1 / sqrt(n_data), so its sum of squares is the objective,
+        and its jacobian with respect to (a, c) from the forward sensitivity equations,
+        repeated calls at the same I_params are served from self.lsq_cache'''
+        hit = self.lsq_cache.get(I_params)
+        if hit is not None:
+            self.lsq_cache.hits += 1
+            return hit
+        self.lsq_cache.misses += 1
+        I, profile = self.__stim(I_params)
+        x0, p = self.__hh()
+        traj = hh_adjoint.forward_sweep(x0, I, p, self.dt, self.gating, self.integrator)
+        # (a, c) only enter through the stimulus
+        dI = np.column_stack([profile, self.__impulse_dc(I_params, I, self.t_sim)])
+        dV = hh_adjoint.tangent_sweep(traj, I, p, self.dt, np.zeros((4, 2)), None, dI, self.gating, self.integrator)
+        scale = 1.0 / np.sqrt(self.obs.n_data)
+        r, jac = scale * self.obs.residual(traj[:, 0]), scale * self.obs.project(dV.T).T
+        self.lsq_cache.put(I_params, r, jac)
+        return r, jac
+
+    def least_squares(self, x0 = None, method = None, maxiter = None):
+        '''Gauss-Newton type fit of the residual with scipy.optimize.least_squares, the jacobian from residual_and_jacobian
+        Args:
+            x0 (array): starting point, defaults to the initial guess
+            method (str): 'trf', 'dogbox' or 'lm' (unbounded only), defaults to self.method if it is one of them, else 'trf'
+            maxiter (int): cap on the residual evaluations (max_nfev), None for scipy's default
+        Returns:
+            optim (OptimizeResult): optim.fun is the objective as with optimize(), optim.residual the residual vector
+        '''
+        if x0 is None:
+            x0 = self.I_params_init
+        if method is None:
+            method = self.method if self.method in hh_adjoint.least_squares_methods else 'trf'
+        bounds = (-np.inf, np.inf)
+        if len(self.bounds):
+            bounds = tuple(np.array([(-np.inf if lo is None else lo, np.inf if hi is None else hi) for lo, hi in self.bounds], dtype = float).T)
+        # x_scale = 'jac' evens out parameters of very different magnitude
+        optim = optimize.least_squares(lambda x: self.residual_and_jacobian(x)[0], x0, jac = lambda x: self.residual_and_jacobian(x)[1],
+                                       bounds = bounds, method = method, x_scale = 'jac', max_nfev = maxiter)
+        optim.residual = optim.fun
+        optim.fun = float(np.sum(optim.residual**2))
+        return optim
+
+    def optimize(self, x0 = None, maxiter = None):
+        '''impliments minimization problem with respect to desired parameters
+        Args:
+            x0 (array): optional starting (a, c), e.g. the optimum of a coarser level, defaults to (guess_a, guess_c)
+            maxiter (int): optional iteration cap, e.g. to keep benchmarks on long traces affordable
+        '''
+        if x0 is None:
+            x0 = self.I_params_init
+        if self.method in hh_adjoint.least_squares_methods:
+            return self.least_squares(x0, maxiter = maxiter)
+        options = {} if maxiter is None else {'maxiter': maxiter}
             
-        grad_AD = grad(self.__cost, 0)
+        # scipy receives cost and gradient together, one forward/backward pass per iterate
         if self.bounds == []:
-            optim = optimize.minimize(self.__cost, self.I_params_init, args = (), jac = grad_AD, method = self.method)
+            optim = optimize.minimize(self.value_and_grad, x0, args = (), jac = True, method = self.method, options = options)
         else: 
-            optim = optimize.minimize(self.__cost, self.I_params_init, args = (), jac = grad_AD, bounds = self.bounds, method = self.method)
+            optim = optimize.minimize(self.value_and_grad, x0, args = (), jac = True, bounds = self.bounds, method = self.method, options = options)
         return optim
+
+    def state(self, I_params, t):
+        '''simulated state (V, m, h, n) at time t, carried into the next window of a long recording;
+        t may lie up to one data step past the last sample, where the next contiguous window starts'''
+        if t > self.t_final + 1.5 * (self.t_final - self.t_data[-2]):
+            raise ValueError('state is only simulated up to one data step past the last sample')
+        if self.integrator == 'rk23':
+            return tuple(float(q) for q in self.__adaptive(I_params, t)[1][-1])
+        k = max(int(round((t - self.t_sim[0]) / self.dt)), 0)
+        I = self.__impulse(I_params, self.t_sim[0] + self.dt * np.arange(k))
+        x0, p = self.__hh()
+        return hh_adjoint.advance(x0, I, p, self.dt, gating = self.gating, scheme = self.integrator)
+
+    def coarsen(self, factor, integrator = None):
+        '''the same recovery problem on every factor-th data sample with a factor times larger dt, every coarse step is
+        driven by the mean of the impulse over the step (step_mean), so an impulse narrower than the coarse dt keeps its charge
+        Args:
+            factor (int): decimation of the data and coarsening of the time step
+            integrator (str): integrator of the coarse problem, defaults to the one of this instance
+        Returns:
+            coarse (stim_adj): new instance with every other setting copied from this one
+        '''
+        HH_params = (self.g_Na, self.g_K, self.g_L, self.E_Na, self.E_K, self.E_L, self.C_m, self.m, self.n, self.h)
+        return stim_adj(self.V_data[::factor], self.t_data[::factor], self.dt * factor, HH_params, self.a_init, self.c_init,
+                        bounds = self.bounds, method = self.method, obs_mode = self.obs.mode, grad_mode = self.grad_mode,
+                        checkpoint_budget = self.checkpoint_budget, gating = self.gating,
+                        integrator = self.integrator if integrator is None else integrator, rk_options = self.rk_options, b = self.b_init,
+                        init_state = self.init_state, step_mean = True)
    
     def recovery(self):
         X = self.optimize().x
@@ -185,26 +448,20 @@ class stim_adj:
             msg = print('can only perform FD check for amplitude (idx = 0) or duration (idx = 1)')
             return msg
 
-        L1 = self.__cost(I1)
-
-        # compute gradient using autograd
-        grad_AD = grad(self.__cost, 0)
-        g = grad_AD(I1)[param_idx]
+        # compute gradient using autograd or the hand written adjoint, depending on grad_mode
+        g = self.gradient(I1)[param_idx]
         dL_dV_p = np.dot(g, p)
 
+        # perturbed costs for every step size integrated together as one batch
+        I2 = np.tile(I1, (len(step_sizes), 1))
+        I2[:, param_idx] += np.array(step_sizes)*p
+        L = self.cost_batch(np.vstack([I1, I2]))
+        L1 = L[0]
+
         grad_errs = list()
-        for s in step_sizes:
+        for s, L2 in zip(step_sizes, L[1:]):
 
             # compute gradient using finite differences
-            if param_idx == 0:
-                A2 = A1 + s*p
-                I2 = np.array([A2, self.c_init])
-
-            elif param_idx == 1:
-                c2 = c1 + s*p
-                I2 = np.array([self.a_init, c2])
-
-            L2 = self.__cost(I2)
             dL_dV_p_diff = (L2 - L1) / s
 
 
@@ -217,6 +474,7 @@ class stim_adj:
             grad_errs.append(grad_err)
 
 
+        import matplotlib.pyplot as plt #only needed for the plot
         plt.loglog(step_sizes, grad_errs)
         plt.title('Finite Difference Gradient Check for ' + title)
         plt.xlabel('step size')
@@ -0,0 +1,118 @@
+import os
+import json
+import numpy as np
+import trace_store
+
+# Index of every trace archive in sim_data with its metadata precomputed, stored in sim_data/catalog.json.
+# Queries such as query(model = 'HH', min_spikes = 2) only read the index, no trace is opened.
+# Run `python catalog.py` after adding or changing an archive to rebuild it.
+
+CATALOG = os.path.join(trace_store.DATA_DIR, 'catalog.json')
+SPIKE_THRESHOLD = -20.0  # mV, upward crossings count as action potentials
+
+_entries = None
+
+
+def describe(name):
+    '''metadata of one archive, computed from its cached columns
+    Args:
+        name (str): archive name in sim_data, e.g. 'gt_1a'
+    Returns:
+        entry (dict): sample count, dt, V0, voltage range, stimulus onset/offset/center/amplitude,
+                      spike count and spike times
+    '''
+    path = trace_store.archive_path(name)
+    t_data, V_data, I_data = trace_store.load_trace(path)
+    impulse = np.flatnonzero(I_data != 0.0)
+    spikes = np.flatnonzero((V_data[:-1] < SPIKE_THRESHOLD) & (V_data[1:] >= SPIKE_THRESHOLD)) + 1
+    entry = {'name': name,
+             'archive': os.path.basename(path),
+             'sha256': trace_store.archive_hash(path),
+             'model': 'HH' if name.startswith('hh_') else 'L5PC' if name.startswith('gt_') else 'unknown',
+             'n_samples': int(len(t_data)),
+             'dt': float(t_data[1] - t_data[0]),
+             't_start': float(t_data[0]),
+             't_end': float(t_data[-1]),
+             'V0': float(V_data[0]),
+             'V_min': float(np.min(V_data)),
+             'V_max': float(np.max(V_data)),
+             'stim_onset': None, 'stim_offset': None, 'stim_center': None, 'stim_amplitude': 0.0,
+             'n_spikes': int(len(spikes)),
+             'spike_times': [float(t) for t in t_data[spikes]]}
+    if len(impulse):
+        # same center as retrieve_file.load always computed
+        center = round((impulse[-1] - impulse[0])/2) + impulse[0]
+        entry.update(stim_onset = float(t_data[impulse[0]]), stim_offset = float(t_data[impulse[-1]]),
+                     stim_center = float(t_data[center]), stim_amplitude = float(np.max(np.abs(I_data[impulse]))))
+    return entry
+
+
+def build(path = CATALOG):
+    '''describes every archive in sim_data and writes the catalog
+    Returns:
+        entries (list): one dict per archive, sorted by name
+    '''
+    global _entries
+    names = sorted(f[:-len('.zip')] for f in os.listdir(trace_store.DATA_DIR) if f.endswith('.zip'))
+    _entries = [describe(name) for name in names]
+    with open(path, 'w') as f:
+        json.dump({'spike_threshold': SPIKE_THRESHOLD, 'traces': _entries}, f, indent = 1)
+    return _entries
+
+
+def entries(path = CATALOG):
+    '''all catalog entries, read from disk once per process'''
+    global _entries
+    if _entries is None:
+        with open(path) as f:
+            _entries = json.load(f)['traces']
+    return _entries
+
+
+def get(name):
+    '''catalog entry of one trace'''
+    for entry in entries():
+        if entry['name'] == name:
+            return entry
+    raise KeyError('no trace named %s in the catalog' % name)
+
+
+def query(model = None, min_spikes = None, max_spikes = None, where = None, **fields):
+    '''entries matching every given condition
+    Args:
+        model (str): 'HH' or 'L5PC'
+        min_spikes, max_spikes (int): inclusive bounds on the spike count
+        where (function): extra predicate on the entry dict
+        fields: exact matches on any other entry field, e.g. dt = 0.025
+    Returns:
+        entries (list): matching catalog entries, e.g. query(model = 'HH', min_spikes = 2)
+    '''
+    out = []
+    for entry in entries():
+        if model is not None and entry['model'] != model:
+            continue
+        if min_spikes is not None and entry['n_spikes'] < min_spikes:
+            continue
+        if max_spikes is not None and entry['n_spikes'] > max_spikes:
+            continue
+        if any(entry.get(k) != v for k, v in fields.items()):
+            continue
+        if where is not None and not where(entry):
+            continue
+        out.append(entry)
+    return out
+
+
+def stale():
+    '''names of catalog entries whose archive changed or disappeared since the catalog was built'''
+    out = []
+    for entry in entries():
+        path = trace_store.archive_path(entry['name'])
+        if not os.path.exists(path) or trace_store.archive_hash(path) != entry['sha256']:
+            out.append(entry['name'])
+    return out
+
+
+if __name__ == '__main__':
+    for entry in build():
+        print('%-14s %-5s n=%-7d dt=%-7g spikes=%d' % (entry['name'], entry['model'], entry['n_samples'], entry['dt'], entry['n_spikes']))
@@ -0,0 +1,306 @@
+'''
+Benchmark and profiling suite for the solvers in this repo, run over the traces bundled in sim_data.
+
+Every (case, dataset) pair runs in a fresh worker process so peak memory is measured per case.
+Results are written to a JSON report and optionally compared against a stored baseline report. The committed
+benchmark_baseline.json was run with --maxiter 10; timings are machine dependent, regenerate it with --save-baseline
+on the machine the comparisons run on.
+
+usage (from the repo root):
+    python development/runtime/benchmark.py                          # every case on every dataset
+    python development/runtime/benchmark.py --datasets hh_1ap --cases forward_euler stim_adj
+    python development/runtime/benchmark.py --t-max 300 --maxiter 10 # quick run on cropped traces
+    python development/runtime/benchmark.py --save-baseline          # store the report as the baseline
+    python development/runtime/benchmark.py --maxiter 10 --baseline  # compare against the committed benchmark_baseline.json
+    python development/runtime/benchmark.py --profile --datasets hh_1ap --cases stim_adj   # writes runtime.prof
+    python development/runtime/benchmark.py --imports --cases                # import time and memory of the modules only
+'''
+import argparse
+import contextlib
+import cProfile
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on windows, peak memory is then reported as None
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(ROOT, 'adjoint'))
+sys.path.append(os.path.join(ROOT, 'neuralnet'))
+sys.path.append(ROOT)
+import trace_store
+import catalog
+from stim_adj import stim_adj
+from param_adj import param_adj
+import NNengine
+import NNvector
+
+DATASETS = ['hh_1ap', 'hh_multap', 'hh_noap', 'gt_1a', 'gt_multa', 'gt_noap', 'gt_1a_100', 'gt_multa_100', 'gt_noap_100']
+CASES = ['forward_euler', 'forward_rush_larsen', 'forward_rk23', 'forward_ensemble', 'stim_adj', 'param_adj', 'nn', 'nn_vector']
+# modules a worker process imports, each is imported alone in a fresh interpreter
+IMPORTS = ['upload', 'catalog', 'trace_store', 'trace_stream', 'NEURON_inst', 'stim_adj', 'param_adj', 'multires',
+           'NNengine', 'NNvector', 'NNdata', 'WaveformGenerator']
+HEAVY = ['matplotlib', 'pandas', 'neuron', 'scipy.signal']
+BASELINE = os.path.join(HERE, 'benchmark_baseline.json')
+PROFILE = os.path.join(HERE, 'runtime.prof')
+
+# HH parameters used in the examples, stim_adj order (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m, m, n, h)
+HH_PARAMS = (120.0, 36.0, 0.3, 50.0, -77.0, -55.0, 1.0, 0.05, 0.6, 0.32)
+# impulse center of traces without a stimulus, as in retrieve_file.load
+DEFAULT_B = 150.0
+
+
+def load_trace(name, t_max = None):
+    '''time, voltage and stim of a bundled trace from the binary trace store, nothing is extracted
+    Args:
+        name (str): dataset name, e.g. 'hh_1ap' or 'gt_1a_100'
+        t_max (float): optional end time (ms) the trace is cropped to
+    Returns:
+        t_data, V_data, I_data (arrays)
+    '''
+    t_data, V_data, I_data = trace_store.load_trace(name)
+    keep = slice(None) if t_max is None else t_data <= t_max
+    return np.array(t_data[keep]), np.array(V_data[keep]), np.array(I_data[keep])
+
+
+def _stim_center(dataset):
+    '''center of the stimulus impulse of a dataset from the catalog, DEFAULT_B like retrieve_file.load when it has none'''
+    center = catalog.get(dataset)['stim_center']
+    return DEFAULT_B if center is None else center
+
+
+def _stim_solver(t_data, V_data, b, integrator = 'euler', grad_mode = 'adjoint'):
+    dt = t_data[1] - t_data[0]
+    return stim_adj(V_data, t_data, dt, HH_PARAMS, 5.0, 2.0, bounds = [(0.1, 50.0), (0.1, 10.0)], method = 'L-BFGS-B',
+                    grad_mode = grad_mode, integrator = integrator, b = b)
+
+
+def _param_solver(t_data, V_data, I_data, grad_mode = 'adjoint'):
+    g_Na, g_K, g_L, E_Na, E_K, E_L, C_m, m, n, h = HH_PARAMS
+    truth = np.array([g_Na, g_K, g_L, E_Na, E_K, E_L, C_m, m, h, n])
+    bounds = [tuple(sorted((0.8 * v, 1.2 * v))) for v in truth[:7]] + [(0.0, 1.0)] * 3
+    dt = t_data[1] - t_data[0]
+    return param_adj(V_data, t_data, I_data, dt, 1.05 * truth, bounds = bounds, method = 'L-BFGS-B', grad_mode = grad_mode)
+
+
+def _sims(solver):
+    '''simulations a fit ran, i.e. the misses of every evaluation cache of the solver'''
+    return sum(getattr(solver, name).misses for name in ('cache', 'lsq_cache', 'free_cache') if hasattr(solver, name))
+
+
+def run_case(case, dataset, t_max = None, maxiter = None, grad_mode = 'adjoint', batch = 16):
+    '''runs one benchmark case on one dataset
+    Returns:
+        result (dict): wall time, evaluation counts, peak memory and final misfit of the case
+    '''
+    t_data, V_data, I_data = load_trace(dataset, t_max)
+    result = {'case': case, 'dataset': dataset, 'n_samples': len(t_data), 'nfev': None, 'njev': None, 'sims': None}
+    b = _stim_center(dataset)
+    if case == 'stim_adj' and not t_data[0] <= b <= t_data[-1]:
+        # the fitted impulse would lie outside the (cropped) trace, its cost does not depend on (a, c)
+        return dict(result, skipped = 'stimulus center outside the trace')
+    rss0 = _peak_rss()
+    start = time.perf_counter()
+
+    if case in ('forward_euler', 'forward_rush_larsen', 'forward_rk23'):
+        solver = _stim_solver(t_data, V_data, b, integrator = case[len('forward_'):], grad_mode = 'autograd')
+        V_sim = solver.integrate_HH(solver.I_params_init)
+        misfit = solver.obs.misfit(V_sim)
+        result['sims'] = 1
+    elif case == 'forward_ensemble':
+        solver = _stim_solver(t_data, V_data, b)
+        a = np.linspace(1.0, 20.0, batch)
+        misfit = float(np.min(solver.cost_batch(np.column_stack([a, np.full(batch, solver.c_init)]))))
+        result['sims'] = batch
+    elif case == 'stim_adj':
+        solver = _stim_solver(t_data, V_data, b, grad_mode = grad_mode)
+        optim = solver.optimize(maxiter = maxiter)
+        misfit, result['nfev'], result['njev'], result['sims'] = optim.fun, optim.nfev, optim.njev, _sims(solver)
+    elif case == 'param_adj':
+        solver = _param_solver(t_data, V_data, I_data, grad_mode = grad_mode)
+        optim = solver.optimize(maxiter = maxiter)
+        misfit, result['nfev'], result['njev'], result['sims'] = optim.fun, optim.nfev, optim.njev, _sims(solver)
+    elif case == 'nn':
+        random.seed(0)
+        # the scalar engine is far too slow for full traces, train on a 32 sample decimation
+        idx = np.linspace(0, len(t_data) - 1, 32).astype(int)
+        NN = NNengine.Multilayers(32, [8, 32])
+        iter_lim = 20 if maxiter is None else maxiter
+        with contextlib.redirect_stdout(io.StringIO()):
+            stim_pred, misfit = NNengine.Run_NN(NN, I_data[idx], V_data[idx], iter_lim = iter_lim)
+        NNengine.Family.clear_families()
+        result['nfev'] = result['njev'] = iter_lim
+    elif case == 'nn_vector':
+        # the matrix engine trains on the full trace
+        NN = NNvector.Multilayers(len(t_data), [8, len(t_data)], seed = 0)
+        iter_lim = 20 if maxiter is None else maxiter
+        with contextlib.redirect_stdout(io.StringIO()):
+            stim_pred, misfit = NNvector.Run_NN(NN, I_data, V_data, iter_lim = iter_lim)
+        result['nfev'] = result['njev'] = iter_lim
+    else:
+        raise ValueError('unknown benchmark case ' + case)
+
+    result['wall_s'] = time.perf_counter() - start
+    rss1 = _peak_rss()
+    result['peak_rss_mb'] = rss1
+    result['peak_rss_delta_mb'] = None if rss1 is None else rss1 - rss0
+    result['misfit'] = float(misfit)
+    return result
+
+
+_IMPORT_SCRIPT = '''
+import os, sys, time, json
+sys.path[:0] = %r
+def rss_kb():
+    # current resident size on linux, peak size elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.perf_counter()
+rss0 = rss_kb()
+import %s
+print(json.dumps({'import_s': time.perf_counter() - t0, 'rss_delta_kb': rss_kb() - rss0,
+                  'heavy': [m for m in %r if m in sys.modules]}))
+'''
+
+
+def import_cost(module):
+    '''wall time and peak memory growth of importing module in a fresh interpreter (numpy is imported first,
+    every module needs it), plus which of the HEAVY dependencies the import pulled in
+    Returns:
+        result (dict): module, import_s, rss_delta_mb, heavy
+    '''
+    paths = [ROOT, os.path.join(ROOT, 'adjoint'), os.path.join(ROOT, 'neuralnet')]
+    script = 'import numpy\n' + _IMPORT_SCRIPT % (paths, module, HEAVY)
+    proc = subprocess.run([sys.executable, '-c', script], capture_output = True, text = True, cwd = ROOT)
+    if proc.returncode:
+        return {'module': module, 'error': proc.stderr.strip().splitlines()[-1]}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    kb = result.pop('rss_delta_kb')
+    result['rss_delta_mb'] = kb / 1024.0 if sys.platform != 'darwin' else kb / 1024.0**2
+    return dict(module = module, **result)
+
+
+def _peak_rss():
+    '''peak resident memory of this process in MB'''
+    if resource is None:
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return kb / 1024.0 if sys.platform != 'darwin' else kb / 1024.0**2
+
+
+def _isolated(args):
+    '''runs a case in a fresh process so the peak memory of one case does not leak into the next'''
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers = 1, mp_context = ctx) as pool:
+        return pool.submit(run_case, *args).result()
+
+
+def compare(report, baseline, tolerance = 0.2):
+    '''flags cases that got slower or less accurate than the baseline
+    Args:
+        report, baseline (dict): benchmark reports
+        tolerance (float): allowed relative increase of wall time and misfit
+    Returns:
+        rows (list): (case, dataset, wall ratio, misfit ratio, regressed) for every case found in both
+    '''
+    old = {(r['case'], r['dataset']): r for r in baseline['results']}
+    rows = []
+    for r in report['results']:
+        b = old.get((r['case'], r['dataset']))
+        if b is None or 'error' in r or 'error' in b or 'skipped' in r or 'skipped' in b:
+            continue
+        wall = r['wall_s'] / b['wall_s'] if b['wall_s'] > 0 else np.inf
+        misfit = r['misfit'] / b['misfit'] if b['misfit'] > 0 else (1.0 if r['misfit'] <= 0 else np.inf)
+        diverged = np.isnan(r['misfit']) and not np.isnan(b['misfit'])
+        rows.append((r['case'], r['dataset'], wall, misfit, wall > 1 + tolerance or misfit > 1 + tolerance or diverged))
+    return rows
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'benchmark the solvers over the bundled sim_data traces')
+    parser.add_argument('--cases', nargs = '*', default = CASES, choices = CASES)
+    parser.add_argument('--datasets', nargs = '+', default = DATASETS, choices = DATASETS)
+    parser.add_argument('--t-max', type = float, default = None, help = 'crop every trace to this end time (ms)')
+    parser.add_argument('--maxiter', type = int, default = None, help = 'iteration cap for the optimizations and NN training')
+    parser.add_argument('--grad-mode', default = 'adjoint', choices = ['autograd', 'adjoint', 'checkpoint'])
+    parser.add_argument('--output', default = os.path.join(HERE, 'benchmark_report.json'))
+    parser.add_argument('--baseline', nargs = '?', const = BASELINE, default = None,
+                        help = 'report to compare against, ' + BASELINE + ' when given without a path')
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'also write the report to ' + BASELINE)
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'allowed relative slowdown or misfit increase')
+    parser.add_argument('--profile', action = 'store_true', help = 'run in process under cProfile and write ' + PROFILE)
+    parser.add_argument('--imports', nargs = '*', default = None, choices = IMPORTS,
+                        help = 'also measure the import cost of these modules (all when given without names)')
+    args = parser.parse_args(argv)
+
+    report = {'meta': {'date': datetime.now().isoformat(timespec = 'seconds'), 'python': platform.python_version(),
+                       'numpy': np.__version__, 'platform': platform.platform(), 'processor': platform.processor(),
+                       'args': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'save_baseline')}},
+              'results': []}
+    profiler = cProfile.Profile() if args.profile else None
+    for dataset in args.datasets:
+        for case in args.cases:
+            job = (case, dataset, args.t_max, args.maxiter, args.grad_mode)
+            try:
+                if profiler is not None:
+                    result = profiler.runcall(run_case, *job)
+                else:
+                    result = _isolated(job)
+            except Exception as err:
+                result = {'case': case, 'dataset': dataset, 'error': repr(err)}
+            report['results'].append(result)
+            if 'error' in result:
+                print(f"{case:>20s} {dataset:>14s}   failed: {result['error']}")
+            elif 'skipped' in result:
+                print(f"{case:>20s} {dataset:>14s}   skipped: {result['skipped']}")
+            else:
+                print(f"{case:>20s} {dataset:>14s} {result['wall_s']:10.3f} s   misfit {result['misfit']:.4g}   sims {result['sims']}")
+    if args.imports is not None:
+        report['imports'] = [import_cost(module) for module in (args.imports or IMPORTS)]
+        for r in report['imports']:
+            if 'error' in r:
+                print(f"{'import':>20s} {r['module']:>17s}   failed: {r['error']}")
+            else:
+                print(f"{'import':>20s} {r['module']:>17s} {r['import_s']:10.3f} s   {r['rss_delta_mb']:6.1f} MB   heavy: {', '.join(r['heavy']) or '-'}")
+    if profiler is not None:
+        profiler.dump_stats(PROFILE)
+        print('profile written to', PROFILE)
+
+    for path in [args.output] + ([BASELINE] if args.save_baseline else []):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent = 1)
+    print('report written to', args.output)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        settings = ('t_max', 'maxiter', 'grad_mode')
+        if any(baseline['meta']['args'].get(k) != report['meta']['args'][k] for k in settings):
+            print('warning: the baseline was run with ' + ', '.join('%s=%s' % (k, baseline['meta']['args'].get(k)) for k in settings))
+        rows = compare(report, baseline, args.tolerance)
+        for case, dataset, wall, misfit, regressed in rows:
+            print(f"{case:>20s} {dataset:>14s}   time x{wall:.2f}   misfit x{misfit:.2f}" + ('   REGRESSION' if regressed else ''))
+        if any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
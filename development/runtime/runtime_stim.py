@@ -1,9 +1,14 @@
+import sys
+sys.path.append('./adjoint')
 import autograd.numpy as np 
-from autograd import grad
+from autograd import grad, value_and_grad
 from scipy import optimize
+from observation import obs_operator
+from hh_rates import get_gating
+from eval_cache import eval_cache
 
 class stim_adj: 
-    def __init__(self, V_data, t_data, dt, HH_params, guess_a, guess_c, bounds = [], method =  'BFGS'):
+    def __init__(self, V_data, t_data, dt, HH_params, guess_a, guess_c, bounds = [], method =  'BFGS', obs_mode = 'linear', gating = None):
         '''
         args:
             V0 (float): defined in upload.py to be initial voltage
@@ -22,6 +27,8 @@ class stim_adj:
                 b: center location
             bounds (list of tuples): specifies bounds for each variable
             method (str): method for optimization
+            obs_mode (str): how data samples are matched to simulation steps, 'exact', 'nearest' or 'linear'
+            gating (None, str or hh_rates): None or 'analytic' for the rate functions, 'table' or an hh_rates.rate_table for tabulated rates
         '''
         
         #variables from empiracle data
@@ -41,37 +48,41 @@ class stim_adj:
         
         #retrieved simulation parameter
         self.t_sim = np.arange(0, self.t_final, dt)
+        self.obs = obs_operator(self.t_sim, t_data, V_data, obs_mode)
         
         #defining optimization parameters
         self.I_params_init = np.array([guess_a, guess_c])
         self.bounds = bounds
         self.method = method
+        self.gating = get_gating(gating)
+        #cost and gradient of recently evaluated I_params, shared by fun, jac and the store callback
+        self.cache = eval_cache()
 
         
     # Define the HH model helper equations, these need not automatic imput
     def alpha_m(self, V):
         '''transition rate constant for m-gates (rapid response Na) shut gates opening as a function of voltage'''
-        return 0.1 * (V + 40.0) / (1.0 - np.exp(-(V + 40.0) / 10.0))
+        return self.gating.alpha_m(V)
 
     def beta_m(self, V):
         '''transition rate constant for m-gates (rapid response Na) open gates closing as a function of voltage '''
-        return 4.0 * np.exp(-(V + 65.0) / 18.0)
+        return self.gating.beta_m(V)
 
     def alpha_h(self, V):
         '''transition rate constant for h-gates (slow response Na) shut gates opening as a function of voltage'''
-        return 0.07 * np.exp(-(V + 65.0) / 20.0)
+        return self.gating.alpha_h(V)
 
     def beta_h(self, V):
         '''transition rate constant for h-gates (slow response Na) open gates closing as a function of voltage '''
-        return 1.0 / (1.0 + np.exp(-(V + 35.0) / 10.0))
+        return self.gating.beta_h(V)
 
     def alpha_n(self, V):
         '''transition rate constant for n-gates (slow response K) shut gates opening as a function of voltage'''
-        return 0.01 * (V + 55.0) / (1.0 - np.exp(-(V + 55.0) / 10.0))
+        return self.gating.alpha_n(V)
 
     def beta_n(self, V):
         '''transition rate constant for n-gates (slow response K) open gates closing as a function of voltage '''
-        return 0.125 * np.exp(-(V + 65) / 80.0)
+        return self.gating.beta_n(V)
 
  
     def __forward(self, I_params, V, m, n, h, t):
@@ -85,9 +96,10 @@ class stim_adj:
         '''
         I = I_params[0]*np.exp(-(t-self.b_init)**2/(2*I_params[1]**2))
         dVdt = (I - self.g_Na * m**3 * h * (V - self.E_Na) - self.g_K * n**4 * (V - self.E_K) - self.g_L * (V - self.E_L)) / self.C_m
-        dmdt = self.alpha_m(V) * (1 - m) - self.beta_m(V) * m
-        dhdt = self.alpha_h(V) * (1 - h) - self.beta_h(V) * h
-        dndt = self.alpha_n(V) * (1 - n) - self.beta_n(V) * n
+        alpha_m, beta_m, alpha_h, beta_h, alpha_n, beta_n = self.gating.rates(V)
+        dmdt = alpha_m * (1 - m) - beta_m * m
+        dhdt = alpha_h * (1 - h) - beta_h * h
+        dndt = alpha_n * (1 - n) - beta_n * n
         return dVdt, dmdt, dhdt, dndt
     
     # Forward Euler to solve IVP
@@ -112,8 +124,6 @@ class stim_adj:
     
     def __cost(self, I_params): 
         '''defines optimizaton problem, objective function sought to minimize'''
-        cost = 0
-        
         V_record = []
         V = self.V0
         
@@ -132,14 +142,21 @@ class stim_adj:
             h += dhdt * self.dt
             n += dndt * self.dt
 
-        # compute cost at time t_i
-            if self.t_sim[i] in self.t_data:
-                j = np.where(self.t_data == self.t_sim[i])
-                cost += (V_record[i] - self.V_data[j])**2 
-                  
-        cost = cost/len(self.t_data)
+        # compare against the data at every observed time in one pass
+        cost = self.obs.misfit(np.array(V_record))
 
         return cost 
+
+    def value_and_grad(self, I_params):
+        '''cost and gradient from one fused forward/backward pass, cached per I_params'''
+        hit = self.cache.get(I_params)
+        if hit is not None and hit[1] is not None:
+            self.cache.hits += 1
+            return hit[0], hit[1].copy()
+        self.cache.misses += 1
+        J, g = value_and_grad(self.__cost, 0)(I_params)
+        self.cache.put(I_params, float(J), g)
+        return float(J), np.array(g, dtype = float)
     
 #         # print out at every iteration
 #     def callback(self, x):
@@ -159,45 +176,33 @@ class stim_adj:
         # start callback
         all_x_i = [self.I_params_init[0]]
         all_y_i = [self.I_params_init[1]]
-        all_f_i = [self.__cost(self.I_params_init)]
+        all_f_i = [self.value_and_grad(self.I_params_init)[0]]
         def store(X):
             x, y = X
             all_x_i.append(x)
             all_y_i.append(y)
-            all_f_i.append(self.__cost(X))
+            # the iterate was just evaluated by the optimizer, so this is a cache hit
+            all_f_i.append(self.value_and_grad(X)[0])
         # end callback
             
-        grad_AD = grad(self.__cost, 0)
         if self.bounds == []:
-            optim = optimize.minimize(self.__cost, self.I_params_init, args = (), jac = grad_AD, method = self.method)
+            optim = optimize.minimize(self.value_and_grad, self.I_params_init, args = (), jac = True, method = self.method)
         else: 
             #self.callback.iteration = 0
-            optim = optimize.minimize(self.__cost, self.I_params_init, args = (), jac = grad_AD, bounds = self.bounds, callback = store, method = self.method) #options={'disp': True, 'maxiter':3})
+            optim = optimize.minimize(self.value_and_grad, self.I_params_init, args = (), jac = True, bounds = self.bounds, callback = store, method = self.method) #options={'disp': True, 'maxiter':3})
         return optim
    
     def recovery(self):
         X = self.optimize().x
         recovered = self.integrate_HH(X)
         return X, recovered
-import zipfile
-import csv
+sys.path.append('.')
+import trace_store
 
 fname = 'gt_1a' # user defined filename
 
-with zipfile.ZipFile('./sim_data/' + fname + '.zip', 'r') as zip_ref:
-    zip_ref.extractall()
-    
-with open(fname + '.csv', newline='') as csvfile:
-    data = list(csv.reader(csvfile))
-
-t_data = [row[0] for row in data][1:-1] # extract time data
-t_data = np.array([float(i) for i in t_data]) # convert to numpy array of floats
-
-V_data = [row[1] for row in data][1:-1]
-V_data = np.array([float(i) for i in V_data])
-
-I_data = [row[2] for row in data][1:-1]
-I_data = np.array([float(i) for i in I_data])
+# memory mapped from the binary trace store instead of extracting and parsing the csv
+t_data, V_data, I_data = trace_store.load_trace(fname)
 
 
 V0 = V_data[0]
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression tests of neuralnet/NNparallel.train_parallel, run with python -m pytest development/tests
+"""
+import os
+import sys
+import time
+import signal
+import threading
+import faulthandler
+import multiprocessing
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'neuralnet'))
+import NNvector
+import NNparallel
+
+
+def _data(n=512, nin=20, nout=5, seed=0):
+    rng = np.random.default_rng(seed)
+    voltage = rng.random((n, nin))
+    return voltage, 1/(1 + np.exp(-voltage[:, :nout]))
+
+
+def test_matches_in_process_training():
+    voltage, stim = _data()
+    runs = []
+    for workers in (1, 2):
+        NN = NNvector.Multilayers(voltage.shape[1], [8, stim.shape[1]], seed=0)
+        runs.append(NNparallel.train_parallel(NN, voltage, stim, workers=workers, epochs=2, error_thresh=0, seed=0, verbose=False))
+    assert np.allclose([h['loss'] for h in runs[0]], [h['loss'] for h in runs[1]])
+
+
+def test_killed_worker_raises():
+    '''a worker killed mid epoch ends training with a RuntimeError instead of hanging the parent'''
+    voltage, stim = _data(n=4096)
+    NN = NNvector.Multilayers(voltage.shape[1], [64, 64, stim.shape[1]], seed=0)
+    killed = []
+
+    def kill_one():
+        deadline = time.monotonic() + 30
+        while len(multiprocessing.active_children()) < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(1.5)
+        children = multiprocessing.active_children()
+        if children:
+            os.kill(children[0].pid, signal.SIGKILL)
+            killed.append(children[0].pid)
+
+    faulthandler.dump_traceback_later(120, exit=True) #a hang fails the run instead of blocking it
+    killer = threading.Thread(target=kill_one, daemon=True)
+    killer.start()
+    start = time.monotonic()
+    try:
+        with pytest.raises(RuntimeError, match='worker failed'):
+            NNparallel.train_parallel(NN, voltage, stim, workers=3, batch_size=64, epochs=100000, error_thresh=0,
+                                      seed=0, verbose=False)
+    finally:
+        faulthandler.cancel_dump_traceback_later()
+    assert killed
+    assert time.monotonic() - start < 30
+    killer.join()
+    #the surviving workers are shut down with the parent, none is left behind
+    assert not multiprocessing.active_children()
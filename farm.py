@@ -0,0 +1,207 @@
+import os
+import json
+import hashlib
+import itertools
+import argparse
+import multiprocessing
+import numpy as np
+import trace_store
+
+# Ground truth traces from NEURON, generated in parallel. A sweep is a list of parameter dicts, each
+# simulated by a pool of worker processes that build their own NEURON instance and cell once (HH_NEURON
+# from NEURON_inst.py or the L5PC model of sim_data/models with the compiled mechanisms of sim_data) and
+# only change parameters between runs. Every trace goes straight from the worker into a trace store
+# directory under a key derived from its parameters, and the parent appends its header to manifest.jsonl,
+# so an interrupted sweep resumes where it stopped.
+#
+# usage (from the repo root):
+#     python farm.py --model HH --grid '{"amp": [0.05, 0.1, 0.2], "dur": [5, 50], "gnabar": [0.1, 0.12]}'
+#     python farm.py --model L5PC --grid '{"amp": [0, 1.5], "syn_imax": [0, 0.5], "somatic.gNaTa_tbar_NaTa_t": [0.8, 1.0]}'
+
+SIM_DIR = os.path.join(trace_store.ROOT, 'sim_data')
+FARM_DIR = os.path.join(SIM_DIR, 'farm')
+MANIFEST = 'manifest.jsonl'
+
+# run settings and their defaults, every other key of a job is a stimulus or biophysical parameter
+RUN = {'tstop': 250.0, 'dt': 0.025, 'v_init': -65.0}
+MODELS = {
+    # IClamp delay/dur/amp plus the soma hh conductances and leak reversal potential, see NEURON_inst.HH_NEURON
+    'HH': {'delay': 10.0, 'dur': 100.0, 'amp': 0.1, 'gnabar': 0.12, 'gkbar': 0.036, 'gl': 0.003, 'el': -54.3},
+    # settings of the sim_data notebooks: somatic step current, EPSP-like current at apic[36](0.9) 5 ms after its onset;
+    # '<sectionlist>.<range variable>' keys scale the distributed value, e.g. 'somatic.gNaTa_tbar_NaTa_t': 1.2
+    'L5PC': {'delay': 60.0, 'dur': 5.0, 'amp': 1.5, 'syn_imax': 0.0, 'syn_tau0': 0.5, 'syn_tau1': 5.0,
+             'tstop': 100.0, 'v_init': -80.0, 'celsius': 37.0},
+}
+
+
+def grid(**axes):
+    '''every combination of the given parameter values, e.g. grid(amp = [0.1, 0.2], dur = [5, 50])'''
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[n] for n in names))]
+
+
+def sample(n, seed = None, **ranges):
+    '''n parameter dicts drawn uniformly from (low, high) ranges, e.g. sample(100, amp = (0.05, 0.3))'''
+    rng = np.random.default_rng(seed)
+    draws = {name: rng.uniform(lo, hi, n) for name, (lo, hi) in ranges.items()}
+    return [{name: float(draws[name][i]) for name in ranges} for i in range(n)]
+
+
+def job_key(model, params):
+    '''content key of a simulation, identical parameters map to the same trace'''
+    full = dict(MODELS[model], **params)
+    text = json.dumps([model, sorted((k, float(v)) for k, v in full.items())])
+    return model.lower() + '_' + hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+class _hh_worker:
+    def __init__(self):
+        from NEURON_inst import HH_NEURON
+        self.cell = HH_NEURON()
+        self.cell.record()
+
+    def __call__(self, p):
+        self.cell.set_biophysics(p['gnabar'], p['gkbar'], p['gl'], p['el'])
+        self.cell.set_stim(p['delay'], p['dur'], p['amp'])
+        return self.cell.run(p['tstop'], p['dt'], p['v_init'])
+
+
+class _l5pc_worker:
+    def __init__(self):
+        import neuron
+        from neuron import h
+        # finds the compiled mechanisms in sim_data/<arch> (e.g. x86_64, built with nrnivmodl mods)
+        neuron.load_mechanisms(SIM_DIR)
+        h.load_file('stdrun.hoc')
+        h.load_file('import3d.hoc')
+        h.load_file(os.path.join(SIM_DIR, 'models', 'L5PCbiophys3.hoc'))
+        h.load_file(os.path.join(SIM_DIR, 'models', 'L5PCtemplate.hoc'))
+        self.h = h
+        self.cell = h.L5PCtemplate(os.path.join(SIM_DIR, 'morphologies', 'cell1.asc'))
+        self.stim = h.IClamp(0.5, sec = self.cell.soma[0])
+        self.syn = h.epsp(self.cell.apic[36](0.9))
+        self.t_vec = h.Vector().record(h._ref_t)
+        self.v_vec = h.Vector().record(self.cell.soma[0](0.5)._ref_v)
+        self.i_vec = h.Vector().record(self.stim._ref_i)
+        self.defaults = {} #distributed values before any scaling, (section, x, name) -> value
+        self.scaled = set() #keys scaled by the previous job
+
+    def scale(self, key, factor):
+        sections, name = key.split('.', 1)
+        for sec in getattr(self.cell, sections):
+            for seg in sec:
+                if not hasattr(seg, name):
+                    continue
+                default = self.defaults.setdefault((sec.name(), seg.x, name), getattr(seg, name))
+                setattr(seg, name, default * factor)
+
+    def __call__(self, p):
+        h = self.h
+        # factors of the previous job that this one does not set go back to 1
+        keys = {k for k in p if '.' in k}
+        for key in keys | self.scaled:
+            self.scale(key, p.get(key, 1.0))
+        self.scaled = keys
+        self.stim.delay, self.stim.dur, self.stim.amp = p['delay'], p['dur'], p['amp']
+        self.syn.tau0, self.syn.tau1, self.syn.imax = p['syn_tau0'], p['syn_tau1'], p['syn_imax']
+        self.syn.onset = p['delay'] + 5
+        h.celsius = p['celsius']
+        h.dt = p['dt']
+        h.steps_per_ms = 1.0 / p['dt']
+        h.tstop = p['tstop']
+        h.v_init = p['v_init']
+        h.run()
+        return np.array(self.t_vec), np.array(self.v_vec), np.array(self.i_vec)
+
+
+_worker = None
+
+
+def _init(model):
+    '''builds the NEURON model once per worker process'''
+    global _worker
+    try:
+        _worker = _hh_worker() if model == 'HH' else _l5pc_worker()
+    except Exception as err:
+        # a failing pool initializer makes the pool restart workers forever, the error is raised by the first job instead
+        _worker = err
+
+
+def _run(job):
+    '''simulates one job in a worker and writes it to the trace store, returns its header'''
+    model, key, params, out_dir = job
+    full = dict(RUN, **MODELS[model])
+    full.update(params)
+    if isinstance(_worker, Exception):
+        raise RuntimeError('could not build the %s model in the worker' % model) from _worker
+    t, V, I = _worker(full)
+    header = {'model': model, 'params': full, 'n_samples': len(t), 'n_spikes': int(np.sum((V[:-1] < -20.0) & (V[1:] >= -20.0)))}
+    return trace_store.write(key, {'time': t, 'voltage': V, 'stim': I}, header, out_dir)
+
+
+def manifest(out_dir = FARM_DIR):
+    '''headers of every trace written to out_dir so far'''
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load(key, out_dir = FARM_DIR):
+    '''t_data, V_data, I_data of a generated trace, memory mapped'''
+    columns = trace_store.read(key, out_dir)[0]
+    return columns['time'], columns['voltage'], columns['stim']
+
+
+def generate(model, jobs, out_dir = FARM_DIR, workers = None, chunksize = 1, verbose = True):
+    '''
+    simulates every parameter dict of jobs across a process pool
+    Args:
+        model (str): 'HH' or 'L5PC'
+        jobs (list): parameter dicts, e.g. grid(amp = [0.1, 0.2]) or sample(1000, amp = (0, 2)), missing keys take MODELS defaults
+        out_dir (str): trace store directory holding the traces and manifest.jsonl
+        workers (int): processes, defaults to the number of cores
+        chunksize (int): jobs handed to a worker at once
+    Returns:
+        headers (list): manifest entries of the jobs, including ones generated by an earlier run
+    '''
+    if model not in MODELS:
+        raise ValueError("model must be 'HH' or 'L5PC'")
+    os.makedirs(out_dir, exist_ok = True)
+    done = {entry['key']: entry for entry in manifest(out_dir)}
+    todo = []
+    queued = set()
+    for params in jobs:
+        key = job_key(model, params)
+        if key not in done and key not in queued:
+            queued.add(key)
+            todo.append((model, key, params, out_dir))
+    if verbose:
+        print('%d jobs, %d already in %s' % (len(jobs), len(jobs) - len(todo), out_dir))
+    if todo:
+        # spawned workers start from a clean interpreter, NEURON is never forked
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(workers, initializer = _init, initargs = (model,)) as pool, \
+                open(os.path.join(out_dir, MANIFEST), 'a') as f:
+            for i, header in enumerate(pool.imap_unordered(_run, todo, chunksize), 1):
+                f.write(json.dumps(header) + '\n')
+                f.flush()
+                done[header['key']] = header
+                if verbose:
+                    print('%d/%d %s spikes=%d' % (i, len(todo), header['key'], header['n_spikes']))
+    return [done[job_key(model, params)] for params in jobs]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'generate NEURON ground truth traces over a parameter sweep')
+    parser.add_argument('--model', default = 'HH', choices = list(MODELS))
+    parser.add_argument('--grid', default = '{}', help = 'JSON dict of parameter name -> list of values')
+    parser.add_argument('--sample', type = int, default = None, help = 'draw this many jobs, --grid then holds [low, high] ranges')
+    parser.add_argument('--seed', type = int, default = None)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--out', default = FARM_DIR)
+    args = parser.parse_args()
+    axes = json.loads(args.grid)
+    jobs = sample(args.sample, args.seed, **axes) if args.sample else grid(**axes)
+    generate(args.model, jobs, args.out, args.workers)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+(voltage, stim) training pairs for the neural networks and a loader that streams them in shuffled mini-batches.
+
+Pairs come from the sim_data archives, cut into segments of nin samples, or from Hodgkin Huxley
+simulations of random gaussian impulses run as one ensemble. Both are generators, so a loader built on
+them never holds more than its shuffle buffer in memory.
+"""
+import os
+import sys
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# HH parameters of the examples, (g_Na, g_K, g_L, E_Na, E_K, E_L, C_m) and initial state (V, m, h, n)
+HH_P = (120.0, 36.0, 0.3, 50.0, -77.0, -55.0, 1.0)
+HH_X0 = (-65.0, 0.05, 0.6, 0.32)
+
+
+def prepare(voltage, stim):
+    '''scaling of the example notebook, voltage min-max scaled onto [0, 1] and stim mapped to 1/(1 + exp(stim)),
+    applied to every row of a batch'''
+    voltage = np.atleast_2d(np.asarray(voltage, dtype=float))
+    mn = voltage.min(axis=1, keepdims=True)
+    r = voltage.max(axis=1, keepdims=True) - mn
+    voltage = (voltage - mn)/np.where(r > 0, r, 1.0)
+    stim = 1/(1 + np.exp(np.atleast_2d(np.asarray(stim, dtype=float))))
+    return voltage, stim
+
+
+def rescale(stim_pred):
+    '''network output back to the stimulus scale, inverse of the stim mapping of prepare'''
+    return np.log((1/(stim_pred + 1e-8)) - 1)
+
+
+def archive_pairs(names, nin, stride=None, active=False):
+    '''
+    (voltage, stim) segments of nin samples cut from trace store archives
+    Args:
+        names (list): archive names in sim_data, e.g. ['hh_1ap', 'hh_multap']
+        nin (int): samples per segment
+        stride (int): samples between segment starts, defaults to nin (no overlap)
+        active (bool): keep only segments during which the stimulus is on somewhere
+    Returns:
+        pairs (generator): (voltage, stim) arrays of length nin
+    '''
+    if ROOT not in sys.path:
+        sys.path.append(ROOT)
+    import trace_store
+    stride = nin if stride is None else stride
+    for name in names:
+        t, V, I = trace_store.load_trace(name)
+        for start in range(0, len(t) - nin + 1, stride):
+            stim = np.array(I[start:start+nin])
+            if active and not np.any(stim):
+                continue
+            yield np.array(V[start:start+nin]), stim
+
+
+def synthetic_pairs(n, nin, dt=0.025, amplitude=(1.0, 20.0), width=(0.5, 5.0), seed=None, chunk=256, scheme='euler'):
+    '''
+    (voltage, stim) pairs of Hodgkin Huxley responses to gaussian impulses a*exp(-(t-b)^2/(2c^2)) with random a, b, c
+    Args:
+        n (int): number of pairs
+        nin (int): samples per pair
+        dt (float): time step (ms)
+        amplitude, width (tuples): ranges a and c are drawn from, b is drawn from the middle half of the trace
+        seed (int): seed of the random impulses
+        chunk (int): pairs simulated together as one ensemble
+        scheme (str): integrator of hh_ensemble
+    Returns:
+        pairs (generator): (voltage, stim) arrays of length nin
+    '''
+    adjoint = os.path.join(ROOT, 'adjoint')
+    if adjoint not in sys.path:
+        sys.path.append(adjoint)
+    import hh_ensemble
+    rng = np.random.default_rng(seed)
+    t = np.arange(nin)*dt
+    for start in range(0, n, chunk):
+        k = min(chunk, n - start)
+        a = rng.uniform(*amplitude, size=(k, 1))
+        c = rng.uniform(*width, size=(k, 1))
+        b = rng.uniform(0.25, 0.75, size=(k, 1))*t[-1]
+        I = a*np.exp(-(t - b)**2/(2*c**2))
+        V = hh_ensemble.integrate_ensemble(np.array(HH_X0), I, np.array(HH_P), dt, scheme=scheme)
+        for i in range(k):
+            yield V[i], I[i]
+
+
+class loader:
+    "streams (voltage, stim) pairs in mini-batches of prepared (batch, nin) arrays, one pass over the source per epoch"
+
+    def __init__(self, source, batch_size=32, shuffle=True, buffer_size=4096, seed=None, transform=prepare):
+        '''
+        Args:
+            source (list or function): list of (voltage, stim) pairs, or a function without arguments returning a fresh
+                                       iterable of pairs each epoch, e.g. lambda: archive_pairs(['hh_multap'], 200)
+            batch_size (int): pairs per batch, the last batch of an epoch may be smaller
+            shuffle (bool): shuffles the pairs through a buffer of buffer_size pairs (exact for shorter sources)
+            seed (int): seed of the shuffling
+            transform (function): applied to every (voltage, stim) batch, None keeps the raw values
+        '''
+        self.source = source
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.rng = np.random.default_rng(seed)
+        self.transform = transform
+
+    def pairs(self):
+        pairs = self.source() if callable(self.source) else self.source
+        if not self.shuffle:
+            yield from pairs
+            return
+        buffer = []
+        for pair in pairs:
+            if len(buffer) < self.buffer_size:
+                buffer.append(pair)
+                continue
+            i = self.rng.integers(len(buffer))
+            yield buffer[i]
+            buffer[i] = pair
+        self.rng.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        batch = []
+        for pair in self.pairs():
+            batch.append(pair)
+            if len(batch) == self.batch_size:
+                yield self.__stack(batch)
+                batch = []
+        if batch:
+            yield self.__stack(batch)
+
+    def __stack(self, batch):
+        voltage = np.stack([v for v, _ in batch])
+        stim = np.stack([s for _, s in batch])
+        if self.transform is None:
+            return voltage, stim
+        return self.transform(voltage, stim)
@@ -8,22 +8,51 @@ Created on Tue Dec  5 10:56:47 2023
 import random
 import numpy as np
 
+class Tape(object):
+    "arena of the nodes linked during one forward/backward pass, released once the pass is done"
+    active = None #tape of the network currently running a pass
+    
+    __slots__ = ('nodes', 'created', 'peak', 'peak_linked', 'passes')
+    
+    def __init__(self):
+        self.nodes = [] #nodes with children or parents in this pass
+        self.created = 0 #Params created in this pass
+        self.peak = 0 #most Params created by one pass
+        self.peak_linked = 0 #most nodes linked in one pass
+        self.passes = 0
+        
+    def activate(self):
+        Tape.active = self
+        
+    def release(self):
+        "unlinks every node of the pass, so the graph can be freed, and updates the peak counts"
+        if not self.created and not self.nodes:
+            return
+        for node in self.nodes:
+            node.children = []
+            node.parents = []
+        self.peak = max(self.peak, self.created)
+        self.peak_linked = max(self.peak_linked, len(self.nodes))
+        self.passes += 1
+        self.nodes = []
+        self.created = 0
+        if Tape.active is self:
+            Tape.active = None
+
 class Family(object):
+    "kept for compatibility, Params are no longer registered globally; clear_families releases the active tape"
     params = []
     
-    def __init__(self, param_obj):
-        Family.params.append(self)
-        self.param_obj = param_obj
-        
     @classmethod
     def clear_families(cls):
-        for obj in cls.params:
-            obj.children = []
-            obj.parents = []
+        if Tape.active is not None:
+            Tape.active.release()
 
 class Param:
     "stores parameter (wi, bj, h) values and gradients"
     
+    __slots__ = ('value', 'grad', 'children', 'parents')
+    
     def __init__(self, value):
         if isinstance(value, Param):
             self.value = value.value
@@ -32,7 +61,8 @@ class Param:
         self.grad = 0
         self.children = []
         self.parents = []
-        Family(self)
+        if Tape.active is not None:
+            Tape.active.created += 1
         
     def __add__(self, other):
         if isinstance(other, Param):
@@ -80,6 +110,13 @@ class Param:
         return self.value*(1-self.value) 
     
     def child(self, child_param):
+        tape = Tape.active
+        if tape is not None:
+            #first link of either node in this pass puts it on the tape
+            if not self.children and not self.parents:
+                tape.nodes.append(self)
+            if not child_param.children and not child_param.parents:
+                tape.nodes.append(child_param)
         self.children.append(child_param)
         child_param.parents.append(self)
     
@@ -177,8 +214,11 @@ class Multilayers():
         sz = [nin] + nouts
         self.layers = [Layer(sz[i], sz[i+1], act=i==len(nouts)-1) for i in range(len(nouts))]
         self.pred = None #calculated by forward pass, to be used by backward pass
+        self.tape = Tape() #nodes of the current pass, tape.peak / tape.peak_linked report the largest pass
 
     def __call__(self, x, y_true):
+        self.tape.release() #graph of a previous pass that was never propagated back
+        self.tape.activate()
         biases = []
         y_pred_list = [] #FOR DEBUGGING ONLY
         for layer in self.layers:
@@ -199,6 +239,7 @@ class Multilayers():
         at_end = [True] + [False]*(len(self.layers)-1)
         for layer, boo in zip(reversed(self.layers), at_end):
             layer.backward(boo, self.pred)
+        self.tape.release()
     
     def parameters(self):
         return [p for layer in self.layers for p in layer.parameters()]
@@ -225,7 +266,6 @@ def Run_NN(ML_instance, stim, voltage, error_thresh=.1, iter_lim=100, loss=1000)
     count = 0
     while (loss > error_thresh) and (count < iter_lim):
         stim_pred,loss = forward(NN, stim, voltage)
-        backward(NN)
-        Family.clear_families()
+        backward(NN) #releases the tape of the pass
         count += 1
     return stim_pred,loss
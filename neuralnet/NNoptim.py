@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Optimizers, learning rate schedules and gradient clipping for NNvector.Multilayers.
+
+Optimizers update a list of parameter arrays in place from a matching list of gradients and keep
+their state (velocities, moment estimates) as arrays of the same shapes. Schedules are called once
+per iteration or epoch with the optimizer and the latest loss and set optimizer.lr.
+"""
+import numpy as np
+
+
+class sgd:
+    "gradient descent with optional (nesterov) momentum"
+
+    def __init__(self, lr=.002, momentum=0.0, nesterov=False):
+        self.lr = lr
+        self.momentum = momentum
+        self.nesterov = nesterov
+        self.velocity = None
+
+    def step(self, params, grads):
+        if not self.momentum:
+            for p, g in zip(params, grads):
+                p -= self.lr*g
+            return
+        if self.velocity is None:
+            self.velocity = [np.zeros_like(p) for p in params]
+        for p, g, v in zip(params, grads, self.velocity):
+            v *= self.momentum
+            v += g
+            p -= self.lr*(g + self.momentum*v if self.nesterov else v)
+
+
+class rmsprop:
+    "gradient scaled by a running root mean square of past gradients"
+
+    def __init__(self, lr=.001, decay=.9, eps=1e-8):
+        self.lr = lr
+        self.decay = decay
+        self.eps = eps
+        self.square = None
+
+    def step(self, params, grads):
+        if self.square is None:
+            self.square = [np.zeros_like(p) for p in params]
+        for p, g, s in zip(params, grads, self.square):
+            s *= self.decay
+            s += (1 - self.decay)*g**2
+            p -= self.lr*g/(np.sqrt(s) + self.eps)
+
+
+class adam:
+    "bias corrected running first and second moments of the gradient"
+
+    def __init__(self, lr=.001, beta1=.9, beta2=.999, eps=1e-8):
+        self.lr = lr
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.eps = eps
+        self.t = 0
+        self.m = self.v = None
+
+    def step(self, params, grads):
+        if self.m is None:
+            self.m = [np.zeros_like(p) for p in params]
+            self.v = [np.zeros_like(p) for p in params]
+        self.t += 1
+        lr = self.lr*np.sqrt(1 - self.beta2**self.t)/(1 - self.beta1**self.t)
+        for p, g, m, v in zip(params, grads, self.m, self.v):
+            m *= self.beta1
+            m += (1 - self.beta1)*g
+            v *= self.beta2
+            v += (1 - self.beta2)*g**2
+            p -= lr*m/(np.sqrt(v) + self.eps)
+
+
+optimizers = {'sgd': sgd, 'momentum': lambda **kw: sgd(**dict({'momentum': .9}, **kw)), 'rmsprop': rmsprop, 'adam': adam}
+
+
+def get_optimizer(optimizer, **kwargs):
+    '''optimizer instance from a name in optimizers ('sgd', 'momentum', 'rmsprop', 'adam') or an instance, returned unchanged'''
+    if isinstance(optimizer, str):
+        if optimizer not in optimizers:
+            raise ValueError('optimizer must be one of ' + ', '.join(optimizers))
+        return optimizers[optimizer](**kwargs)
+    return optimizer
+
+
+class step_decay:
+    "multiplies the learning rate by factor every `every` calls"
+
+    def __init__(self, every, factor=.5):
+        self.every = every
+        self.factor = factor
+        self.calls = 0
+
+    def __call__(self, optimizer, loss=None):
+        self.calls += 1
+        if self.calls % self.every == 0:
+            optimizer.lr *= self.factor
+
+
+class cosine:
+    "anneals the learning rate from its initial value to lr_min over total calls"
+
+    def __init__(self, total, lr_min=0.0):
+        self.total = total
+        self.lr_min = lr_min
+        self.calls = 0
+        self.lr0 = None
+
+    def __call__(self, optimizer, loss=None):
+        if self.lr0 is None:
+            self.lr0 = optimizer.lr
+        self.calls = min(self.calls + 1, self.total)
+        optimizer.lr = self.lr_min + (self.lr0 - self.lr_min)*(1 + np.cos(np.pi*self.calls/self.total))/2
+
+
+class plateau:
+    "multiplies the learning rate by factor once the loss has not improved by threshold for patience calls"
+
+    def __init__(self, factor=.5, patience=5, threshold=1e-4, lr_min=0.0):
+        self.factor = factor
+        self.patience = patience
+        self.threshold = threshold
+        self.lr_min = lr_min
+        self.best = np.inf
+        self.wait = 0
+
+    def __call__(self, optimizer, loss=None):
+        if loss < self.best*(1 - self.threshold):
+            self.best = loss
+            self.wait = 0
+            return
+        self.wait += 1
+        if self.wait >= self.patience:
+            optimizer.lr = max(optimizer.lr*self.factor, self.lr_min)
+            self.wait = 0
+
+
+def clip_norm(grads, max_norm):
+    '''scales the gradients in place so their global L2 norm is at most max_norm, returns the norm before clipping'''
+    norm = np.sqrt(sum(np.sum(g**2) for g in grads))
+    if norm > max_norm:
+        for g in grads:
+            g *= max_norm/norm
+    return norm
+
+
+def clip_value(grads, max_value):
+    '''clips every gradient entry in place to [-max_value, max_value]'''
+    for g in grads:
+        np.clip(g, -max_value, max_value, out=g)
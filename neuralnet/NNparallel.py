@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Data-parallel training of NNvector.Multilayers on one machine.
+
+The training data, the parameters and one gradient row per worker live in shared memory. Each step the
+parent writes the indices of the next mini-batch and sends its size down one pipe per worker, every worker
+computes the gradient of its shard of that batch into its row and answers with its loss, and the parent
+sums the rows and steps the parameters in place, so every worker sees the updated network without any
+copying. The parent waits on the pipes together with the process sentinels, so a worker that raises or
+is killed ends training with a RuntimeError instead of leaving the parent waiting for its answer.
+Batches are drawn from a seeded permutation per epoch, so for a fixed seed the result matches workers=1
+(which runs in process) up to the summation order.
+"""
+import time
+import multiprocessing
+from multiprocessing import connection, shared_memory
+import numpy as np
+import NNvector
+
+_GRACE = 1.0 #seconds a worker gets to exit at shutdown before it is terminated
+
+
+def _shared(shape, ctx_list, value=None):
+    '''float64 array in a new shared memory block, the block is appended to ctx_list so it can be freed'''
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape))*8, 8))
+    ctx_list.append(shm)
+    out = np.ndarray(shape, dtype=float, buffer=shm.buf)
+    if value is not None:
+        out[...] = value
+    return out
+
+
+def _attach(name, shape, ctx_list):
+    shm = shared_memory.SharedMemory(name=name)
+    ctx_list.append(shm)
+    return np.ndarray(shape, dtype=float, buffer=shm.buf)
+
+
+def _bind(NN, flat, copy=True):
+    '''makes the weights and biases of NN views into the flat parameter vector, copying their values into it first'''
+    offset = 0
+    for layer in NN.layers:
+        for name in ('W', 'b'):
+            p = getattr(layer, name)
+            view = flat[offset:offset + p.size].reshape(p.shape)
+            if copy:
+                view[...] = p
+            setattr(layer, name, view)
+            offset += p.size
+    return offset
+
+
+def _flatten_grad(NN, out):
+    offset = 0
+    for g in NN.gradients():
+        out[offset:offset + g.size] = g.ravel()
+        offset += g.size
+
+
+def _shard_gradient(NN, voltage, stim, idx, n_batch, grad_out):
+    '''gradient of the loss of the full batch restricted to the samples idx, returns their summed squared error'''
+    if not len(idx):
+        grad_out[...] = 0.0
+        return 0.0
+    v, s = voltage[idx], stim[idx]
+    pred = NN(v, s)
+    NN.grad *= len(idx)/n_batch #the loss is a mean over the whole batch, not over the shard
+    NN.gradient()
+    _flatten_grad(NN, grad_out)
+    return float(np.sum((s - pred)**2))
+
+
+def _worker(rank, workers, sizes, names, shapes, conn):
+    '''answers every batch size received on conn with the loss of its shard, exits on a negative size or a closed pipe'''
+    blocks = []
+    voltage, stim, params, grads, idx = [_attach(n, shp, blocks) for n, shp in zip(names, shapes)]
+    try:
+        NN = NNvector.Multilayers(sizes[0], sizes[1:])
+        _bind(NN, params, copy=False)
+        while True:
+            n_batch = conn.recv()
+            if n_batch < 0:
+                break
+            shard = np.array_split(idx[:n_batch].astype(int), workers)[rank]
+            conn.send(_shard_gradient(NN, voltage, stim, shard, n_batch, grads[rank]))
+    except EOFError:
+        pass #the parent is gone
+    finally:
+        del voltage, stim, params, grads, idx
+        for shm in blocks:
+            shm.close()
+        conn.close()
+
+
+def _failed(procs):
+    '''error naming the exit codes of the workers, waits for the failed one to exit when it only closed its pipe so far'''
+    deadline = time.monotonic() + _GRACE
+    while all(proc.exitcode is None for proc in procs) and time.monotonic() < deadline:
+        time.sleep(0.01) #the sentinel of an exiting worker can be ready shortly before its exit code is
+    return RuntimeError('a training worker failed, exit codes %s' % [proc.exitcode for proc in procs])
+
+
+def _gather(conns, procs):
+    '''sum of the losses the workers answer with, raises RuntimeError as soon as one of them exits instead'''
+    pending = set(conns)
+    sentinels = {proc.sentinel for proc in procs}
+    total = 0.0
+    while pending:
+        #a dead worker shows up as a ready sentinel, nothing it may have held has to be acquired to notice it
+        ready = connection.wait(list(pending) + list(sentinels))
+        if sentinels.intersection(ready):
+            raise _failed(procs)
+        for conn in ready:
+            try:
+                total += conn.recv()
+            except EOFError:
+                raise _failed(procs) from None
+            pending.discard(conn)
+    return total
+
+
+def train_parallel(ML_instance, voltage, stim, workers=None, batch_size=64, epochs=10, error_thresh=.1, seed=None,
+                   step_size=.002, verbose=True, optimizer=None, schedule=None, clip=None):
+    '''
+    mini-batch training with the batch gradient computed by worker processes on disjoint shards
+    Args:
+        ML_instance (NNvector.Multilayers): network to train, its parameters are updated in place
+        voltage, stim (arrays): (N, nin) and (N, nout) training pairs, already scaled (see NNdata.prepare)
+        workers (int): number of processes, defaults to the number of cores, 1 trains in process
+        batch_size (int): pairs per step, split evenly over the workers
+        epochs (int): maximum number of passes over the data
+        error_thresh (float): stops once the mean loss of an epoch is below it
+        seed (int): seed of the batch order
+        step_size (float): passed to Multilayers.step
+        verbose (bool): prints the metrics of every epoch
+        optimizer, schedule, clip: see NNvector.train, the optimizer runs in the parent on the reduced gradient
+    Returns:
+        history (list): per epoch dict of the mean loss, batch and sample counts and wall time, like NNvector.train
+    '''
+    NN = ML_instance
+    NNvector.configure(NN, optimizer, schedule, clip)
+    voltage = np.atleast_2d(np.asarray(voltage, dtype=float))
+    stim = np.atleast_2d(np.asarray(stim, dtype=float))
+    workers = multiprocessing.cpu_count() if workers is None else workers
+    sizes = [NN.layers[0].nin] + [layer.nout for layer in NN.layers]
+    n_params = sum(p.size for p in NN.parameters())
+    rng = np.random.default_rng(seed)
+
+    blocks = []
+    procs = []
+    conns = []
+    ctx = multiprocessing.get_context()
+    try:
+        if workers > 1:
+            shapes = [voltage.shape, stim.shape, (n_params,), (workers, n_params), (batch_size,)]
+            arrays = [_shared(voltage.shape, blocks, voltage), _shared(stim.shape, blocks, stim), _shared((n_params,), blocks),
+                      _shared((workers, n_params), blocks), _shared((batch_size,), blocks)]
+            voltage_s, stim_s, params, grads, idx = arrays
+            _bind(NN, params)
+            names = [shm.name for shm in blocks]
+            for rank in range(workers):
+                conn, child = ctx.Pipe()
+                procs.append(ctx.Process(target=_worker, args=(rank, workers, sizes, names, shapes, child), daemon=True))
+                procs[-1].start()
+                child.close()
+                conns.append(conn)
+        else:
+            grads = np.zeros((1, n_params))
+        total_grad = np.empty(n_params)
+
+        history = []
+        for epoch in range(epochs):
+            t0 = time.perf_counter()
+            total = 0.0
+            n_batches = 0
+            order = rng.permutation(len(voltage))
+            for b in range(0, len(order), batch_size):
+                batch = order[b:b + batch_size]
+                if workers > 1:
+                    idx[:len(batch)] = batch
+                    try:
+                        for conn in conns:
+                            conn.send(len(batch))
+                    except OSError:
+                        raise _failed(procs) from None
+                    total += _gather(conns, procs)
+                else:
+                    total += _shard_gradient(NN, voltage, stim, batch, len(batch), grads[0])
+                np.sum(grads, axis=0, out=total_grad)
+                #hand the reduced gradient to the layers and step as in single process training
+                offset = 0
+                for layer in NN.layers:
+                    layer.dW = total_grad[offset:offset + layer.W.size].reshape(layer.W.shape)
+                    offset += layer.W.size
+                    layer.db = total_grad[offset:offset + layer.b.size]
+                    offset += layer.b.size
+                NN.step(step_size)
+                n_batches += 1
+            history.append({'epoch': epoch, 'loss': total/(len(voltage)*stim.shape[1]), 'batches': n_batches,
+                            'samples': len(voltage), 'time': time.perf_counter() - t0})
+            if verbose:
+                print('epoch %d: loss %.6g over %d samples (%.2f s)' % (epoch, history[-1]['loss'], len(voltage), history[-1]['time']))
+            if schedule is not None:
+                schedule(NN.optimizer, history[-1]['loss'])
+            if history[-1]['loss'] < error_thresh:
+                break
+    finally:
+        for conn in conns:
+            try:
+                conn.send(-1)
+            except OSError:
+                pass #the worker is already gone
+        for proc in procs:
+            proc.join(_GRACE)
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+        for conn in conns:
+            conn.close()
+        if procs:
+            #the network keeps private copies of its parameters once the shared blocks are gone
+            for layer in NN.layers:
+                layer.W = np.array(layer.W)
+                layer.b = np.array(layer.b)
+            del voltage_s, stim_s, params, grads, idx, arrays
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return history
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Matrix backed version of NNengine with the same Multilayers/Run_NN API.
+
+Every layer holds a weight matrix and a bias vector instead of one Param object per scalar,
+the forward pass is a matrix product per layer with the activations cached for the backward pass,
+and the backward pass is the exact gradient of the mean squared loss. Inputs can be a single trace
+of shape (nin,) or a batch of traces of shape (batch, nin).
+
+The network is the one of NNengine: inputs are min-max scaled to [0, 1], the inputs of every later layer
+to [-1, 1], hidden layers are linear and the last layer is a sigmoid.
+"""
+import time
+import numpy as np
+import NNoptim
+
+
+def _scale(x, lo):
+    '''min-max scaling of every row of x onto [lo, 1], returns the scaled rows and their ranges'''
+    mn = x.min(axis=1, keepdims=True)
+    r = x.max(axis=1, keepdims=True) - mn
+    r = np.where(r > 0, r, 1.0) #constant rows are only shifted
+    return (1 - lo)*(x - mn)/r + lo, r
+
+
+def _scale_grad(x, r, g, lo):
+    '''gradient of _scale(x, lo) with respect to x given the gradient g of its output'''
+    rows = np.arange(len(x))
+    u = (x - x.min(axis=1, keepdims=True))/r
+    dx = (1 - lo)*g/r
+    #the row minimum and maximum move every scaled value
+    np.add.at(dx, (rows, x.argmin(axis=1)), -(1 - lo)*np.sum(g*(1 - u), axis=1)/r[:, 0])
+    np.add.at(dx, (rows, x.argmax(axis=1)), -(1 - lo)*np.sum(g*u, axis=1)/r[:, 0])
+    return dx
+
+
+class Layer:
+    "stores the weight matrix and bias vector of one layer and the activations of the last forward pass"
+
+    def __init__(self, nin, nout, act, rng):
+        self.nin = nin
+        self.nout = nout
+        self.act = act #boolean, sigmoid output
+        self.W = rng.uniform(-1, 1, (nin, nout))
+        self.b = rng.uniform(-1, 1, nout)
+        self.dW = np.zeros_like(self.W)
+        self.db = np.zeros_like(self.b)
+        self.x = self.r = self.xs = self.out = None #cached by forward pass, to be used by backward pass
+
+    def __call__(self, x, first):
+        lo = 0.0 if first else -1.0
+        xs, r = _scale(x, lo)
+        out = xs @ self.W + self.b
+        if self.act:
+            out = 1/(1 + np.exp(-out))
+        self.x, self.r, self.xs, self.out = x, r, xs, out
+        return out
+
+    def backward(self, grad, first):
+        '''accumulates dW, db from the gradient of the loss w.r.t. the layer output, returns the gradient w.r.t. its input'''
+        if self.act:
+            grad = grad*self.out*(1 - self.out)
+        self.dW = self.xs.T @ grad
+        self.db = grad.sum(axis=0)
+        if first: #the data needs no gradient
+            return None
+        return _scale_grad(self.x, self.r, grad @ self.W.T, -1.0)
+
+    def parameters(self):
+        return [self.W, self.b]
+
+    def gradients(self):
+        return [self.dW, self.db]
+
+
+class Multilayers():
+    "use to initiate neural network, neural network parameters"
+
+    def __init__(self, nin, nouts, seed=None):
+        sz = [nin] + nouts
+        rng = np.random.default_rng(seed)
+        self.layers = [Layer(sz[i], sz[i+1], act=i==len(nouts)-1, rng=rng) for i in range(len(nouts))]
+        self.pred = None #calculated by forward pass, to be used by backward pass
+        self.grad = None #gradient of the loss w.r.t. pred
+        self.buffers = {} #per batch size work arrays of predict, allocated once
+        self.optimizer = None #NNoptim optimizer used by step, plain gradient descent when None
+        self.clip = None #maximum global norm of the gradient
+
+    def __call__(self, x, y_true):
+        x = np.asarray(x, dtype=float)
+        single = x.ndim == 1
+        x = np.atleast_2d(x)
+        for i, layer in enumerate(self.layers):
+            x = layer(x, i == 0)
+        y_true = np.atleast_2d(np.asarray(y_true, dtype=float))
+        #mean over the batch of the mean squared loss of every trace
+        self.grad = 2*(x - y_true)/x.size
+        self.pred = x
+        return x[0] if single else x
+
+    def backward(self):
+        self.gradient()
+        self.step()
+
+    def gradient(self):
+        '''sets dW, db of every layer from the last forward pass without stepping'''
+        grad = self.grad
+        for i in reversed(range(len(self.layers))):
+            grad = self.layers[i].backward(grad, i == 0)
+
+    def step(self, step_size=.002): #change step size as necessary, ignored when an optimizer is set
+        grads = self.gradients()
+        if self.clip is not None:
+            NNoptim.clip_norm(grads, self.clip)
+        if self.optimizer is not None:
+            self.optimizer.step(self.parameters(), grads)
+            return
+        for layer in self.layers:
+            layer.W -= step_size*layer.dW
+            layer.b -= step_size*layer.db
+
+    def predict(self, x, out=None):
+        '''
+        stimulus prediction without loss, gradients or cached activations
+        Args:
+            x (array): (nin,) voltage trace or (batch, nin) traces
+            out (array): optional (batch, nout) array the prediction is written to
+        Returns:
+            stim_pred (array): (nout,) or (batch, nout)
+        '''
+        x = np.asarray(x, dtype=float)
+        single = x.ndim == 1
+        x = np.atleast_2d(x)
+        if len(x) not in self.buffers:
+            self.buffers[len(x)] = [(np.empty((len(x), layer.nin)), np.empty((len(x), 1)), np.empty((len(x), layer.nout)))
+                                    for layer in self.layers]
+        for i, (layer, (xs, r, y)) in enumerate(zip(self.layers, self.buffers[len(x)])):
+            #_scale and Layer.__call__ written into the work arrays
+            lo = 0.0 if i == 0 else -1.0
+            np.min(x, axis=1, keepdims=True, out=r)
+            np.subtract(x, r, out=xs)
+            np.max(xs, axis=1, keepdims=True, out=r)
+            r[r == 0] = 1.0
+            xs /= r
+            if lo:
+                xs *= 1 - lo
+                xs += lo
+            y = y if out is None or i < len(self.layers) - 1 else out.reshape(len(x), layer.nout)
+            np.matmul(xs, layer.W, out=y)
+            y += layer.b
+            if layer.act:
+                np.negative(y, out=y)
+                np.exp(y, out=y)
+                y += 1
+                np.reciprocal(y, out=y)
+            x = y
+        if out is not None:
+            return out
+        return x[0].copy() if single else x.copy()
+
+    def predict_batches(self, voltages, batch_size=256):
+        '''predictions for many recordings, (N, nin) array or iterable of (nin,) traces, run batch_size at a time'''
+        voltages = np.asarray(voltages, dtype=float)
+        out = np.empty((len(voltages), self.layers[-1].nout))
+        for start in range(0, len(voltages), batch_size):
+            self.predict(voltages[start:start+batch_size], out[start:start+batch_size])
+        return out
+
+    def save(self, path):
+        '''writes the layer sizes, weights and biases to a compressed .npz file'''
+        arrays = {'sizes': np.array([self.layers[0].nin] + [layer.nout for layer in self.layers])}
+        for i, layer in enumerate(self.layers):
+            arrays['W%d' % i] = layer.W
+            arrays['b%d' % i] = layer.b
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        '''network saved with save'''
+        with np.load(path) as f:
+            sizes = [int(n) for n in f['sizes']]
+            NN = cls(sizes[0], sizes[1:])
+            for i, layer in enumerate(NN.layers):
+                layer.W = f['W%d' % i]
+                layer.b = f['b%d' % i]
+        return NN
+
+    def parameters(self):
+        return [p for layer in self.layers for p in layer.parameters()]
+
+    def gradients(self):
+        return [g for layer in self.layers for g in layer.gradients()]
+
+
+def mean_squared_loss(stim, stim_pred):
+    stim = np.asarray(stim, dtype=float)
+    return np.mean((stim - stim_pred)**2)
+
+def forward(ML_instance, stim, voltage, loss_func=mean_squared_loss):
+    NN = ML_instance
+    stim_pred = NN(voltage, stim)
+    loss = loss_func(stim, stim_pred)
+    print('loss: ' + str(loss))
+    return stim_pred, loss
+
+def backward(ML_instance):
+    NN = ML_instance
+    NN.backward() #go back and adjust params; do not return anything
+
+def configure(ML_instance, optimizer=None, schedule=None, clip=None):
+    '''sets the optimizer (name or NNoptim instance) and gradient clipping of the network, a schedule needs an optimizer
+    so plain gradient descent (NNoptim.sgd) is set when it has none'''
+    NN = ML_instance
+    if optimizer is not None:
+        NN.optimizer = NNoptim.get_optimizer(optimizer)
+    if schedule is not None and NN.optimizer is None:
+        NN.optimizer = NNoptim.sgd()
+    if clip is not None:
+        NN.clip = clip
+
+#function the user will run to run/train neural network, stim and voltage may be single traces or batches
+#optimizer: 'sgd', 'momentum', 'rmsprop', 'adam' or an NNoptim instance; schedule: NNoptim schedule called every iteration
+#clip: maximum global gradient norm
+def Run_NN(ML_instance, stim, voltage, error_thresh=.1, iter_lim=100, loss=1000, optimizer=None, schedule=None, clip=None):
+    NN = ML_instance
+    configure(NN, optimizer, schedule, clip)
+    count = 0
+    while (loss > error_thresh) and (count < iter_lim):
+        stim_pred, loss = forward(NN, stim, voltage)
+        backward(NN)
+        if schedule is not None:
+            schedule(NN.optimizer, loss)
+        count += 1
+    return stim_pred, loss
+
+#mini-batch training over (voltage, stim) batches, e.g. an NNdata.loader
+def train(ML_instance, batches, epochs=10, error_thresh=.1, verbose=True, optimizer=None, schedule=None, clip=None):
+    '''
+    Args:
+        ML_instance (Multilayers): network to train
+        batches (iterable): (voltage, stim) batches of shape (batch, nin), iterated once per epoch
+        epochs (int): maximum number of passes over the batches
+        error_thresh (float): stops once the mean loss of an epoch is below it
+        verbose (bool): prints the metrics of every epoch
+        optimizer, clip: see Run_NN
+        schedule: NNoptim schedule called after every epoch with the epoch loss
+    Returns:
+        history (list): per epoch dict of the mean loss, batch and sample counts and wall time
+    '''
+    NN = ML_instance
+    configure(NN, optimizer, schedule, clip)
+    history = []
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        total = 0.0
+        n_batches = n_samples = 0
+        for voltage, stim in batches:
+            stim_pred = NN(voltage, stim)
+            total += mean_squared_loss(stim, stim_pred)*len(stim)
+            NN.backward()
+            n_batches += 1
+            n_samples += len(stim)
+        history.append({'epoch': epoch, 'loss': total/max(n_samples, 1), 'batches': n_batches, 'samples': n_samples,
+                        'time': time.perf_counter() - start})
+        if verbose:
+            print('epoch %d: loss %.6g over %d samples (%.2f s)' % (epoch, history[-1]['loss'], n_samples, history[-1]['time']))
+        if schedule is not None:
+            schedule(NN.optimizer, history[-1]['loss'])
+        if history[-1]['loss'] < error_thresh:
+            break
+    return history
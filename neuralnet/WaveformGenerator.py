@@ -9,8 +9,17 @@
 #Import Packages
 
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.signal import gaussian
+
+#matplotlib and scipy are imported by the methods that use them, so importing this module
+#stays cheap and has no side effects (the example below only runs as a script)
+
+def gaussian(M, std):
+    #scipy.signal.gaussian moved to scipy.signal.windows and was removed from scipy.signal in 1.13
+    try:
+        from scipy.signal.windows import gaussian as window
+    except ImportError:
+        from scipy.signal import gaussian as window
+    return window(M, std=std)
 
 #The class waveform is used to return voltage and time data of a waveform we 
 #wish to use in an experiment. The initialization of the waveform object
@@ -37,16 +46,8 @@ class Waveform:
 
     #The square wave method also allows you to define a duty cycle
     def square_wave(self, frequency, amplitude, duty_cycle=0.5):
-        periods = int(self.duration * frequency)
-        samples_per_period = int(self.sampling_rate / frequency)
-        on_samples = int(samples_per_period * duty_cycle)
-
-        square_wave = np.zeros(len(self.time))
-        for i in range(periods):
-            start = i * samples_per_period
-            square_wave[start:start + on_samples] = amplitude
-
-        self.voltage_data = square_wave
+        self.voltage_data = amplitude * _square(len(self.time), self.duration, self.sampling_rate,
+                                                np.array([frequency]), np.array([duty_cycle]))[0]
 
     #Returns a basic triangle wave of set frequency and amplitude
     def triangular_wave(self, frequency, amplitude):
@@ -70,25 +71,120 @@ class Waveform:
     def plot_waveform(self, title="Waveform"):
         if self.voltage_data is None:
             raise ValueError("Waveform data has not been generated yet. Call a waveform generation method first.")
+        import matplotlib.pyplot as plt
         plt.plot(self.time, self.voltage_data)
         plt.title(title)
         plt.xlabel("Time (s)")
         plt.ylabel("Voltage")
         plt.show()
 
-# Example usage:
-waveform_generator = Waveform(duration=2, sampling_rate=1000)
+#Shared by Waveform and WaveformBank: rows of unit square waves, the first `on` samples of every
+#full period are 1 (the vectorized form of filling each period in a loop)
+def _square(n, duration, sampling_rate, frequencies, duty_cycles):
+    periods = (duration * frequencies).astype(int)[:, None]
+    samples_per_period = (sampling_rate / frequencies).astype(int)[:, None]
+    on_samples = (samples_per_period * duty_cycles[:, None]).astype(int)
+    idx = np.arange(n)[None, :]
+    return ((idx % samples_per_period < on_samples) & (idx < periods * samples_per_period)).astype(float)
 
-# Generate a Gaussian pulse with FWHM in seconds
-waveform_generator.gaussian_pulse(amplitude=1, fwhm_seconds=1)
 
-# Get the waveform data
-waveform_data = waveform_generator.get_waveform_data()
-print("Gaussian Pulse Data:")
-print(waveform_data)
+#The WaveformBank holds whole grids of candidate waveforms as the rows of one 2d array
+#and fits a signal against all of them at once. The squared error of every template at
+#every circular shift follows from one batched FFT cross-correlation (a matched filter),
+#instead of generating and fitting one candidate at a time.
 
-# Plot the Gaussian pulse
-waveform_generator.plot_waveform(title="Gaussian Pulse")
+class WaveformBank:
+    def __init__(self, duration=1, sampling_rate=1000):
+        self.duration = duration
+        self.sampling_rate = sampling_rate
+        self.time = np.linspace(0, duration, int(duration * sampling_rate), endpoint=False)
+        self.templates = np.empty((0, len(self.time)))
+        self.params = [] #one dict per template row
+
+    def add(self, form, templates, params):
+        self.templates = np.vstack((self.templates, templates))
+        self.params.extend(dict(p, form=form) for p in params)
+
+    #Every combination of the given parameters; amplitudes=None adds unit templates whose
+    #amplitude is then solved for in fit (least squares at every shift)
+    def sine_waves(self, frequencies, amplitudes=None):
+        f, a = self._grid(frequencies, amplitudes)
+        self.add('sine_wave', np.nan_to_num(a, nan=1.0)[:, None] * np.sin(2 * np.pi * f[:, None] * self.time),
+                 [{'frequency': float(fi), 'amplitude': float(ai)} for fi, ai in zip(f, a)])
+
+    def square_waves(self, frequencies, amplitudes=None, duty_cycles=(0.5,)):
+        f, a, d = self._grid(frequencies, amplitudes, duty_cycles)
+        self.add('square_wave', np.nan_to_num(a, nan=1.0)[:, None] * _square(len(self.time), self.duration, self.sampling_rate, f, d),
+                 [{'frequency': float(fi), 'amplitude': float(ai), 'duty_cycle': float(di)} for fi, ai, di in zip(f, a, d)])
+
+    def triangular_waves(self, frequencies, amplitudes=None):
+        f, a = self._grid(frequencies, amplitudes)
+        ft = f[:, None] * self.time
+        self.add('triangular_wave', np.nan_to_num(a, nan=1.0)[:, None] * np.abs(2 * (ft - np.floor(ft + 0.5))),
+                 [{'frequency': float(fi), 'amplitude': float(ai)} for fi, ai in zip(f, a)])
+
+    def gaussian_pulses(self, fwhms_seconds, amplitudes=None):
+        w, a = self._grid(fwhms_seconds, amplitudes)
+        #same pulse as Waveform.gaussian_pulse, centered at duration / 2
+        n = len(self.time)
+        std = w * 1000 / (2 * np.sqrt(2 * np.log(2)))
+        pulses = np.exp(-0.5 * ((np.arange(n) - (n - 1) / 2) / std[:, None])**2)
+        shift = int(self.duration / 2 * self.sampling_rate) - n // 2
+        self.add('gaussian_pulse', np.nan_to_num(a, nan=1.0)[:, None] * np.roll(pulses, shift, axis=1),
+                 [{'fwhm_seconds': float(wi), 'amplitude': float(ai)} for wi, ai in zip(w, a)])
+
+    def grid(self, frequencies, amplitudes=None, fwhms_seconds=(), duty_cycles=(0.5,)):
+        self.sine_waves(frequencies, amplitudes)
+        self.square_waves(frequencies, amplitudes, duty_cycles)
+        self.triangular_waves(frequencies, amplitudes)
+        if len(fwhms_seconds):
+            self.gaussian_pulses(fwhms_seconds, amplitudes)
+        return self
+
+    def _grid(self, *axes):
+        fixed = axes[1] is not None
+        axes = [np.asarray(axes[0], dtype=float), np.asarray(axes[1] if fixed else [np.nan], dtype=float)] + \
+               [np.asarray(ax, dtype=float) for ax in axes[2:]]
+        return [g.ravel() for g in np.meshgrid(*axes, indexing='ij')]
+
+    #Returns the best template, its circular shift in samples, the fitted waveform and its mean
+    #squared error, plus the error of every template at its best shift
+    def fit(self, signal):
+        x = np.asarray(signal, dtype=float)
+        if len(x) != len(self.time):
+            raise ValueError("signal must have one sample per time point of the bank")
+        n = len(x)
+        corr = np.fft.irfft(np.fft.rfft(x) * np.conj(np.fft.rfft(self.templates, axis=1)), n, axis=1)
+        energy = np.sum(self.templates**2, axis=1)[:, None]
+        free = np.array([np.isnan(p['amplitude']) for p in self.params])[:, None]
+        #unit templates are scaled by corr/energy, fixed amplitude templates keep theirs
+        safe = np.where(energy > 0, energy, 1.0)
+        sse = np.where(free, np.sum(x**2) - corr**2 / safe, np.sum(x**2) - 2 * corr + energy)
+        shifts = np.argmin(sse, axis=1)
+        mse = np.maximum(sse[np.arange(len(sse)), shifts], 0) / n
+        best = int(np.argmin(mse))
+        shift = int(shifts[best])
+        params = dict(self.params[best])
+        scale = corr[best, shift] / safe[best, 0] if free[best, 0] else 1.0
+        if free[best, 0]:
+            params['amplitude'] = float(scale)
+        return {'form': params.pop('form'), 'params': params, 'shift': shift, 'mse': float(mse[best]),
+                'waveform': scale * np.roll(self.templates[best], shift), 'errors': mse}
+
+if __name__ == '__main__':
+    # Example usage:
+    waveform_generator = Waveform(duration=2, sampling_rate=1000)
+
+    # Generate a Gaussian pulse with FWHM in seconds
+    waveform_generator.gaussian_pulse(amplitude=1, fwhm_seconds=1)
+
+    # Get the waveform data
+    waveform_data = waveform_generator.get_waveform_data()
+    print("Gaussian Pulse Data:")
+    print(waveform_data)
+
+    # Plot the Gaussian pulse
+    waveform_generator.plot_waveform(title="Gaussian Pulse")
 
 
 # In[ ]:
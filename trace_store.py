@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import zipfile
+import numpy as np
+
+# Binary cache of the sim_data traces. Each zipped CSV is converted once into a float64 .npy file
+# holding one row per column (time, voltage, stim) plus a JSON header, both named after the content
+# hash of the archive. Later loads memory map the .npy file, nothing is extracted and no CSV is parsed.
+# A changed archive gets a new hash and is converted again, stale entries can be removed with clear().
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(ROOT, 'sim_data')
+CACHE_DIR = os.environ.get('TRACE_CACHE', os.path.join(DATA_DIR, '.trace_cache'))
+
+#content hash of every archive seen by this process, keyed on (path, size, mtime) so repeated loads skip the hashing
+_hashes = {}
+
+
+def archive_path(name):
+    '''path of a bundled archive from its name ('gt_1a' or 'gt_1a.zip'), other paths are returned unchanged'''
+    if os.path.exists(name):
+        return name
+    return os.path.join(DATA_DIR, name if name.endswith('.zip') else name + '.zip')
+
+
+def archive_hash(path):
+    '''sha256 of the archive bytes'''
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        _hashes[key] = digest.hexdigest()
+    return _hashes[key]
+
+
+def _read_csv(path):
+    '''columns of the first member of a zipped CSV, read straight from the archive'''
+    import pandas as pd
+    with zipfile.ZipFile(path, 'r') as zip_ref:
+        member = zip_ref.namelist()[0]
+        with zip_ref.open(member) as csv_file:
+            df = pd.read_csv(csv_file)
+    return member, {c: df[c].to_numpy(dtype = float) for c in df.columns}
+
+
+def write(key, columns, header = None, cache_dir = None):
+    '''stores equally long columns under key as <key>.npy plus <key>.json
+    Args:
+        key (str): file name stem inside the cache
+        columns (dict): column name -> 1d array
+        header (dict): extra metadata saved in the JSON header
+        cache_dir (str): defaults to CACHE_DIR
+    Returns:
+        header (dict): the header as written
+    '''
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok = True)
+    names = list(columns)
+    block = np.vstack([np.asarray(columns[c], dtype = float) for c in names])
+    header = dict(header or {}, key = key, columns = names, n_samples = block.shape[1], dtype = 'float64')
+    # write to temporary names and rename, so concurrent jobs never see a half written entry
+    tmp = os.path.join(cache_dir, '%s.%d.tmp' % (key, os.getpid()))
+    with open(tmp + '.npy', 'wb') as f:
+        np.save(f, block)
+    with open(tmp + '.json', 'w') as f:
+        json.dump(header, f, indent = 1)
+    os.replace(tmp + '.npy', os.path.join(cache_dir, key + '.npy'))
+    os.replace(tmp + '.json', os.path.join(cache_dir, key + '.json'))
+    return header
+
+
+def read(key, cache_dir = None):
+    '''memory mapped columns and header of a cache entry
+    Returns:
+        columns (dict): column name -> read only memmap view
+        header (dict)
+    '''
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    with open(os.path.join(cache_dir, key + '.json')) as f:
+        header = json.load(f)
+    block = np.load(os.path.join(cache_dir, key + '.npy'), mmap_mode = 'r')
+    return dict(zip(header['columns'], block)), header
+
+
+def load(name, cache_dir = None):
+    '''columns of a zipped trace, converting the archive into the cache on first use
+    Args:
+        name (str): archive name in sim_data ('hh_1ap', 'gt_1a_100', ...) or path to a zipped CSV
+        cache_dir (str): defaults to sim_data/.trace_cache, or the TRACE_CACHE environment variable
+    Returns:
+        columns (dict): 'time', 'voltage' and 'stim' as read only memmap arrays
+    '''
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    path = archive_path(name)
+    key = archive_hash(path)
+    if not os.path.exists(os.path.join(cache_dir, key + '.json')):
+        member, columns = _read_csv(path)
+        write(key, columns, {'archive': os.path.basename(path), 'member': member}, cache_dir)
+    return read(key, cache_dir)[0]
+
+
+def load_trace(name, cache_dir = None):
+    '''t_data, V_data, I_data of a zipped trace, see load'''
+    columns = load(name, cache_dir)
+    return columns['time'], columns['voltage'], columns['stim']
+
+
+def clear(cache_dir = None):
+    '''removes leftover temporary files and converted archives that no longer match an archive in sim_data'''
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if not os.path.isdir(cache_dir):
+        return
+    live = {archive_hash(os.path.join(DATA_DIR, f)) for f in os.listdir(DATA_DIR) if f.endswith('.zip')}
+    for f in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, f)
+        if f.endswith('.tmp.npy') or f.endswith('.tmp.json'):
+            os.remove(path)
+        elif f.endswith('.json'):
+            with open(path) as h:
+                header = json.load(h)
+            if 'archive' in header and header['key'] not in live:
+                os.remove(path)
+                os.remove(os.path.join(cache_dir, header['key'] + '.npy'))
@@ -0,0 +1,163 @@
+import numpy as np
+import trace_store
+
+# Windowed reading of long voltage recordings. A recording is read in blocks of a fixed number of
+# samples and cut into windows, either of a fixed length with some overlap or around every stimulus,
+# so at most one window plus one block is held in memory. recover_windows fits one window at a time and
+# carries the simulated state at the start of each window over from the fit of the previous one, for
+# overlapping windows as well as for contiguous ones starting at the sample after the previous window.
+
+
+def read_blocks(source, block_size = 100000):
+    '''columns of a recording in consecutive blocks
+    Args:
+        source (str or dict): trace store name ('hh_multap'), path to a zipped or plain CSV with time, voltage
+                              and stim columns, or a dict of equally long arrays (e.g. memory maps)
+        block_size (int): samples per block
+    Returns:
+        blocks (generator): (t, V, I) arrays of at most block_size samples
+    '''
+    if isinstance(source, dict):
+        columns = source
+    elif str(source).endswith('.csv'):
+        columns = None
+    else:
+        columns = trace_store.load(source)
+    if columns is not None:
+        # memory mapped columns, only the sliced block is read from disk
+        t, V, I = columns['time'], columns['voltage'], columns['stim']
+        for start in range(0, len(t), block_size):
+            stop = start + block_size
+            yield np.array(t[start:stop]), np.array(V[start:stop]), np.array(I[start:stop])
+        return
+    import pandas as pd
+    for df in pd.read_csv(source, chunksize = block_size):
+        yield df['time'].to_numpy(dtype = float), df['voltage'].to_numpy(dtype = float), df['stim'].to_numpy(dtype = float)
+
+
+class window:
+    def __init__(self, t_data, V_data, I_data, start, event = None):
+        '''
+        one window of a long recording
+        Args:
+            t_data, V_data, I_data (arrays): samples of the window, times are those of the recording
+            start (int): index of the first sample in the recording
+            event (int): index in the recording of the stimulus onset the window was cut around, if any
+        '''
+        self.t_data = t_data
+        self.V_data = V_data
+        self.I_data = I_data
+        self.start = start
+        self.event = event
+
+    def __len__(self):
+        return len(self.t_data)
+
+    @property
+    def dt(self):
+        return self.t_data[1] - self.t_data[0]
+
+    @property
+    def stim_center(self):
+        '''center of the stimulus in the window, computed like retrieve_file.load, None without stimulus'''
+        impulse = np.flatnonzero(self.I_data != 0.0)
+        if not len(impulse):
+            return None
+        return float(self.t_data[round((impulse[-1] - impulse[0])/2) + impulse[0]])
+
+
+def fixed_windows(blocks, length, overlap = 0.0):
+    '''windows of a fixed duration, consecutive windows share overlap ms of samples
+    Args:
+        blocks (iterable): (t, V, I) blocks, e.g. read_blocks(source)
+        length (float): window duration (ms)
+        overlap (float): duration (ms) shared by consecutive windows, smaller than length
+    Returns:
+        windows (generator): window objects, the last one may be shorter
+    '''
+    buffer = None
+    start = 0
+    n = hop = None
+    for block in blocks:
+        buffer = block if buffer is None else tuple(np.concatenate(pair) for pair in zip(buffer, block))
+        if n is None:
+            dt = buffer[0][1] - buffer[0][0]
+            n = int(round(length / dt)) + 1
+            hop = n - int(round(overlap / dt))
+            if hop < 1:
+                raise ValueError('overlap must be shorter than the window length')
+        while len(buffer[0]) >= n:
+            yield window(*(c[:n] for c in buffer), start)
+            buffer = tuple(c[hop:] for c in buffer)
+            start += hop
+    # remainder, skipped when it is already contained in the previous window
+    if buffer is not None and len(buffer[0]) > 1 and (start == 0 or len(buffer[0]) > n - hop):
+        yield window(*buffer, start)
+
+
+def event_windows(blocks, pre, post):
+    '''windows around every stimulus onset, i.e. where the stim column turns non zero
+    Args:
+        blocks (iterable): (t, V, I) blocks, e.g. read_blocks(source)
+        pre (float): duration (ms) kept before the onset
+        post (float): duration (ms) kept after the onset
+    Returns:
+        windows (generator): window objects with event set to the onset index, windows of close onsets overlap
+    '''
+    buffer = None
+    offset = 0        # recording index of buffer[0]
+    pending = []      # onsets whose window is not complete yet
+    n_pre = n_post = None
+    last = 0.0        # stim value before the buffer, so onsets on block boundaries are found
+    for block in blocks:
+        t, V, I = block
+        if n_pre is None:
+            dt = t[1] - t[0]
+            n_pre, n_post = int(round(pre / dt)), int(round(post / dt))
+        on = np.flatnonzero((np.concatenate(([last], I[:-1])) == 0.0) & (I != 0.0))
+        last = I[-1]
+        size = 0 if buffer is None else len(buffer[0])
+        pending.extend(offset + size + on)
+        buffer = block if buffer is None else tuple(np.concatenate(pair) for pair in zip(buffer, block))
+        end = offset + len(buffer[0])
+        while pending and pending[0] + n_post < end:
+            onset = pending.pop(0)
+            lo = max(onset - n_pre, 0)
+            yield window(*(c[lo - offset:onset + n_post + 1 - offset] for c in buffer), int(lo), int(onset))
+        # drop samples no window needs any more
+        keep = min([p - n_pre for p in pending] + [end - n_pre])
+        if keep > offset:
+            buffer = tuple(c[keep - offset:] for c in buffer)
+            offset = keep
+    for onset in pending:
+        lo = max(onset - n_pre, 0)
+        yield window(*(c[lo - offset:] for c in buffer), int(lo), int(onset))
+
+
+def recover_windows(windows, make_solver, x0 = None, warm_start = None):
+    '''fits windows one at a time
+    Args:
+        windows (iterable): window objects, e.g. fixed_windows(read_blocks('hh_multap'), 100.0, 10.0)
+        make_solver (function): make_solver(window, state) returns the stim_adj or param_adj instance of the window,
+                                state is the simulated (V, m, h, n) at the first sample of the window carried over
+                                from the previous fit, None for the first window or after a gap; pass it on as
+                                init_state, e.g. stim_adj(w.V_data, w.t_data, dt, HH_params, a, c, b = w.stim_center, init_state = state)
+        x0 (array): starting point of the first fit, later fits start from the optimum of the previous window
+        warm_start (function): warm_start(x, state) returns the starting point from the previous optimum and the carried
+                               state, e.g. to replace the initial gates m, h, n of a param_adj that fits them by state[1:]
+    Returns:
+        results (generator): (window, optim, solver) per window
+    '''
+    solver = None
+    x = x0
+    for w in windows:
+        state = None
+        # the state reaches one data step past the previous window, where a window without overlap starts
+        if solver is not None and w.t_data[0] <= solver.t_data[-1] + 1.5 * (solver.t_data[-1] - solver.t_data[-2]):
+            state = solver.state(x, w.t_data[0])
+        solver = make_solver(w, state)
+        if warm_start is not None and state is not None:
+            x = warm_start(x, state)
+        optim = solver.optimize(x)
+        x = optim.x
+        yield w, optim, solver